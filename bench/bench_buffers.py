@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+"""
+Measures the overhead of opening page buffers and switching between them,
+counted in calls from python into vim, which are what makes these operations
+slow in a real vim. Compares running the setup commands one by one with
+batching them through execute().
+
+    python bench/bench_buffers.py [buffers]
+"""
+
+from __future__ import print_function
+
+import io
+import os
+import sys
+import time
+import contextlib
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'plugin'))
+sys.path.insert(0, here)
+
+import vim  # noqa: E402  (the stub from this directory)
+import dokuvimki  # noqa: E402
+
+
+def make_dokuvimki():
+    vim.reset()
+    dw = dokuvimki.DokuVimKi.__new__(dokuvimki.DokuVimKi)
+    dw.buffers = {}
+    dw.stats = dokuvimki.Stats()
+    dw.locks = set()
+    dw.lock_timer = None
+    dw.link_check = True
+    dw.timers = False
+    dw.worker = None
+    dw.offline = True
+    dw.page_index = dokuvimki.PageIndex(os.devnull)
+    return dw
+
+
+def open_pages(dw, count):
+    text = '====== page ======\n\n' + 'some text\n' * 100
+    for i in range(count):
+        wp = 'bench:page%d' % i
+        dw.edit_loaded(wp, None, 8, text, {'locked': [wp]}, None)
+
+
+def switch_pages(dw, count):
+    for i in range(count):
+        wp = 'bench:page%d' % i
+        dw.buffer_leave(wp)
+        dw.buffer_enter(wp)
+
+
+def measure(func, *args):
+    calls = vim.calls
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        func(*args)
+    return vim.calls - calls, (time.perf_counter() - start) * 1000
+
+
+def main(count):
+    print('%-10s %16s %16s %16s %16s' % ('', 'open [calls]', 'open [ms]', 'switch [calls]', 'switch [ms]'))
+    for name, execute in [('single', None), ('batched', vim.Function('execute'))]:
+        dokuvimki.vim_execute = execute
+        dw = make_dokuvimki()
+        open_calls, open_time = measure(open_pages, dw, count)
+        switch_calls, switch_time = measure(switch_pages, dw, count)
+        print('%-10s %16.1f %16.3f %16.1f %16.3f' % (name, open_calls / float(count), open_time / count,
+                                                     switch_calls / float(count), switch_time / count))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100)
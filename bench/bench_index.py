@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+"""
+Measures the latency of DWcd (DokuVimKi.cd) for growing page indexes.
+
+The synthetic wiki has 20 top level namespaces with 50 sub namespaces each,
+so listing a top level namespace yields the same 50 entries at every size and
+its latency should stay flat.
+
+    python bench/bench_index.py [sizes...]
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import tempfile
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'plugin'))
+sys.path.insert(0, here)
+
+import vim  # noqa: E402  (the stub from this directory)
+import dokuvimki  # noqa: E402
+
+
+def page_ids(count):
+    return ['ns%d:sub%d:page%d' % (i % 20, (i // 20) % 50, i) for i in range(count)]
+
+
+def make_dokuvimki(count, cache_dir):
+    vim.reset()
+    dw = dokuvimki.DokuVimKi.__new__(dokuvimki.DokuVimKi)
+    dw.buffers = {'index': dokuvimki.Buffer('index', 'nofile')}
+    dw.stats = dokuvimki.Stats()
+    dw.index_winwith = '30'
+    dw.cur_ns = ''
+    dw.page_index = dokuvimki.PageIndex(os.path.join(cache_dir, 'index.json'))
+    dw.page_index.set_pages(page_ids(count))
+    dw.pages = sorted(dw.page_index.pages)
+    return dw
+
+
+def measure(func, repeat=20):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000
+
+
+def main(sizes):
+    cache_dir = tempfile.mkdtemp(prefix='dokuvimki-bench-')
+    print('%10s %12s %12s %12s' % ('pages', 'build [ms]', 'DWcd / [ms]', 'DWcd ns3 [ms]'))
+    for count in sizes:
+        start = time.perf_counter()
+        dw = make_dokuvimki(count, cache_dir)
+        build = (time.perf_counter() - start) * 1000
+        root = measure(lambda: dw.cd(''))
+        ns = measure(lambda: dw.cd('ns3'))
+        print('%10d %12.1f %12.3f %12.3f' % (count, build, root, ns))
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000, 500000])
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+"""
+Measures the latency of the everyday operations of DokuVimKi and its memory
+use against the fake wiki, for growing wikis. Every size runs in a fresh
+interpreter with an empty cache; requests run synchronously so every
+operation is timed until its result has been shown.
+
+    python bench/bench_ops.py [--pages 1000 10000 100000 500000]
+                              [--media N] [--revisions N] [--page-size BYTES]
+                              [--latency MS] [--repeat N] [--json]
+
+Latencies are medians in milliseconds, memory is the size of the python
+objects allocated by DokuVimKi in megabytes (after startup and peak) and
+the peak resident size of the process.
+"""
+
+from __future__ import print_function
+
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import resource
+import subprocess
+import contextlib
+import tracemalloc
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'plugin'))
+sys.path.insert(0, here)
+
+OPERATIONS = [
+    ('startup', 'DokuVimKi with a cold cache [ms]'),
+    ('refresh', 'DWrefresh, nothing changed [ms]'),
+    ('refresh!', 'DWrefresh!, full rebuild [ms]'),
+    ('index', 'DWcd into a namespace [ms]'),
+    ('complete', 'completing a page id [ms]'),
+    ('complete fuzzy', 'completing a page id fuzzily [ms]'),
+    ('edit', 'DWedit of an uncached page [ms]'),
+    ('edit cached', 'DWedit of a cached page [ms]'),
+    ('save', 'DWsave of a changed page [ms]'),
+    ('search', 'DWsearch [ms]'),
+    ('search!', 'DWsearch!, full-text [ms]'),
+    ('search! cached', 'DWsearch!, repeated [ms]'),
+    ('memory', 'python objects after startup [MB]'),
+    ('memory peak', 'python objects, peak [MB]'),
+    ('rss', 'peak resident size [MB]'),
+]
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return (time.perf_counter() - start) * 1000
+
+
+def child(args):
+    import vim  # the stub from this directory
+
+    vim.variables['g:DokuVimKi_URL'] = args.url
+    vim.variables['g:DokuVimKi_CACHE_DIR'] = args.cache
+    vim.variables['g:DokuVimKi_PREFETCH_REVISIONS'] = '0'
+
+    import dokuvimki
+
+    result = {}
+    repeat = range(args.repeat)
+    pages = ['ns%d:sub%d:page%d' % (i % 20, (i // 20) % 50, i) for i in range(args.pages[0])]
+    step = max(1, len(pages) // (2 * args.repeat + 1))
+    samples = iter(pages[::step])
+
+    tracemalloc.start()
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        start = time.perf_counter()
+        dokuvimki.dokuvimki = dw = dokuvimki.DokuVimKi()
+        result['startup'] = (time.perf_counter() - start) * 1000
+        result['memory'] = tracemalloc.get_traced_memory()[0] / 2.0 ** 20
+
+        result['refresh'] = median([timed(dw.refresh) for i in repeat])
+        result['refresh!'] = median([timed(lambda: dw.refresh(True)) for i in repeat])
+        result['index'] = median([timed(lambda: dw.cd('ns%d:sub%d' % (i % 20, i % 50))) for i in repeat])
+
+        result['complete'] = median([timed(lambda: dw.complete('pages', 'ns%d:sub%d' % (i % 20, i))) for i in repeat])
+        dw.complete_fuzzy = True
+        result['complete fuzzy'] = median([timed(lambda: dw.complete('pages', 'n%dsb%d' % (i % 20, i))) for i in repeat])
+        dw.complete_fuzzy = False
+
+        opened = []
+        edits = []
+        for i in repeat:
+            wp = next(samples)
+            edits.append(timed(lambda: dw.edit(wp)))
+            opened.append(wp)
+        result['edit'] = median(edits)
+
+        saves = []
+        for wp in opened:
+            dw.edit(wp)
+            buf = dw.buffers[wp].buf
+            buf[:] = list(buf) + ['changed at %f' % time.time()]
+            saves.append(timed(lambda: dw.save('bench')))
+        result['save'] = median(saves)
+
+        for wp in opened:
+            dw.close(wp)
+        result['edit cached'] = median([timed(lambda: dw.edit(wp)) for wp in opened])
+
+        result['search'] = median([timed(lambda: dw.search('page', 'page%d' % i)) for i in repeat])
+        result['search!'] = median([timed(lambda: dw.search('page', 'word%d' % i, True)) for i in repeat])
+        result['search! cached'] = median([timed(lambda: dw.search('page', 'word%d' % i, True)) for i in repeat])
+
+    result['memory peak'] = tracemalloc.get_traced_memory()[1] / 2.0 ** 20
+    tracemalloc.stop()
+
+    # ru_maxrss is in kilobytes on linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result['rss'] = rss / 2.0 ** (20 if sys.platform == 'darwin' else 10)
+
+    print(json.dumps(result))
+
+
+def run(args, url, cache, pages):
+    output = subprocess.check_output([sys.executable, __file__, '--child', '--url', url, '--cache', cache,
+                                      '--pages', str(pages), '--repeat', str(args.repeat)])
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def main(args):
+    import fakewiki
+
+    results = {}
+    for pages in args.pages:
+        media = pages // 10 if args.media is None else args.media
+        wiki = fakewiki.Wiki(pages, media, args.revisions, args.page_size)
+        server = fakewiki.serve(wiki, latency=args.latency / 1000.0)
+        url = 'http://127.0.0.1:%d' % server.server_address[1]
+
+        cache = tempfile.mkdtemp(prefix='dokuvimki-bench-')
+        try:
+            results[pages] = run(args, url, cache, pages)
+        finally:
+            shutil.rmtree(cache)
+            server.shutdown()
+            server.server_close()
+
+    if args.json:
+        print(json.dumps({'latency': args.latency, 'results': results}, indent=2, sort_keys=True))
+        return
+
+    print('latency %.0f ms, %d revisions, %d bytes per page' % (args.latency, args.revisions, args.page_size))
+    print('%-36s' % 'pages' + ''.join('%12d' % pages for pages in args.pages))
+    for key, label in OPERATIONS:
+        print('%-36s' % label + ''.join('%12.1f' % results[pages][key] for pages in args.pages))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, nargs='+', default=[1000, 10000, 100000, 500000])
+    parser.add_argument('--media', type=int, help='number of media files (default pages / 10)')
+    parser.add_argument('--revisions', type=int, default=2)
+    parser.add_argument('--page-size', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0, help='per request latency in ms')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', action='store_true', help='print the results as json')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--url', help=argparse.SUPPRESS)
+    parser.add_argument('--cache', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args)
+    else:
+        main(args)
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+"""
+Measures building the local full-text index (SearchIndex) and querying it
+for growing numbers of pages: a rare term, a common term, two terms and a
+phrase. The texts are those of the fake wiki.
+
+    python bench/bench_search.py [sizes...]
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import tempfile
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'plugin'))
+sys.path.insert(0, here)
+
+import vim  # noqa: E402,F401  (the stub from this directory)
+import dokuvimki  # noqa: E402
+import fakewiki  # noqa: E402
+
+QUERIES = [
+    ('rare', 'page4711'),
+    ('common', 'word500'),
+    ('two terms', 'word500 word501'),
+    ('phrase', '"word500 word501"'),
+]
+
+
+def measure(func, repeat=20):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000
+
+
+def main(sizes):
+    cache_dir = tempfile.mkdtemp(prefix='dokuvimki-bench-')
+    print('%10s %12s %12s' % ('pages', 'build [ms]', 'load [ms]') + ''.join('%14s' % (name + ' [ms]') for name, query in QUERIES))
+    for count in sizes:
+        wiki = fakewiki.Wiki(0, 0)
+        texts = dict((fakewiki.Wiki.page_id(i), wiki.text(fakewiki.Wiki.page_id(i), i, 0, 500, count))
+                     for i in range(count))
+
+        filename = os.path.join(cache_dir, 'search%d.json' % count)
+        index = dokuvimki.SearchIndex(filename)
+        start = time.perf_counter()
+        for page, text in texts.items():
+            index.add(page, 1, text)
+        build = (time.perf_counter() - start) * 1000
+        index.save()
+
+        start = time.perf_counter()
+        dokuvimki.SearchIndex(filename).load()
+        load = (time.perf_counter() - start) * 1000
+
+        times = [measure(lambda: index.search(query, texts.get, 50)) for name, query in QUERIES]
+        print('%10d %12.1f %12.1f' % (count, build, load) + ''.join('%14.2f' % t for t in times))
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000])
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+"""
+Measures the startup of DokuVimKi against the fake wiki: the time to load
+the python part of the plugin, the time until :DokuVimKi returns and vim
+accepts the first keystroke, and the time until the page index is synced
+with the remote wiki. Every run happens in a fresh interpreter, with an
+empty (cold) or a previously filled (warm) cache, with and without
+background requests.
+
+    python bench/bench_startup.py [--pages N] [--latency MS]
+"""
+
+from __future__ import print_function
+
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+import contextlib
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'plugin'))
+sys.path.insert(0, here)
+
+
+def child(args):
+    import vim  # the stub from this directory
+
+    vim.variables['g:DokuVimKi_URL'] = args.url
+    vim.variables['g:DokuVimKi_CACHE_DIR'] = args.cache
+    vim.variables['g:DokuVimKi_ASYNC'] = str(args.async_requests)
+    vim.features['timers'] = bool(args.async_requests)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        import dokuvimki
+        loaded = time.perf_counter()
+        dokuvimki.dokuvimki = dw = dokuvimki.DokuVimKi()
+        ready = time.perf_counter()
+        vim.run_timers(dw, 120)
+        synced = time.perf_counter()
+
+    print(json.dumps({
+        'load': (loaded - start) * 1000,
+        'ready': (ready - start) * 1000,
+        'synced': (synced - start) * 1000,
+        'pages': len(dw.page_index.pages),
+    }))
+
+
+def run(url, cache, async_requests):
+    output = subprocess.check_output([sys.executable, __file__, '--child', '--url', url, '--cache', cache,
+                                      '--async', str(async_requests)])
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def main(args):
+    import fakewiki
+
+    server = fakewiki.serve(fakewiki.Wiki(args.pages, args.pages // 10), latency=args.latency / 1000.0)
+    url = 'http://127.0.0.1:%d' % server.server_address[1]
+
+    print('%d pages, latency %.0f ms' % (args.pages, args.latency))
+    print('%-16s %12s %12s %12s' % ('', 'load [ms]', 'ready [ms]', 'synced [ms]'))
+    for async_requests in (0, 1):
+        cache = tempfile.mkdtemp(prefix='dokuvimki-bench-')
+        try:
+            for state in ('cold', 'warm'):
+                result = run(url, cache, async_requests)
+                name = '%s %s' % ('async' if async_requests else 'sync', state)
+                print('%-16s %12.1f %12.1f %12.1f' % (name, result['load'], result['ready'], result['synced']))
+        finally:
+            shutil.rmtree(cache)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=10000)
+    parser.add_argument('--latency', type=float, default=50, help='per request latency in ms')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--url', help=argparse.SUPPRESS)
+    parser.add_argument('--cache', help=argparse.SUPPRESS)
+    parser.add_argument('--async', dest='async_requests', type=int, default=1, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args)
+    else:
+        main(args)
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compares the per-call latency of the stock dokuwikixmlrpc.DokuWikiClient with
+DokuVimKi's WikiClient against the fake wiki, which simulates the request
+latency and the cost of establishing a (TLS) connection.
+
+    python bench/bench_transport.py [--latency MS] [--handshake MS] [--calls N]
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import argparse
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, '..', 'plugin'))
+sys.path.insert(0, here)
+
+import vim  # noqa: E402,F401  (the stub from this directory)
+import fakewiki  # noqa: E402
+import dokuvimki  # noqa: E402
+import dokuwikixmlrpc  # noqa: E402
+
+
+def measure(server, factory, calls):
+    connections = server.connections
+
+    start = time.perf_counter()
+    client = factory()
+    created = time.perf_counter() - start
+
+    timings = []
+    for i in range(calls):
+        start = time.perf_counter()
+        client.acl_check('ns0:sub0:page0')
+        timings.append(time.perf_counter() - start)
+
+    timings.sort()
+    return {
+        'create': created * 1000,
+        'mean': sum(timings) / len(timings) * 1000,
+        'p95': timings[int(len(timings) * 0.95) - 1] * 1000,
+        'connections': server.connections - connections,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--latency', type=float, default=20, help='per request latency in ms')
+    parser.add_argument('--handshake', type=float, default=60, help='per connection latency in ms')
+    parser.add_argument('--calls', type=int, default=50)
+    args = parser.parse_args()
+
+    server = fakewiki.serve(fakewiki.Wiki(100, 10), latency=args.latency / 1000.0,
+                            handshake=args.handshake / 1000.0)
+    url = 'http://127.0.0.1:%d' % server.server_address[1]
+
+    clients = [
+        ('DokuWikiClient', lambda: dokuwikixmlrpc.DokuWikiClient(url, 'bench', 'bench')),
+        ('WikiClient', lambda: dokuvimki.WikiClient(url, 'bench', 'bench')),
+    ]
+
+    print('latency %.0f ms, handshake %.0f ms, %d calls' % (args.latency, args.handshake, args.calls))
+    print('%-16s %12s %12s %12s %12s' % ('client', 'create [ms]', 'mean [ms]', 'p95 [ms]', 'connections'))
+    for name, factory in clients:
+        result = measure(server, factory, args.calls)
+        print('%-16s %12.1f %12.1f %12.1f %12d' % (name, result['create'], result['mean'],
+                                                   result['p95'], result['connections']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+
+"""
+A local stand-in for the XML-RPC interface of DokuWiki, implementing the calls
+DokuVimKi uses on a synthetic wiki of configurable size. Every HTTP request
+can be delayed to simulate network latency.
+
+    python bench/fakewiki.py --pages 10000 --media 1000 --latency 50
+"""
+
+from __future__ import print_function
+
+import re
+import sys
+import time
+import hashlib
+import argparse
+import threading
+
+from xmlrpc.client import Binary, Fault
+from xmlrpc.server import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+from socketserver import ThreadingMixIn
+
+
+class Wiki(object):
+    """
+    The synthetic wiki: pages with a number of revisions, media files and a
+    changelog.
+    """
+
+    def __init__(self, pages=1000, media=100, revisions=3, page_size=2000):
+        self.lock = threading.Lock()
+        self.now = int(time.time())
+        self.pages = {}
+        self.revisions = {}
+        self.media = {}
+        self.changes = []
+        self.media_changes = []
+        self.locks = {}
+
+        for i in range(pages):
+            page = self.page_id(i)
+            revs = []
+            for r in range(revisions):
+                rev = self.now - (revisions - r) * 3600 - i
+                revs.append((rev, self.text(page, i, r, page_size, pages)))
+            self.revisions[page] = revs
+            self.pages[page] = revs[-1]
+
+        for i in range(media):
+            self.media['ns%d:image%d.png' % (i % 20, i)] = (self.now - i, b'\x89PNG' + b'\0' * 1000)
+
+    @staticmethod
+    def page_id(i):
+        return 'ns%d:sub%d:page%d' % (i % 20, (i // 20) % 50, i)
+
+    def text(self, page, i, rev, size, count):
+        links = ' '.join('[[%s]]' % self.page_id((i * 7 + k) % count) for k in range(1, 4))
+        words = ' '.join('word%d' % ((i + k) % 997) for k in range(size // 8))
+        return '====== %s ======\n\nRevision %d links to %s.\n\n%s\n' % (page, rev, links, words)
+
+    def info(self, page, rev=None):
+        for version, text in reversed(self.revisions.get(page, [])):
+            if rev is None or version == rev:
+                return {'name': page, 'lastModified': version, 'author': 'bench',
+                        'version': version, 'size': len(text)}
+        raise Fault(121, 'The requested page does not exist')
+
+
+class Handler(SimpleXMLRPCRequestHandler):
+    # accept the ?u=...&p=... credentials DokuWikiClient appends to the path
+    rpc_paths = ()
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        # a new connection, optionally pay for a (simulated) TLS handshake
+        self.server.connections += 1
+        if self.server.handshake:
+            time.sleep(self.server.handshake)
+        SimpleXMLRPCRequestHandler.setup(self)
+
+    def do_POST(self):
+        self.server.requests += 1
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        SimpleXMLRPCRequestHandler.do_POST(self)
+
+    def do_GET(self):
+        body = b'XML-RPC server accepts POST requests only.'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class Server(ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+
+
+def serve(wiki, host='127.0.0.1', port=0, latency=0.0, handshake=0.0):
+    """
+    Starts a server for wiki in a background thread and returns it, its URL
+    is http://host:port with port = server.server_address[1]. Every request
+    is delayed by latency seconds, every new connection by handshake seconds.
+    """
+
+    server = Server((host, port), requestHandler=Handler, logRequests=False, allow_none=True)
+    server.wiki = wiki
+    server.latency = latency
+    server.handshake = handshake
+    server.connections = 0
+    server.requests = 0
+    server.calls = 0
+
+    def expose(name, func):
+        def wrapper(*args):
+            server.calls += 1
+            with wiki.lock:
+                return func(*args)
+        server.register_function(wrapper, name)
+
+    def get_page(page):
+        return wiki.pages.get(page, (0, ''))[1]
+
+    def get_page_version(page, rev):
+        for version, text in wiki.revisions.get(page, []):
+            if version == rev:
+                return text
+        return ''
+
+    def get_page_versions(page, offset):
+        return [{'user': 'bench', 'ip': '127.0.0.1', 'type': 'E', 'sum': 'edit',
+                 'modified': version, 'version': version}
+                for version, text in reversed(wiki.revisions.get(page, [])[:-1])][offset:]
+
+    def put_page(page, text, params):
+        now = max(int(time.time()), wiki.now + 1)
+        wiki.now = now
+        if text:
+            wiki.revisions.setdefault(page, []).append((now, text))
+            wiki.pages[page] = (now, text)
+        else:
+            wiki.pages.pop(page, None)
+        wiki.changes.append({'name': page, 'lastModified': now, 'author': 'bench',
+                             'version': now, 'size': len(text)})
+        return True
+
+    def recent_changes(timestamp):
+        changes = [c for c in wiki.changes if c['version'] >= timestamp]
+        if not changes:
+            raise Fault(321, 'There are no changes in the specified timeframe')
+        return changes
+
+    def recent_media_changes(timestamp):
+        changes = [c for c in wiki.media_changes if c['version'] >= timestamp]
+        if not changes:
+            raise Fault(321, 'There are no changes in the specified timeframe')
+        return changes
+
+    def get_attachments(ns, options):
+        ns = ns.strip(':')
+        prefix = ns + ':' if ns else ''
+        result = []
+        for media, (mtime, data) in wiki.media.items():
+            if not media.startswith(prefix):
+                continue
+            if not options.get('recursive') and ':' in media[len(prefix):]:
+                continue
+            result.append({'id': media, 'size': len(data), 'lastModified': mtime,
+                           'isimg': True, 'writable': True})
+        return result
+
+    def put_attachment(media, data, params):
+        now = int(time.time())
+        wiki.media[media] = (now, data.data)
+        wiki.media_changes.append({'name': media, 'lastModified': now, 'author': 'bench',
+                                   'version': now, 'size': len(data.data)})
+        return media
+
+    def set_locks(locks):
+        locked = []
+        lockfail = []
+        for page in locks.get('lock', []):
+            locked.append(page)
+            wiki.locks[page] = time.time()
+        unlocked = []
+        for page in locks.get('unlock', []):
+            if wiki.locks.pop(page, None):
+                unlocked.append(page)
+        return {'locked': locked, 'lockfail': lockfail, 'unlocked': unlocked, 'unlockfail': []}
+
+    def backlinks(page):
+        needle = '[[%s]]' % page
+        return [p for p, (version, text) in wiki.pages.items() if needle in text]
+
+    def search(query):
+        pattern = re.compile(re.escape(query), re.I)
+        result = []
+        for page, (version, text) in wiki.pages.items():
+            hits = len(pattern.findall(text))
+            if hits:
+                m = pattern.search(text)
+                result.append({'id': page, 'score': hits, 'rev': version, 'mtime': version,
+                               'size': len(text), 'title': page,
+                               'snippet': text[max(0, m.start() - 40):m.end() + 40]})
+        result.sort(key=lambda r: -r['score'])
+        return result
+
+    def pagelist(ns, opts):
+        prefix = ns.strip(':') + ':' if ns.strip(':') else ''
+        result = []
+        for page, (version, text) in wiki.pages.items():
+            if page.startswith(prefix):
+                item = {'id': page, 'rev': version, 'mtime': version, 'size': len(text)}
+                if opts.get('hash'):
+                    item['hash'] = hashlib.md5(text.encode('utf-8')).hexdigest()
+                result.append(item)
+        return result
+
+    expose('dokuwiki.getVersion', lambda: 'Fake DokuWiki')
+    expose('dokuwiki.getTime', lambda: int(time.time()))
+    expose('dokuwiki.setLocks', set_locks)
+    expose('dokuwiki.search', search)
+    expose('dokuwiki.getPagelist', pagelist)
+    expose('wiki.getAllPages', lambda: [{'id': p, 'perms': 8, 'size': len(t), 'lastModified': v}
+                                        for p, (v, t) in wiki.pages.items()])
+    expose('wiki.getAttachments', get_attachments)
+    expose('wiki.putAttachment', put_attachment)
+    expose('wiki.getRecentChanges', recent_changes)
+    expose('wiki.getRecentMediaChanges', recent_media_changes)
+    expose('wiki.aclCheck', lambda page: 8)
+    expose('wiki.getPage', get_page)
+    expose('wiki.getPageVersion', get_page_version)
+    expose('wiki.getPageVersions', get_page_versions)
+    expose('wiki.getPageInfo', lambda page: wiki.info(page))
+    expose('wiki.getPageInfoVersion', lambda page, rev: wiki.info(page, rev))
+    expose('wiki.putPage', put_page)
+    expose('wiki.getBackLinks', backlinks)
+    expose('wiki.getAttachment', lambda media: Binary(wiki.media[media][1]))
+    server.register_multicall_functions()
+
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--pages', type=int, default=1000)
+    parser.add_argument('--media', type=int, default=100)
+    parser.add_argument('--revisions', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=0, help='per request latency in ms')
+    parser.add_argument('--handshake', type=float, default=0, help='per connection latency in ms')
+    args = parser.parse_args()
+
+    wiki = Wiki(args.pages, args.media, args.revisions)
+    server = serve(wiki, port=args.port, latency=args.latency / 1000.0, handshake=args.handshake / 1000.0)
+    print('Serving %d pages at http://127.0.0.1:%d' % (len(wiki.pages), server.server_address[1]))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+
+"""
+Minimal stand-in for the vim python module, so DokuVimKi can be driven from a
+plain python interpreter for benchmarking. It records every command and
+implements just enough of the buffer/window handling DokuVimKi relies on.
+"""
+
+import os
+import re
+import sys
+
+variables = {
+    'v:version': '802',
+    'g:DokuVimKi_USER': 'bench',
+    'g:DokuVimKi_PASS': 'bench',
+    'g:DokuVimKi_URL': 'http://127.0.0.1:8080',
+    'g:DokuVimKi_HTTP_BASIC_AUTH': '',
+    'g:DokuVimKi_IMG_SUB_NS': '',
+    'g:DokuVimKi_INDEX_WINWIDTH': '30',
+    'g:DokuVimKi_DEFAULT_SUM': '[xmlrpc dokuvimki edit]',
+    'g:DokuVimKi_CACHE_DIR': '~/.cache/dokuvimki',
+    'g:DokuVimKi_INDEX_MAX_AGE': '6',
+    'g:DokuVimKi_CACHE_SIZE': '50',
+    'g:DokuVimKi_CACHE_MAX_AGE': '30',
+    'g:DokuVimKi_PREFETCH_REVISIONS': '5',
+    'g:DokuVimKi_PREFETCH_PAGES': '10',
+    'g:DokuVimKi_PREFETCH_RATE': '512',
+    'g:DokuVimKi_COMPLETE_MAX': '100',
+    'g:DokuVimKi_COMPLETE_FUZZY': '0',
+    'g:DokuVimKi_ASYNC': '0',
+    'g:DokuVimKi_POLL_INTERVAL': '50',
+    'g:DokuVimKi_TIMEOUT': '30',
+    'g:DokuVimKi_COMPRESS': '0',
+    'g:DokuVimKi_OFFLINE': '0',
+    'g:DokuVimKi_LOCK_INTERVAL': '600',
+    'g:DokuVimKi_UNLOCKED_NS': '',
+    'g:DokuVimKi_LINK_CHECK': '1',
+    'g:DokuVimKi_CHANGES_INTERVAL': '300',
+    'g:DokuVimKi_TRACE_FILE': '',
+    'g:DokuVimKi_SEARCH_PAGE_SIZE': '50',
+    'g:DokuVimKi_SEARCH_LOCAL': '0',
+    'g:DokuVimKi_UPLOAD_THREADS': '4',
+    'g:DokuVimKi_UPLOAD_MEMORY': '64',
+}
+
+features = {'timers': False}
+
+# active timers, id -> callback name (call them with run_timers())
+timers = {}
+
+commands = []
+
+# number of calls from python into vim
+calls = 0
+
+
+class error(Exception):
+    pass
+
+
+class Buffer(list):
+    def __init__(self, number, name):
+        list.__init__(self, [''])
+        self.number = number
+        self.name = name
+        self.vars = {}
+        self.autocmds = {}
+        self.options = {'modifiable': True, 'modified': False}
+        self.changedtick = 1
+
+    def __setitem__(self, key, value):
+        if isinstance(key, slice):
+            value = list(value) or ['']
+        list.__setitem__(self, key, value)
+        self.changedtick += 1
+
+
+class Buffers(dict):
+    def __iter__(self):
+        return iter(self.values())
+
+
+class Window(object):
+    def __init__(self, number):
+        self.number = number
+        self.cursor = (1, 0)
+        self.buffer = None
+        self.vars = {}
+        self.options = {}
+
+
+class Current(object):
+    def __init__(self):
+        self.windows = [Window(1), Window(2), Window(3)]
+        self.window = self.windows[0]
+
+    @property
+    def buffer(self):
+        return self.window.buffer
+
+    @property
+    def line(self):
+        return self.window.buffer[self.window.cursor[0] - 1]
+
+
+buffers = Buffers()
+current = Current()
+
+
+def reset():
+    """Forgets all buffers and recorded commands."""
+    global calls
+    calls = 0
+    del commands[:]
+    timers.clear()
+    buffers.clear()
+    current.__init__()
+
+
+def run_timers(dokuvimki, timeout=10.0):
+    """Runs the DokuVimKi poll timer until it is stopped."""
+    import time
+    deadline = time.time() + timeout
+    while 'DokuVimKiPoll' in timers.values() and time.time() < deadline:
+        dokuvimki.poll()
+        time.sleep(0.001)
+
+
+def _bufnr(name):
+    for buf in buffers:
+        if buf.name == name or buf.name.endswith(os.sep + name):
+            return buf.number
+    return -1
+
+
+def command(cmd):
+    global calls
+    calls += 1
+    _command(cmd)
+
+
+def _command(cmd):
+    commands.append(cmd)
+    cmd = cmd.strip()
+    while cmd.startswith('silent!') or cmd.startswith('silent '):
+        cmd = cmd.split(' ', 1)[1].strip()
+
+    m = re.match(r'badd (.*)$', cmd)
+    if m:
+        if _bufnr(m.group(1)) == -1:
+            number = len(buffers) + 1
+            # like vim, keep the full path of the buffer name
+            buffers[number] = Buffer(number, os.path.join(os.getcwd(), m.group(1)))
+        return
+
+    m = re.match(r'buffer!? (\d+)$', cmd)
+    if m:
+        current.window.buffer = buffers[int(m.group(1))]
+        return
+
+    # like vim, run the BufDelete autocmd of a buffer when it is deleted
+    m = re.match(r'autocmd! BufDelete <buffer> Py (.*)$', cmd)
+    if m and current.buffer is not None:
+        current.buffer.autocmds['BufDelete'] = m.group(1)
+        return
+
+    m = re.match(r'bdel!? (\d+)$', cmd)
+    if m:
+        buf = buffers.get(int(m.group(1)))
+        if buf is not None and 'BufDelete' in buf.autocmds:
+            exec(buf.autocmds.pop('BufDelete'), vars(sys.modules['dokuvimki']))
+        return
+
+    m = re.match(r'(\d+)wincmd w$', cmd)
+    if m:
+        current.window = current.windows[int(m.group(1)) - 1]
+        return
+
+    m = re.match(r'call timer_stop\((\d+)\)$', cmd)
+    if m:
+        timers.pop(int(m.group(1)), None)
+        return
+
+    m = re.match(r'(?:setlocal|set) (.*)$', cmd)
+    if m and current.buffer is not None:
+        for arg in re.split(r'(?<!\\) ', m.group(1)):
+            m = re.match(r'(no)?(\w+)(?:=(.*))?$', arg)
+            if m:
+                no, option, value = m.groups()
+                current.buffer.options[option] = value if value is not None else not no
+        return
+
+    m = re.match(r'let ([gbw]:\w+) = (.*)$', cmd)
+    if m:
+        variables[m.group(1)] = _literal(m.group(2))
+
+
+def _literal(value):
+    if value[:1] in '"\'':
+        return value[1:-1]
+    return value
+
+
+class Function(object):
+    """Only execute() is supported, it runs a list of commands."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __call__(self, cmds):
+        global calls
+        calls += 1
+        for cmd in cmds:
+            _command(cmd)
+        return ''
+
+
+def eval(expr):
+    global calls
+    calls += 1
+    if expr in variables:
+        return variables[expr]
+
+    m = re.match(r'get\(g:, "(\w+)", "(.*)"\)$', expr)
+    if m:
+        return variables.get('g:' + m.group(1), m.group(2))
+
+    m = re.match(r'bufnr\("(.*)"\)$', expr)
+    if m:
+        return str(_bufnr(m.group(1)))
+
+    m = re.match(r'getbufvar\((\d+), "changedtick"\)$', expr)
+    if m:
+        return str(buffers[int(m.group(1))].changedtick)
+
+    if expr == 'winnr()':
+        return str(current.window.number)
+
+    m = re.match(r"has\('(\w+)'\)$", expr)
+    if m:
+        return '1' if features.get(m.group(1)) else '0'
+
+    m = re.match(r"timer_start\((\d+), '(\w+)'", expr)
+    if m:
+        number = max(timers or [0]) + 1
+        timers[number] = m.group(2)
+        return str(number)
+
+    if expr == "exists('*execute')":
+        return '1'
+
+    if expr.startswith('exists('):
+        return '0'
+
+    raise error('E121: Undefined variable: %s' % expr)
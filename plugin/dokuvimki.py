@@ -6,40 +6,1994 @@ import sys
 import os
 import re
 import vim
+import glob
+import json
+import mmap
 import time
+import queue
+import bisect
+import difflib
+import functools
+import math
+import heapq
+import hashlib
+import threading
 import subprocess
+import contextlib
+import collections
 
-from tempfile import TemporaryDirectory
+from os import path
+
+__version__ = '2021.4.4'
+__author__ = 'Michael Klier <chi@chimeric.de>'
+__license__ = 'MIT'
+__maintainer__ = 'Florian Rathgeber <florian.rathgeber+github@gmail.com>'
+
+try:
+    import dokuwikixmlrpc
+    has_dokuwikixmlrpc = True
+except ImportError:
+    print('DokuVimKi Error: The dokuwikixmlrpc python module is missing!', file=sys.stderr)
+    has_dokuwikixmlrpc = False
+
+
+vim_version = int(vim.eval('v:version'))
+
+# execute() runs a list of ex commands with a single call into vim (vim 8.0)
+if hasattr(vim, 'Function') and int(vim.eval("exists('*execute')")):
+    vim_execute = vim.Function('execute')
+else:
+    vim_execute = None
+
+if sys.version_info < (3,):
+    def u(x):
+        return x if isinstance(x, unicode) else x.decode('utf-8')
+else:
+    def u(x):
+        return x
+
+
+def vim_commands(commands):
+    """
+    Runs a list of ex commands, with a single call into vim if possible.
+    """
+
+    if vim_execute is not None:
+        vim_execute(commands)
+    else:
+        for command in commands:
+            vim.command(command)
+
+
+def write_atomic(filename, data):
+    """
+    Writes data to a file by writing a temporary file first and renaming it
+    afterwards, so readers never see a partially written file.
+    """
+
+    dirname = os.path.dirname(filename)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+
+    tmp = filename + '.tmp'
+    with open(tmp, 'wb') as fh:
+        fh.write(data)
+    os.replace(tmp, filename)
+
+
+if has_dokuwikixmlrpc:
+    class TransportMixin:
+        """
+        Configures the XML-RPC transports: the connection is kept open between
+        requests (one connection per client, i.e. per thread), requests time
+        out and request bodies larger than compress bytes are sent gzipped.
+        Responses are accepted gzipped anyway.
+        """
+
+        def configure(self, timeout, compress, user_agent, stats=None):
+            self.timeout = timeout
+            self.encode_threshold = compress or None
+            self.user_agent = user_agent
+            self.stats = stats
+            self.received = 0
+
+        def make_connection(self, host):
+            conn = super(TransportMixin, self).make_connection(host)
+            conn.timeout = self.timeout
+            return conn
+
+        def single_request(self, host, handler, request_body, verbose=False):
+            if self.stats is None:
+                return super(TransportMixin, self).single_request(host, handler, request_body, verbose)
+
+            self.received = 0
+            start = time.time()
+            error = True
+            try:
+                result = super(TransportMixin, self).single_request(host, handler, request_body, verbose)
+                error = False
+                return result
+            finally:
+                self.stats.record_request(request_body, time.time() - start, self.received, error)
+
+        def parse_response(self, response):
+            if self.stats is None:
+                return super(TransportMixin, self).parse_response(response)
+            return super(TransportMixin, self).parse_response(CountingResponse(response, self))
+
+    class CountingResponse:
+        """
+        Wraps a HTTP response and adds the number of bytes read from it to the
+        received counter of the transport.
+        """
+
+        def __init__(self, response, transport):
+            self.response = response
+            self.transport = transport
+
+        def read(self, *args):
+            data = self.response.read(*args)
+            self.transport.received += len(data)
+            return data
+
+        def __getattr__(self, name):
+            return getattr(self.response, name)
+
+    class KeepAliveTransport(TransportMixin, dokuwikixmlrpc.xmlrpclib.Transport):
+        pass
+
+    class SafeKeepAliveTransport(TransportMixin, dokuwikixmlrpc.xmlrpclib.SafeTransport):
+        pass
+
+    class WikiClient(dokuwikixmlrpc.DokuWikiClient):
+        """
+        Extends the DokuWikiClient with the XML-RPC calls DokuVimKi needs but
+        dokuwikixmlrpc doesn't provide, and plugs in the keep-alive
+        transports.
+        """
+
+        def __init__(self, url, user, passwd, compress=0, stats=None, **kwargs):
+            """
+            Instanziates a client, compress is the minimum size of request
+            bodies to send gzipped (0 disables compression). Requests are
+            recorded in stats if given.
+            """
+            self._compress = compress
+            self._stats = stats
+            dokuwikixmlrpc.DokuWikiClient.__init__(self, url, user, passwd, **kwargs)
+
+        @dokuwikixmlrpc.checkerr
+        def _xmlrpc_init(self):
+            """
+            Creates the XML-RPC proxy. Unlike DokuWikiClient this doesn't probe
+            the URL with an extra request on a separate connection, an
+            unreachable wiki is reported by the first call instead.
+            """
+
+            script = '/lib/exe/xmlrpc.php'
+
+            if self._http_basic_auth:
+                proto, url = self._url.split('://')
+                url = ''.join([proto, '://', self._user, ':', self._passwd, '@', url, script])
+            else:
+                url = ''.join([self._url, script, '?', dokuwikixmlrpc.urlencode({'u': self._user, 'p': self._passwd})])
+
+            if url.startswith('https:'):
+                transport = SafeKeepAliveTransport(context=self._context)
+            else:
+                transport = KeepAliveTransport()
+            transport.configure(self._timeout, self._compress, self._user_agent, self._stats)
+
+            return dokuwikixmlrpc.xmlrpclib.ServerProxy(url, transport=transport)
+
+        # fault code DokuWiki uses to report an empty recent changes list
+        NO_CHANGES = 321
+
+        # fault code of XML-RPC servers for unknown methods
+        METHOD_NOT_FOUND = -32601
+
+        @dokuwikixmlrpc.checkerr
+        def time(self):
+            """Return the current time (UTC) of the remote wiki."""
+            return self._xmlrpc.dokuwiki.getTime()
+
+        def recent_changes(self, timestamp):
+            """Return the recent page changes since timestamp, if any."""
+            try:
+                return dokuwikixmlrpc.DokuWikiClient.recent_changes(self, timestamp)
+            except dokuwikixmlrpc.DokuWikiXMLRPCError as err:
+                if err.page_id == self.NO_CHANGES:
+                    return []
+                raise
+
+        def recent_media_changes(self, timestamp):
+            """Return the recent media changes since timestamp, if any."""
+            try:
+                return self._recent_media_changes(timestamp)
+            except dokuwikixmlrpc.DokuWikiXMLRPCError as err:
+                if err.page_id == self.NO_CHANGES:
+                    return []
+                raise
+
+        @dokuwikixmlrpc.checkerr
+        def _recent_media_changes(self, timestamp):
+            return self._xmlrpc.wiki.getRecentMediaChanges(timestamp)
+
+        @dokuwikixmlrpc.checkerr
+        def upload_file(self, file_id, filename, overwrite=False):
+            """
+            Upload a local file. The file is mapped into memory instead of
+            read, and handed to the XML-RPC encoder without a copy.
+            """
+
+            xmlrpclib = dokuwikixmlrpc.xmlrpclib
+            with open(filename, 'rb') as fh:
+                size = os.fstat(fh.fileno()).st_size
+                data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+                try:
+                    # Binary() would copy the data
+                    binary = xmlrpclib.Binary.__new__(xmlrpclib.Binary)
+                    binary.data = data
+                    return self._xmlrpc.wiki.putAttachment(file_id, binary, {'ow': overwrite})
+                finally:
+                    if size:
+                        data.close()
+
+        @dokuwikixmlrpc.checkerr
+        def search(self, query):
+            """Return the pages matching a full-text query, best first."""
+            return self._xmlrpc.dokuwiki.search(query)
+
+        @dokuwikixmlrpc.checkerr
+        def multicall(self, calls):
+            """
+            Sends several calls, given as (method name, params) tuples, in a
+            single system.multicall request. Returns the results in order, a
+            failed call yields a DokuWikiXMLRPCError instead of its result.
+            Falls back to one request per call if the remote wiki doesn't
+            support system.multicall.
+            """
+
+            xmlrpclib = dokuwikixmlrpc.xmlrpclib
+
+            try:
+                results = self._xmlrpc.system.multicall([{'methodName': method, 'params': list(params)}
+                                                         for method, params in calls])
+            except xmlrpclib.Fault as fault:
+                if fault.faultCode != self.METHOD_NOT_FOUND:
+                    raise
+                results = []
+                for method, params in calls:
+                    func = self._xmlrpc
+                    for name in method.split('.'):
+                        func = getattr(func, name)
+                    try:
+                        results.append([func(*params)])
+                    except xmlrpclib.Fault as fault:
+                        results.append({'faultCode': fault.faultCode, 'faultString': fault.faultString})
+
+            return [dokuwikixmlrpc.DokuWikiXMLRPCError(xmlrpclib.Fault(result['faultCode'], result['faultString']))
+                    if isinstance(result, dict) else result[0] for result in results]
+
+
+class Namespace:
+    """
+    Node of the namespace tree of the page index. Each node holds the names of
+    its pages and its sub namespaces keyed by name, so listing a namespace
+    only touches its direct children.
+    """
+
+    def __init__(self):
+        """
+        Instanziates an empty namespace.
+        """
+        self.children = {}
+        self.pages = set()
+
+    def add(self, page):
+        """
+        Adds a page id, creating its namespaces as needed.
+        """
+
+        node = self
+        parts = page.split(':')
+        for name in parts[:-1]:
+            child = node.children.get(name)
+            if child is None:
+                child = node.children[name] = Namespace()
+            node = child
+        node.pages.add(parts[-1])
+
+    def remove(self, page):
+        """
+        Removes a page id and all namespaces which became empty.
+        """
+
+        path = []
+        node = self
+        parts = page.split(':')
+        for name in parts[:-1]:
+            path.append((node, name))
+            node = node.children.get(name)
+            if node is None:
+                return
+        node.pages.discard(parts[-1])
+
+        for parent, name in reversed(path):
+            if node.pages or node.children:
+                break
+            del parent.children[name]
+            node = parent
+
+    def find(self, ns):
+        """
+        Returns the node of a namespace given as 'a:b:' or None.
+        """
+
+        node = self
+        for name in ns.split(':'):
+            if name:
+                node = node.children.get(name)
+                if node is None:
+                    return None
+        return node
+
+    def namespaces(self, prefix=''):
+        """
+        Yields the ids of all namespaces below this one, e.g. 'wiki:' and
+        'wiki:sub:' for the page 'wiki:sub:page'.
+        """
+
+        for name, child in self.children.items():
+            ns = prefix + name + ':'
+            yield ns
+            for sub in child.namespaces(ns):
+                yield sub
+
+
+class PageIndex:
+    """
+    Persistent index of the page and media ids of the remote wiki. It is
+    stored in the cache directory of the wiki and brought up to date using the
+    recent changes since the last sync (self.cursor, remote wiki time). The
+    pages are additionally kept in a namespace tree used for navigation.
+
+    Media ids are only known for the namespaces whose media have been listed,
+    self.media maps these namespaces ('a:b:') to their media ids.
+    self.media_trees holds the namespaces listed including all their sub
+    namespaces.
+    """
+
+    version = 2
+
+    def __init__(self, filename):
+        """
+        Instanziates an empty index stored in the given file.
+        """
+        self.filename = filename
+        self.pages = set()
+        self.media = {}
+        self.media_trees = set()
+        self.tree = Namespace()
+        self.cursor = 0
+
+    def load(self):
+        """
+        Loads the index from disk. Returns False if there is no usable index.
+        """
+
+        try:
+            with open(self.filename, 'rb') as fh:
+                data = json.loads(fh.read().decode('utf-8'))
+        except (IOError, OSError, ValueError):
+            return False
+
+        if data.get('version') != self.version:
+            return False
+
+        self.set_pages(data['pages'])
+        self.media = dict((ns, set(ids)) for ns, ids in data['media'].items())
+        self.media_trees = set(data['media_trees'])
+        self.cursor = data['cursor']
+        return True
+
+    def save(self):
+        """
+        Writes the index to disk.
+        """
+
+        data = {
+            'version': self.version,
+            'cursor': self.cursor,
+            'pages': sorted(self.pages),
+            'media': dict((ns, sorted(ids)) for ns, ids in self.media.items()),
+            'media_trees': sorted(self.media_trees),
+        }
+
+        try:
+            write_atomic(self.filename, json.dumps(data).encode('utf-8'))
+        except (IOError, OSError) as err:
+            print("DokuVimKi Error: Failed to write page index: %s" % err, file=sys.stderr)
+
+    def set_pages(self, pages):
+        """
+        Replaces all pages of the index.
+        """
+
+        self.pages = set(pages)
+        self.tree = Namespace()
+        for page in self.pages:
+            self.tree.add(page)
+
+    def add_page(self, page):
+        """
+        Adds a single page to the index.
+        """
+
+        if page not in self.pages:
+            self.pages.add(page)
+            self.tree.add(page)
+
+    def remove_page(self, page):
+        """
+        Removes a single page from the index.
+        """
+
+        if page in self.pages:
+            self.pages.discard(page)
+            self.tree.remove(page)
+
+    def rebuild(self, pages):
+        """
+        Replaces the index with the results of all_pages(). The media are
+        listed again when they are needed.
+        """
+        self.set_pages(page['id'] for page in pages)
+        self.media = {}
+        self.media_trees = set()
+
+    def update(self, pages, media):
+        """
+        Applies the results of recent_changes() and recent_media_changes().
+        The size of deleted pages and media files is reported as 0.
+        """
+
+        for change in pages:
+            if change.get('size', 1):
+                self.add_page(change['name'])
+            else:
+                self.remove_page(change['name'])
+
+        for change in media:
+            if change.get('size', 1):
+                self.add_media(change['name'])
+            else:
+                self.remove_media(change['name'])
+
+    @staticmethod
+    def media_namespace(media):
+        """
+        Returns the namespace of a media id as 'a:b:'.
+        """
+        return media.rsplit(':', 1)[0] + ':' if ':' in media else ''
+
+    def has_media(self, ns, recursive=False):
+        """
+        Checks whether the media of a namespace, with recursive set including
+        those of its sub namespaces, have been listed.
+        """
+
+        if not recursive and ns in self.media:
+            return True
+        parts = ns.split(':')
+        return any(':'.join(parts[:i]) + (':' if i else '') in self.media_trees for i in range(len(parts)))
+
+    def set_media(self, ns, media, recursive=False):
+        """
+        Replaces the media of a namespace, and of its sub namespaces if
+        recursive is set, with the results of list_files().
+        """
+
+        ids = [item['id'] for item in media]
+        if recursive:
+            for other in [other for other in self.media if other.startswith(ns)]:
+                del self.media[other]
+            self.media_trees = set(other for other in self.media_trees if not other.startswith(ns))
+            self.media_trees.add(ns)
+            self.media[ns] = set()
+            for media in ids:
+                self.media.setdefault(self.media_namespace(media), set()).add(media)
+        else:
+            self.media[ns] = set(ids)
+
+    def add_media(self, media):
+        """
+        Adds a media id, if the media of its namespace have been listed.
+        """
+
+        ns = self.media_namespace(media)
+        if self.has_media(ns):
+            self.media.setdefault(ns, set()).add(media)
+
+    def remove_media(self, media):
+        """
+        Removes a media id.
+        """
+        self.media.get(self.media_namespace(media), set()).discard(media)
+
+    def media_ids(self, ns=''):
+        """
+        Returns the known media ids of a namespace and its sub namespaces.
+        """
+
+        result = set()
+        for other, ids in self.media.items():
+            if other.startswith(ns):
+                result.update(ids)
+        return result
+
+    def namespaces(self):
+        """
+        Returns the ids of all namespaces containing pages.
+        """
+        return list(self.tree.namespaces())
+
+    def listing(self, ns):
+        """
+        Returns the sorted sub namespaces and pages of a namespace given as
+        'a:b:'.
+        """
+
+        node = self.tree.find(ns)
+        if node is None:
+            return [], []
+        return sorted(node.children), sorted(node.pages)
+
+
+class ContentCache:
+    """
+    Size bounded on-disk cache of page texts keyed by page id and revision
+    (the lastModified timestamp of the page). The texts are stored in single
+    files, a manifest keeps track of their sizes and when they were last used.
+    Once the cache grows beyond max_size bytes the least recently used texts
+    are evicted, texts not used for max_age seconds are evicted as well.
+
+    The entries of the manifest are kept least recently used first, so
+    evicting doesn't need to look at the entries which are kept. Changes of
+    the manifest are written at most every save_interval seconds and by
+    save().
+    """
+
+    version = 1
+    save_interval = 30
+
+    def __init__(self, dirname, max_size, max_age):
+        """
+        Instanziates the cache stored in the given directory.
+        """
+        self.dirname = dirname
+        self.filename = os.path.join(dirname, 'manifest.json')
+        self.max_size = max_size
+        self.max_age = max_age
+        self.entries = collections.OrderedDict()
+        self.current = {}
+        self.size = 0
+        self.dirty = False
+        self.save_at = 0
+
+    def load(self):
+        """
+        Loads the manifest from disk. Returns False if there is no usable
+        manifest.
+        """
+
+        try:
+            with open(self.filename, 'rb') as fh:
+                data = json.loads(fh.read().decode('utf-8'))
+        except (IOError, OSError, ValueError):
+            return False
+
+        if data.get('version') != self.version:
+            return False
+
+        self.entries = collections.OrderedDict(sorted(data['entries'].items(), key=lambda item: item[1][3]))
+        self.current = data['current']
+        self.size = sum(entry[2] for entry in self.entries.values())
+        self.evict()
+        return True
+
+    def save(self):
+        """
+        Writes the manifest to disk if it has changed.
+        """
+
+        if not self.dirty:
+            return
+
+        data = {
+            'version': self.version,
+            'entries': self.entries,
+            'current': self.current,
+        }
+
+        try:
+            write_atomic(self.filename, json.dumps(data).encode('utf-8'))
+            self.dirty = False
+        except (IOError, OSError) as err:
+            print("DokuVimKi Error: Failed to write page cache: %s" % err, file=sys.stderr)
+        self.save_at = time.time() + self.save_interval
+
+    def changed(self):
+        """
+        Marks the manifest as changed, it is written if it hasn't been for
+        save_interval seconds.
+        """
+
+        self.dirty = True
+        if time.time() >= self.save_at:
+            self.save()
+
+    @staticmethod
+    def key(page, rev):
+        return hashlib.md5(('%s@%d' % (page, rev)).encode('utf-8')).hexdigest()
+
+    def __contains__(self, item):
+        """
+        Checks whether a (page, rev) tuple is cached, without reading it.
+        """
+        return self.key(*item) in self.entries
+
+    def revision(self, page):
+        """
+        Returns the revision of the most recent cached text of a page, None
+        if there is none.
+        """
+        return self.current.get(page)
+
+    def get(self, page, rev=None):
+        """
+        Returns the cached text of a revision of a page, or of its most recent
+        cached text if rev is None. Returns None on a cache miss.
+        """
+
+        if rev is None:
+            rev = self.current.get(page)
+            if rev is None:
+                return None
+
+        key = self.key(page, rev)
+        if key not in self.entries:
+            return None
+
+        try:
+            with open(os.path.join(self.dirname, key), 'rb') as fh:
+                text = fh.read().decode('utf-8')
+        except (IOError, OSError, ValueError):
+            self.remove(key)
+            return None
+
+        # the manifest is written with the next change, losing the access
+        # time of a text is harmless
+        self.entries[key][3] = time.time()
+        self.entries.move_to_end(key)
+        self.dirty = True
+        return text
+
+    def put(self, page, rev, text, current=True):
+        """
+        Adds a revision of a page to the cache, as the most recent text of
+        the page unless current is False.
+        """
+
+        key = self.key(page, rev)
+        data = text.encode('utf-8')
+
+        try:
+            write_atomic(os.path.join(self.dirname, key), data)
+        except (IOError, OSError) as err:
+            print("DokuVimKi Error: Failed to write page cache: %s" % err, file=sys.stderr)
+            return
+
+        if key in self.entries:
+            self.size -= self.entries[key][2]
+        self.entries[key] = [page, rev, len(data), time.time()]
+        self.entries.move_to_end(key)
+        self.size += len(data)
+        if current and rev >= self.current.get(page, 0):
+            self.current[page] = rev
+
+        self.evict()
+        self.changed()
+
+    def drop(self, page):
+        """
+        Forgets the most recent text of a page, e.g. because it was deleted.
+        Older revisions never change and are kept.
+        """
+
+        rev = self.current.pop(page, None)
+        if rev is not None:
+            self.remove(self.key(page, rev))
+            self.changed()
+
+    def remove(self, key):
+        """
+        Removes a single text from the cache.
+        """
+
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+
+        self.size -= entry[2]
+        if self.current.get(entry[0]) == entry[1]:
+            del self.current[entry[0]]
+        self.dirty = True
+
+        try:
+            os.remove(os.path.join(self.dirname, key))
+        except (IOError, OSError):
+            pass
+
+    def evict(self):
+        """
+        Evicts texts which are too old and then the least recently used ones
+        until the cache fits into max_size.
+        """
+
+        deadline = time.time() - self.max_age
+        while self.entries:
+            key, entry = next(iter(self.entries.items()))
+            if entry[3] >= deadline and self.size <= self.max_size:
+                break
+            self.remove(key)
+
+
+class PageDocuments:
+    """
+    Documents derived from the current page texts in the page cache, one per
+    page, like the terms of the SearchIndex or the links of the LinkGraph.
+    Every document is a tuple starting with the revision of the text it was
+    derived from.
+
+    Only the documents are stored on disk, subclasses build what they look
+    things up in from them, once the documents are first used.
+    """
+
+    version = 1
+
+    # what the documents are, for error messages
+    kind = 'page documents'
+
+    def __init__(self, filename):
+        """
+        Instanziates empty documents stored in the given file.
+        """
+        self.filename = filename
+        self.docs = {}
+        self.loaded = False
+        self.dirty = False
+
+    def load(self):
+        """
+        Loads the documents from disk. Returns False if there are no usable
+        documents.
+        """
+
+        self.loaded = True
+        self.clear()
+        try:
+            with open(self.filename, 'rb') as fh:
+                data = json.loads(fh.read().decode('utf-8'))
+        except (IOError, OSError, ValueError):
+            return False
+
+        if data.get('version') != self.version:
+            return False
+
+        for page, doc in data['docs'].items():
+            self.insert(page, tuple(doc))
+        return True
+
+    def save(self):
+        """
+        Writes the documents to disk if they have changed.
+        """
+
+        if not self.dirty:
+            return
+
+        try:
+            write_atomic(self.filename, json.dumps({'version': self.version, 'docs': self.docs}).encode('utf-8'))
+            self.dirty = False
+        except (IOError, OSError) as err:
+            print("DokuVimKi Error: Failed to write %s: %s" % (self.kind, err), file=sys.stderr)
+
+    def ensure(self):
+        if not self.loaded:
+            self.load()
+
+    def revision(self, page):
+        """
+        Returns the revision of the text the document of a page was derived
+        from, None if there is no document of the page.
+        """
+
+        self.ensure()
+        doc = self.docs.get(page)
+        return doc[0] if doc else None
+
+    def add(self, page, rev, text):
+        """
+        Derives the document of a revision of a page, replacing its previous
+        document.
+        """
+
+        self.ensure()
+        if page in self.docs:
+            if self.docs[page][0] == rev:
+                return
+            self.remove(page)
+
+        self.insert(page, self.document(page, rev, text))
+        self.dirty = True
+
+    def remove(self, page):
+        """
+        Removes the document of a page.
+        """
+
+        self.ensure()
+        doc = self.docs.pop(page, None)
+        if doc is None:
+            return
+
+        self.forget(page, doc)
+        self.dirty = True
+
+    def sync(self, cache):
+        """
+        Drops the documents which are no longer derived from the current text
+        in the page cache and adds those of the cached pages which are
+        missing.
+        """
+
+        self.ensure()
+        for page, doc in list(self.docs.items()):
+            if cache.revision(page) != doc[0]:
+                self.remove(page)
+
+        for page, rev in list(cache.current.items()):
+            if page not in self.docs:
+                text = cache.get(page, rev)
+                if text is not None:
+                    self.add(page, rev, text)
+
+    def clear(self):
+        """
+        Forgets what has been built from the documents.
+        """
+
+    def document(self, page, rev, text):
+        """
+        Returns the document of a revision of a page.
+        """
+        raise NotImplementedError
+
+    def insert(self, page, doc):
+        """
+        Adds the document of a page.
+        """
+        self.docs[page] = doc
+
+    def forget(self, page, doc):
+        """
+        Removes what has been built from the removed document of a page.
+        """
+
+
+class SearchIndex(PageDocuments):
+    """
+    Inverted index over the current page texts in the page cache, used to
+    search page contents without asking the remote wiki. Every term maps to
+    the pages containing it and how often it occurs there; phrases are
+    checked against the cached texts. Results are ranked with BM25.
+
+    Only the terms of every page are stored on disk, the postings are built
+    when the index is first used.
+    """
+
+    kind = 'search index'
+
+    # BM25 parameters
+    k1 = 1.2
+    b = 0.75
+
+    term_re = re.compile(r'\w\w+', re.UNICODE)
+    query_re = re.compile(r'"([^"]*)"|(-?)(\S+)')
+
+    def __init__(self, filename):
+        """
+        Instanziates an empty index stored in the given file.
+        """
+        PageDocuments.__init__(self, filename)
+        self.postings = {}
+        self.length = 0
+
+    @classmethod
+    def terms(cls, text):
+        """
+        Returns the terms of a text in order.
+        """
+        return cls.term_re.findall(text.lower())
+
+    def clear(self):
+        self.postings = {}
+        self.length = 0
+
+    def document(self, page, rev, text):
+        terms = self.terms(text)
+        counts = {}
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+        return rev, len(terms), counts
+
+    def insert(self, page, doc):
+        rev, length, counts = self.docs[page] = doc
+        self.length += length
+        for term, count in counts.items():
+            self.postings.setdefault(term, {})[page] = count
+
+    def forget(self, page, doc):
+        rev, length, counts = doc
+        self.length -= length
+        for term in counts:
+            postings = self.postings[term]
+            del postings[page]
+            if not postings:
+                del self.postings[term]
+
+    def parse(self, query):
+        """
+        Splits a query into the terms which have to occur, the phrases and
+        the excluded terms.
+        """
+
+        terms, phrases, excluded = [], [], []
+        for phrase, minus, word in self.query_re.findall(query):
+            if phrase:
+                words = self.terms(phrase)
+                terms += words
+                if len(words) > 1:
+                    phrases.append(words)
+            elif minus:
+                excluded += self.terms(word)
+            else:
+                terms += self.terms(word)
+        return terms, phrases, excluded
+
+    def search(self, query, text, limit=500):
+        """
+        Returns up to limit (page, score) tuples of the pages matching a
+        query, best first. Pages have to contain all terms and "phrases" of
+        the query and none of its -excluded terms. text(page) has to return
+        the indexed text of a page to check phrases, pages whose text is gone
+        are dropped from the index.
+        """
+
+        self.ensure()
+        terms, phrases, excluded = self.parse(query)
+        if not terms:
+            return []
+
+        postings = sorted((self.postings.get(term, {}) for term in set(terms)), key=len)
+        candidates = set(postings[0])
+        for other in postings[1:]:
+            candidates.intersection_update(other)
+
+        for term in excluded:
+            candidates.difference_update(self.postings.get(term, ()))
+
+        if not candidates:
+            return []
+
+        count = len(self.docs)
+        avg = float(self.length) / count if count else 1.0
+        k1, b = self.k1, self.b
+        docs = self.docs
+        norm = dict((page, k1 * (1 - b + b * docs[page][1] / avg)) for page in candidates)
+
+        scores = dict.fromkeys(candidates, 0.0)
+        for term in set(terms):
+            postings = self.postings[term]
+            df = len(postings)
+            idf = math.log(1 + (count - df + 0.5) / (df + 0.5)) * (k1 + 1)
+            for page in candidates:
+                tf = postings[page]
+                scores[page] += idf * tf / (tf + norm[page])
+
+        if not phrases:
+            return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+
+        results = []
+        for page, score in sorted(scores.items(), key=lambda item: -item[1]):
+            content = text(page)
+            if content is None:
+                self.remove(page)
+                continue
+            words = self.terms(content)
+            if all(self.contains(words, phrase) for phrase in phrases):
+                results.append((page, score))
+                if len(results) >= limit:
+                    break
+        return results
+
+    @staticmethod
+    def contains(words, phrase):
+        """
+        Checks whether a list of words contains a phrase given as words.
+        """
+
+        n = len(phrase)
+        first = phrase[0]
+        for i, word in enumerate(words):
+            if word == first and words[i:i + n] == phrase:
+                return True
+        return False
+
+
+# the link under the cursor, see id_lookup()
+link_open_re = re.compile(r'\[{2}[^]]*$')  # opening link syntax
+link_close_re = re.compile(r'^[^\[]*]{2}')  # closing link syntax
+relative_re = re.compile(r'(\.(?=[^:\.]))')
+
+
+@functools.lru_cache(maxsize=65536)
+def resolve_link(link, ns):
+    """
+    Resolves the id of a wiki link, i.e. the part between [[ and ]], found
+    on a page of the namespace ns. This is _almost_ a rip off of DokuWikis
+    resolve_id() function. Returns None for external, interwiki, email and
+    windows share links and for links to sections of the same page.
+    """
+
+    # sanitize match remove anchors and everything after '|'
+    id = link.split('|')[0].split('#')[0].strip()
+
+    if not id or '>' in id or '://' in id or '\\' in id or '@' in id:
+        return None
+
+    # useslash may be used
+    id = id.replace('/', ':')
+
+    if id[0] == '.':
+        id = relative_re.sub('.:', id)
+        id = ns + ':' + id
+        path = id.split(':')
+
+        result = []
+        for dir in path:
+            if dir == '..':
+                try:
+                    if result[-1] == '..':
+                        result.append('..')
+                    elif not result.pop():
+                        result.append('..')
+                except IndexError:
+                    pass
+            elif dir and dir != '.' and not len(dir.split('.')) > 2:
+                result.append(dir)
+
+        id = ':'.join(result)
+
+    elif ns and id[0] != ':' and id.find(':', 0) == -1:
+        id = ns + ':' + id
+
+    # links to a namespace lead to its start page
+    if id.endswith(':'):
+        id += 'start'
+
+    return ':'.join(x.strip().lower().replace(' ', '_') for x in id.strip(':').split(':')) or None
+
+
+class LinkGraph(PageDocuments):
+    """
+    Links between the current page texts in the page cache, used to find
+    backlinks, orphans and wanted pages without asking the remote wiki.
+    Links are resolved like id_lookup() does when following them.
+
+    Only the links of every page are stored on disk, the backlinks are
+    built when the graph is first used.
+    """
+
+    kind = 'link graph'
+
+    link_re = re.compile(r'\[\[([^\]\[]*)\]\]')
+    # links aren't links in there
+    verbatim_re = re.compile(r'<(code|file|nowiki|html|php)\b.*?</\1>|%%.*?%%', re.DOTALL | re.IGNORECASE)
+
+    def __init__(self, filename):
+        """
+        Instanziates an empty graph stored in the given file.
+        """
+        PageDocuments.__init__(self, filename)
+        self.backlinks = {}
+
+    @classmethod
+    def line_links(cls, line, ns):
+        """
+        Returns the links of a single line as (link, page id) tuples, the
+        page id is None for links which don't lead to a page.
+        """
+        return tuple((link, resolve_link(link, ns)) for link in cls.link_re.findall(cls.verbatim_re.sub('', line)))
+
+    @classmethod
+    def links(cls, page, text):
+        """
+        Returns the ids of the pages a text links to, in the order they are
+        first linked.
+        """
+
+        ns = page.rsplit(':', 1)[0] if ':' in page else ''
+        targets = collections.OrderedDict()
+        for link in cls.link_re.findall(cls.verbatim_re.sub('', text)):
+            target = resolve_link(link, ns)
+            if target and target != page:
+                targets[target] = True
+        return list(targets)
+
+    def clear(self):
+        self.backlinks = {}
+
+    def document(self, page, rev, text):
+        return rev, self.links(page, text)
+
+    def insert(self, page, doc):
+        self.docs[page] = doc
+        for target in doc[1]:
+            self.backlinks.setdefault(target, set()).add(page)
+
+    def forget(self, page, doc):
+        for target in doc[1]:
+            sources = self.backlinks[target]
+            sources.discard(page)
+            if not sources:
+                del self.backlinks[target]
+
+    def outgoing(self, page):
+        """
+        Returns the pages a page links to, None if its links aren't known.
+        """
+
+        self.ensure()
+        doc = self.docs.get(page)
+        return doc[1] if doc else None
+
+    def incoming(self, page):
+        """
+        Returns the known pages linking to a page.
+        """
+
+        self.ensure()
+        return sorted(self.backlinks.get(page, ()))
+
+    def orphans(self, pages):
+        """
+        Returns those of the given pages no known page links to.
+        """
+
+        self.ensure()
+        return sorted(page for page in pages if page not in self.backlinks)
+
+    def wanted(self, pages):
+        """
+        Returns the links to pages which don't exist, i.e. aren't among the
+        given pages, as a dict of the missing pages and the pages linking
+        to them.
+        """
+
+        self.ensure()
+        return dict((target, sorted(sources)) for target, sources in self.backlinks.items() if target not in pages)
+
+
+class ChangeFeed:
+    """
+    Local store of the recent changes of the remote wiki, the changes
+    buffer is rendered from it. New changes are fetched from a cursor, the
+    remote wiki time of the last fetch, and merged into the store, which
+    covers all changes from self.start on. Only the latest changes are
+    kept.
+    """
+
+    version = 1
+    limit = 10000
+
+    def __init__(self, filename):
+        """
+        Instanziates an empty feed stored in the given file.
+        """
+        self.filename = filename
+        self.changes = []
+        self.keys = set()
+        self.start = None
+        self.cursor = None
+        self.dirty = False
+
+    def load(self):
+        """
+        Loads the feed from disk.
+        """
+
+        try:
+            with open(self.filename, 'rb') as fh:
+                data = json.loads(fh.read().decode('utf-8'))
+        except (IOError, OSError, ValueError):
+            return
+
+        if data.get('version') != self.version:
+            return
+
+        self.changes = data['changes']
+        self.keys = set((change['name'], change['version']) for change in self.changes)
+        self.start = data['start']
+        self.cursor = data['cursor']
+
+    def save(self):
+        """
+        Writes the feed to disk if it has changed.
+        """
+
+        if not self.dirty:
+            return
+
+        data = {'version': self.version, 'start': self.start, 'cursor': self.cursor, 'changes': self.changes}
+        try:
+            write_atomic(self.filename, json.dumps(data).encode('utf-8'))
+            self.dirty = False
+        except (IOError, OSError) as err:
+            print("DokuVimKi Error: Failed to write the recent changes: %s" % err, file=sys.stderr)
+
+    def covers(self, timestamp):
+        """
+        Checks whether the feed has all changes since timestamp.
+        """
+        return self.start is not None and self.start <= timestamp
+
+    def merge(self, changes, since, now):
+        """
+        Merges the results of recent_changes(since), fetched at the remote
+        wiki time now. The feed starts afresh if they don't connect to the
+        changes it has. Returns the number of new changes.
+        """
+
+        if self.cursor is None or since > self.cursor:
+            self.changes = []
+            self.keys = set()
+            self.start = since
+            self.dirty = True
+
+        new = 0
+        for change in changes:
+            # dates come as xmlrpc DateTime objects
+            change = dict((key, value if value is None or isinstance(value, (int, float, str)) else str(value))
+                          for key, value in change.items())
+            change['version'] = int(change['version'])
+            key = (change['name'], change['version'])
+            if key not in self.keys:
+                self.keys.add(key)
+                self.changes.append(change)
+                new += 1
+
+        if since < self.start:
+            self.start = since
+            self.dirty = True
+
+        if new:
+            self.changes.sort(key=lambda change: change['version'])
+            if len(self.changes) > self.limit:
+                for change in self.changes[:-self.limit]:
+                    self.keys.discard((change['name'], change['version']))
+                del self.changes[:-self.limit]
+                self.start = self.changes[0]['version']
+            self.dirty = True
+
+        self.cursor = now if self.cursor is None else max(self.cursor, now)
+        return new
+
+    def since(self, timestamp):
+        """
+        Returns the changes since timestamp, oldest first.
+        """
+
+        versions = [change['version'] for change in self.changes]
+        return self.changes[bisect.bisect_left(versions, timestamp):]
+
+
+class Journal:
+    """
+    Durable queue of page saves which haven't reached the remote wiki yet.
+    Every pending page is stored in a file of its own and saving a page
+    again replaces its pending save, so only the latest text is uploaded.
+    Failed uploads are retried with exponential backoff.
+    """
+
+    retry_min = 5
+    retry_max = 300
+
+    def __init__(self, dirname):
+        """
+        Instanziates an empty journal stored in the given directory.
+        """
+        self.dirname = dirname
+        self.entries = {}
+        self.attempts = {}
+        self.due = {}
+        self.failed = {}
+
+    def load(self):
+        """
+        Loads the pending saves from disk.
+        """
+
+        try:
+            names = os.listdir(self.dirname)
+        except (IOError, OSError):
+            return
+
+        for name in names:
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.dirname, name), 'rb') as fh:
+                    entry = json.loads(fh.read().decode('utf-8'))
+            except (IOError, OSError, ValueError):
+                continue
+            self.entries[entry['page']] = entry
+
+    def filename(self, page):
+        return os.path.join(self.dirname, hashlib.md5(page.encode('utf-8')).hexdigest() + '.json')
+
+    def add(self, page, text, sum, minor, base=None):
+        """
+        Queues a save of a page, replacing its pending save if there is one.
+        base is the revision the text is based on, 0 for a new page and None
+        if it's unknown. Raises IOError or OSError if the journal can't be
+        written.
+        """
+
+        pending = self.entries.get(page)
+        if pending is not None:
+            minor = minor and pending['minor']
+
+        entry = {'page': page, 'text': text, 'sum': sum, 'minor': minor, 'base': base, 'time': time.time()}
+        write_atomic(self.filename(page), json.dumps(entry).encode('utf-8'))
+
+        self.entries[page] = entry
+        self.attempts.pop(page, None)
+        self.due.pop(page, None)
+        self.failed.pop(page, None)
+        return entry
+
+    def remove(self, page, entry):
+        """
+        Removes an uploaded save, unless the page has been saved again in
+        the meantime.
+        """
+
+        if self.entries.get(page) is not entry:
+            return False
+
+        del self.entries[page]
+        self.attempts.pop(page, None)
+        self.due.pop(page, None)
+        self.failed.pop(page, None)
+
+        try:
+            os.remove(self.filename(page))
+        except (IOError, OSError):
+            pass
+        return True
+
+    def rebase(self, page, base, rev):
+        """
+        Moves the pending save of a page based on revision base onto
+        revision rev, which contains the save it was made after.
+        """
+
+        entry = self.entries.get(page)
+        if entry is None or entry.get('base') != base:
+            return
+        entry['base'] = rev
+        try:
+            write_atomic(self.filename(page), json.dumps(entry).encode('utf-8'))
+        except (IOError, OSError):
+            pass
+
+    def retry(self, page):
+        """
+        Schedules another upload after a failed one and returns the delay in
+        seconds.
+        """
+
+        attempts = self.attempts.get(page, 0)
+        delay = min(self.retry_max, self.retry_min * 2 ** attempts)
+        self.attempts[page] = attempts + 1
+        self.due[page] = time.time() + delay
+        return delay
+
+    def fail(self, page, error):
+        """
+        Stops retrying a save refused by the remote wiki until it is flushed
+        explicitly.
+        """
+        self.failed[page] = error
 
-from os import path
+    def ready(self, force=False):
+        """
+        Returns the pages whose saves are due for an upload, all pending ones
+        if force is set.
+        """
 
-__version__ = '2021.4.4'
-__author__ = 'Michael Klier <chi@chimeric.de>'
-__license__ = 'MIT'
-__maintainer__ = 'Florian Rathgeber <florian.rathgeber+github@gmail.com>'
+        now = time.time()
+        return [page for page in self.entries
+                if force or (page not in self.failed and self.due.get(page, 0) <= now)]
 
-try:
-    import dokuwikixmlrpc
-    has_dokuwikixmlrpc = True
-except ImportError:
-    print('DokuVimKi Error: The dokuwikixmlrpc python module is missing!', file=sys.stderr)
-    has_dokuwikixmlrpc = False
+    def next_due(self):
+        """
+        Returns the time of the next scheduled retry, None if there is none.
+        """
 
-try:
-    from PIL import ImageGrab
-    has_pil = True
-except ImportError:
-    has_pil = False
+        times = [due for page, due in self.due.items() if page in self.entries and page not in self.failed]
+        return min(times) if times else None
 
 
-vim_version = int(vim.eval('v:version'))
+class Mirror:
+    """
+    Local copy of a namespace in the layout of DokuWiki's data directory:
+    pages/<ns>/<page>.txt and media/<ns>/<file>. A manifest records the
+    revision and md5 sum of every file as it was last exported or imported.
+    Transferred files are appended to it right away, so an interrupted
+    transfer resumes where it stopped.
+    """
 
-if sys.version_info < (3,):
-    def u(x):
-        return x if isinstance(x, unicode) else x.decode('utf-8')
-else:
-    def u(x):
-        return x
+    manifest = '.dokuvimki'
+
+    def __init__(self, dirname, ns):
+        """
+        Instanziates a mirror of the namespace ns in the given directory.
+        """
+        self.dirname = os.path.abspath(os.path.expanduser(dirname))
+        self.ns = ns.strip(':')
+        self.prefix = self.ns + ':' if self.ns else ''
+        self.entries = {}
+        self.fh = None
+
+    def load(self):
+        """
+        Loads the manifest, later lines override earlier ones.
+        """
+
+        try:
+            with open(os.path.join(self.dirname, self.manifest), 'rb') as fh:
+                lines = fh.read().decode('utf-8').splitlines()
+        except (IOError, OSError):
+            return
+
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # the tail of an interrupted write
+                continue
+            self.entries[(entry['kind'], entry['id'])] = entry
+
+    def get(self, kind, id):
+        return self.entries.get((kind, id))
+
+    def record(self, kind, id, rev, md5):
+        """
+        Records a transferred file. Raises IOError or OSError if the manifest
+        can't be written.
+        """
+
+        entry = {'kind': kind, 'id': id, 'rev': rev, 'md5': md5}
+        if self.fh is None:
+            if not os.path.isdir(self.dirname):
+                os.makedirs(self.dirname)
+            self.fh = open(os.path.join(self.dirname, self.manifest), 'ab')
+        self.fh.write(json.dumps(entry).encode('utf-8') + b'\n')
+        self.fh.flush()
+        self.entries[(kind, id)] = entry
+
+    def close(self):
+        """
+        Rewrites the manifest without the entries overridden since.
+        """
+
+        if self.fh is None:
+            return
+        self.fh.close()
+        self.fh = None
+        data = ''.join(json.dumps(entry) + '\n' for entry in self.entries.values())
+        write_atomic(os.path.join(self.dirname, self.manifest), data.encode('utf-8'))
+
+    def path(self, kind, id):
+        """
+        Returns the local file of a page or media id.
+        """
+
+        parts = id[len(self.prefix):].split(':')
+        if kind == 'pages':
+            parts[-1] += '.txt'
+        return os.path.join(self.dirname, kind, *parts)
+
+    def files(self, kind):
+        """
+        Returns the ids and local files of all pages or media of the mirror.
+        """
+
+        top = os.path.join(self.dirname, kind)
+        result = []
+        for dirpath, dirnames, filenames in os.walk(top):
+            dirnames[:] = sorted(name for name in dirnames if not name.startswith('.'))
+            for name in sorted(filenames):
+                if name.startswith('.') or name.endswith('.tmp'):
+                    continue
+                if kind == 'pages' and not name.endswith('.txt'):
+                    continue
+                filename = os.path.join(dirpath, name)
+                parts = os.path.relpath(filename, top).split(os.sep)
+                if kind == 'pages':
+                    parts[-1] = parts[-1][:-4]
+                result.append((self.prefix + ':'.join(parts), filename))
+        return result
+
+
+def md5_file(filename):
+    """
+    Returns the md5 sum of a file, read in chunks.
+    """
+
+    digest = hashlib.md5()
+    with open(filename, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def merge3(base, ours, theirs, label='theirs'):
+    """
+    Merges two texts changed independently from a common base, all given as
+    lists of lines. Changes of one side are taken over, changes of both
+    sides to the same lines too if they are the same. Otherwise both are
+    kept between conflict markers. Returns the merged lines and the number
+    of conflicts.
+    """
+
+    def changes(other, side):
+        matcher = difflib.SequenceMatcher(None, base, other, autojunk=False)
+        return [(i1, i2, other[j1:j2], side) for tag, i1, i2, j1, j2 in matcher.get_opcodes() if tag != 'equal']
+
+    def apply(group, side, start, end):
+        lines = []
+        pos = start
+        for i1, i2, new, other in group:
+            if other == side:
+                lines += base[pos:i1] + new
+                pos = i2
+        return lines + base[pos:end]
+
+    hunks = sorted(changes(ours, 0) + changes(theirs, 1), key=lambda hunk: (hunk[0], hunk[1]))
+    merged = []
+    conflicts = 0
+    pos = 0
+    k = 0
+
+    while k < len(hunks):
+        # changes of both sides touching the same lines form one region
+        group = [hunks[k]]
+        start, end = hunks[k][0], hunks[k][1]
+        k += 1
+        while k < len(hunks) and hunks[k][0] <= end:
+            group.append(hunks[k])
+            end = max(end, hunks[k][1])
+            k += 1
+
+        merged += base[pos:start]
+        mine = apply(group, 0, start, end)
+        other = apply(group, 1, start, end)
+        if all(hunk[3] == 0 for hunk in group) or mine == other:
+            merged += mine
+        elif all(hunk[3] == 1 for hunk in group):
+            merged += other
+        else:
+            merged += ['<<<<<<< ours'] + mine + ['======='] + other + ['>>>>>>> ' + label]
+            conflicts += 1
+        pos = end
+
+    return merged + base[pos:], conflicts
+
+
+def has_conflicts(lines):
+    """
+    Checks whether lines contain the conflict markers of merge3().
+    """
+    return any(line.startswith('<<<<<<< ') for line in lines) and any(line.startswith('>>>>>>> ') for line in lines)
+
+
+class Completer:
+    """
+    Completes page and media ids. Prefix matches are looked up by bisecting
+    the sorted ids, optional fuzzy matches (the characters of the base in
+    order, anywhere in the id) are found by a single regex scan over all ids
+    and ranked by how tightly they match.
+    """
+
+    def __init__(self, words=()):
+        """
+        Instanziates a completer for the given ids, which must be sorted.
+        """
+        self.words = list(words)
+        self.text = '\n'.join(self.words)
+
+    def prefix(self, base, limit):
+        """
+        Returns up to limit ids starting with base.
+        """
+
+        result = []
+        start = bisect.bisect_left(self.words, base)
+        for word in self.words[start:start + limit]:
+            if not word.startswith(base):
+                break
+            result.append(word)
+        return result
+
+    def fuzzy(self, base, limit):
+        """
+        Returns up to limit ids containing the characters of base in order,
+        best matches first.
+        """
+
+        if not base:
+            return []
+
+        # negated classes instead of lazy wildcards keep the scan linear
+        chars = [re.escape(c) for c in base]
+        pattern = re.compile(chars[0] + ''.join('[^%s\n]*%s' % (c, c) for c in chars[1:]))
+
+        ranked = []
+        last = -1
+        for m in pattern.finditer(self.text):
+            start = self.text.rfind('\n', 0, m.start()) + 1
+            if start == last:
+                continue
+            last = start
+            end = self.text.find('\n', m.end())
+            word = self.text[start:end if end != -1 else len(self.text)]
+            ranked.append((m.end() - m.start(), m.start() - start, len(word), word))
+
+        ranked.sort()
+        return [word for _, _, _, word in ranked[:limit]]
+
+    def complete(self, base, limit, fuzzy=False):
+        """
+        Returns up to limit ids matching base, prefix matches first.
+        """
+
+        result = self.prefix(base, limit)
+        if fuzzy and len(result) < limit:
+            seen = set(result)
+            for word in self.fuzzy(base, limit):
+                if word not in seen:
+                    result.append(word)
+                    if len(result) == limit:
+                        break
+        return result
+
+
+class Job:
+    """
+    A request handed to the Worker.
+
+        self.label      = short description shown in the statusline
+        self.func       = function called with an XML-RPC client
+        self.callback   = called with the result of func (UI thread)
+        self.errback    = called with the exception raised by func (UI thread)
+        self.cleanup    = called once the job is over, after the callbacks or
+                          when it is cancelled (UI thread)
+    """
+
+    def __init__(self, label, func, callback=None, errback=None, cleanup=None):
+        """
+        Instanziates a new job.
+        """
+        self.label = label
+        self.func = func
+        self.callback = callback
+        self.errback = errback
+        self.cleanup = cleanup
+        self.cancelled = False
+        self.result = None
+        self.error = None
+
+
+class Worker:
+    """
+    Runs jobs in background threads, each owning its own XML-RPC client
+    created by factory. Results are queued and handed to the callbacks of the
+    jobs by deliver(), which has to be called from the UI thread since the
+    vim module must not be used from any other thread.
+    """
+
+    def __init__(self, factory, threads=1):
+        """
+        Instanziates a worker with the given number of threads.
+        """
+        self.factory = factory
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+        self.jobs = []
+        self.threads = []
+
+        for i in range(threads):
+            thread = threading.Thread(target=self.run, name='DokuVimKi-%d' % i)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def run(self):
+        """
+        Thread main loop.
+        """
+
+        client = None
+        while True:
+            job = self.requests.get()
+            if not job.cancelled:
+                try:
+                    if client is None:
+                        client = self.factory()
+                    job.result = job.func(client)
+                except Exception as err:
+                    job.error = err
+            self.results.put(job)
+
+    def submit(self, job):
+        """
+        Queues a job.
+        """
+
+        self.jobs.append(job)
+        self.requests.put(job)
+        return job
+
+    def deliver(self):
+        """
+        Calls the callbacks and cleanups of all finished jobs.
+        """
+
+        while True:
+            try:
+                job = self.results.get_nowait()
+            except queue.Empty:
+                return
+
+            if job.cancelled:
+                continue
+
+            self.jobs.remove(job)
+            try:
+                if job.error is not None:
+                    if job.errback:
+                        job.errback(job.error)
+                elif job.callback:
+                    job.callback(job.result)
+            finally:
+                if job.cleanup:
+                    job.cleanup()
+
+    def cancel(self):
+        """
+        Cancels all pending jobs and calls their cleanups. Requests already
+        sent can't be aborted, but their results are discarded.
+        """
+
+        jobs = self.jobs
+        self.jobs = []
+        for job in jobs:
+            job.cancelled = True
+        for job in jobs:
+            if job.cleanup:
+                job.cleanup()
+        return jobs
+
+    def wait(self, timeout):
+        """
+        Delivers results until all jobs are done or timeout seconds passed.
+        """
+
+        deadline = time.time() + timeout
+        while self.jobs and time.time() < deadline:
+            self.deliver()
+            time.sleep(0.01)
+        self.deliver()
+
+
+class Stats:
+    """
+    Records the XML-RPC requests (count, latency, payload sizes) and the time
+    spent in UI operations. Requests are recorded by the worker threads, so
+    all access is locked. Every record is appended to a trace file if one is
+    given.
+    """
+
+    # upper bounds of the latency histogram buckets in milliseconds
+    buckets = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+    method_re = re.compile(br'<methodName>([^<]*)</methodName>')
+    multicall_re = re.compile(br'<name>methodName</name>\s*<value>(?:<string>)?([^<]*)<')
+
+    def __init__(self, trace=None):
+        """
+        Instanziates empty statistics, trace is the name of the trace file.
+        """
+        self.lock = threading.Lock()
+        self.trace = trace
+        self.trace_file = None
+        self.reset()
+
+    def reset(self):
+        """
+        Forgets everything recorded so far.
+        """
+
+        with self.lock:
+            self.since = time.time()
+            self.entries = {}
+            self.calls = {}
+
+    def record(self, kind, name, elapsed, sent=0, received=0, error=False):
+        """
+        Records an operation which took elapsed seconds.
+        """
+
+        ms = elapsed * 1000
+        with self.lock:
+            entry = self.entries.get((kind, name))
+            if entry is None:
+                entry = self.entries[(kind, name)] = {'count': 0, 'errors': 0, 'total': 0.0, 'max': 0.0,
+                                                      'sent': 0, 'received': 0,
+                                                      'histogram': [0] * (len(self.buckets) + 1)}
+            entry['count'] += 1
+            entry['errors'] += bool(error)
+            entry['total'] += ms
+            entry['max'] = max(entry['max'], ms)
+            entry['sent'] += sent
+            entry['received'] += received
+            entry['histogram'][bisect.bisect_left(self.buckets, ms)] += 1
+
+            if self.trace:
+                self.write_trace('%s\t%s\t%s\t%.1f\t%d\t%d\t%s\n' % (time.strftime('%Y-%m-%dT%H:%M:%S'), kind, name,
+                                                                       ms, sent, received, 'error' if error else 'ok'))
+
+    def record_request(self, body, elapsed, received, error=False):
+        """
+        Records a XML-RPC request given its body. The calls batched by a
+        system.multicall request are counted as well.
+        """
+
+        m = self.method_re.search(body)
+        method = m.group(1).decode('utf-8') if m else '?'
+        if method == 'system.multicall':
+            with self.lock:
+                for call in self.multicall_re.findall(body):
+                    call = call.decode('utf-8')
+                    self.calls[call] = self.calls.get(call, 0) + 1
+        self.record('rpc', method, elapsed, len(body), received, error)
+
+    @contextlib.contextmanager
+    def measure(self, name):
+        """
+        Context manager recording the time spent in a UI operation.
+        """
+
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record('ui', name, time.time() - start)
+
+    def write_trace(self, line):
+        # the trace is best effort, it is disabled if it can't be written
+        try:
+            if self.trace_file is None:
+                self.trace_file = open(os.path.expanduser(self.trace), 'a')
+            self.trace_file.write(line)
+            self.trace_file.flush()
+        except (IOError, OSError) as err:
+            print('DokuVimKi Error: Failed to write the trace log: %s' % err, file=sys.stderr)
+            self.trace = None
+
+    def percentile(self, histogram, fraction):
+        """
+        Returns the upper bound of the bucket containing the given fraction of
+        the recorded operations.
+        """
+
+        limit = fraction * sum(histogram)
+        count = 0
+        for i, n in enumerate(histogram):
+            count += n
+            if count >= limit:
+                return '%d' % self.buckets[i] if i < len(self.buckets) else '>%d' % self.buckets[-1]
+        return '-'
+
+    def report(self):
+        """
+        Returns the statistics as lines of text.
+        """
+
+        with self.lock:
+            entries = sorted(self.entries.items(), key=lambda item: (item[0][0] != 'rpc', -item[1]['total']))
+            calls = sorted(self.calls.items(), key=lambda item: -item[1])
+            since = self.since
+
+        lines = ['DokuVimKi statistics since %s' % time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(since)), '']
+        fmt = '%-28s %7s %6s %9s %8s %8s %6s %6s %9s %9s'
+        header = fmt % ('', 'count', 'errors', 'total ms', 'mean ms', 'max ms', 'p50', 'p95', 'sent KB', 'recv KB')
+
+        for kind, title in (('rpc', 'XML-RPC requests'), ('ui', 'UI operations')):
+            rows = [(name, entry) for (k, name), entry in entries if k == kind]
+            if not rows:
+                continue
+            lines += [title, header]
+            for name, entry in rows:
+                lines.append(fmt % (name, entry['count'], entry['errors'], '%.1f' % entry['total'],
+                                    '%.1f' % (entry['total'] / entry['count']), '%.1f' % entry['max'],
+                                    self.percentile(entry['histogram'], 0.5), self.percentile(entry['histogram'], 0.95),
+                                    '%.1f' % (entry['sent'] / 1024.0), '%.1f' % (entry['received'] / 1024.0)))
+            lines.append('')
+
+        if calls:
+            lines.append('Calls batched by system.multicall')
+            lines += ['%-28s %7d' % call for call in calls]
+            lines.append('')
+
+        if entries:
+            lines.append('Latency histogram [ms]')
+            lines.append('%-28s' % '' + ''.join('%7s' % ('<=%d' % b) for b in self.buckets) + '%7s' % ('>%d' % self.buckets[-1]))
+            for (kind, name), entry in entries:
+                lines.append('%-28s' % name + ''.join('%7s' % (n or '.') for n in entry['histogram']))
+
+        return lines
+
+
+class Budget:
+    """
+    Bounds the number of bytes held by concurrently running jobs. Jobs wait
+    until their size fits into the budget, a job larger than the whole
+    budget runs alone.
+    """
+
+    def __init__(self, limit):
+        """
+        Instanziates a budget of limit bytes.
+        """
+        self.limit = limit
+        self.used = 0
+        self.cond = threading.Condition()
+
+    def acquire(self, size):
+        with self.cond:
+            while self.used and self.used + size > self.limit:
+                self.cond.wait()
+            self.used += size
+
+    def release(self, size):
+        with self.cond:
+            self.used -= size
+            self.cond.notify_all()
 
 
 class DokuVimKi:
@@ -67,38 +2021,140 @@ class DokuVimKi:
             vim.command("command! -complete=customlist,CmdModeComplete -nargs=1 DWedit exec('Py dokuvimki.edit(<f-args>)')")
             vim.command("command! -complete=customlist,CmdModeComplete -nargs=* DWcd exec('Py dokuvimki.cd(<f-args>)')")
             vim.command("command! -nargs=? DWsave exec('Py dokuvimki.save(<f-args>)')")
-            vim.command("command! -nargs=? DWsearch exec('Py dokuvimki.search(\"page\", <f-args>)')")
-            vim.command("command! -nargs=? DWmediasearch exec('Py dokuvimki.search(\"media\", <f-args>)')")
+            vim.command("command! -nargs=? -bang DWsearch call DokuVimKiCall('search', 'page', <q-args>, '<bang>')")
+            vim.command("command! -nargs=? DWmediasearch call DokuVimKiCall('search', 'media', <q-args>)")
             vim.command("command! -complete=customlist,CmdModeComplete -nargs=* DWrevisions exec('Py dokuvimki.revisions(<f-args>)')")
             vim.command("command! -complete=customlist,CmdModeComplete -nargs=? DWbacklinks exec('Py dokuvimki.backlinks(<f-args>)')")
+            vim.command("command! -complete=customlist,CmdModeComplete -nargs=? DWlinks call DokuVimKiCall('links', <q-args>)")
+            vim.command("command! -complete=customlist,CmdModeComplete -nargs=? DWorphans call DokuVimKiCall('orphans', <q-args>)")
+            vim.command("command! -complete=customlist,CmdModeComplete -nargs=? DWwanted call DokuVimKiCall('wanted', <q-args>)")
             vim.command("command! -nargs=? DWchanges exec('Py dokuvimki.changes(<f-args>)')")
             vim.command("command! -nargs=0 -bang DWclose exec('Py dokuvimki.close(\"<bang>\")')")
             vim.command("command! -nargs=0 DWdiffclose exec('Py dokuvimki.diff_close()')")
-            vim.command("command! -complete=file -bang -nargs=1 DWupload exec('Py dokuvimki.upload(<f-args>,\"<bang>\")')")
+            vim.command("command! -complete=customlist,CmdModeComplete -nargs=+ DWcompare exec('Py dokuvimki.compare(<f-args>)')")
+            vim.command("command! -complete=file -bang -nargs=+ DWupload call DokuVimKiCall('upload', [<f-args>], '<bang>')")
             vim.command("command! -nargs=0 DWpasteimage exec('Py dokuvimki.paste_image(0)')")
             vim.command("command! -nargs=0 DWpasteimageAfter exec('Py dokuvimki.paste_image(1)')")
             vim.command("command! -nargs=0 DWhelp exec('Py dokuvimki.help()')")
+            vim.command("command! -nargs=0 -bang DWrefresh exec('Py dokuvimki.reload(\"<bang>\")')")
             vim.command("command! -nargs=0 -bang DWquit exec('Py dokuvimki.quit(\"<bang>\")')")
+            vim.command("command! -nargs=0 DWcancel exec('Py dokuvimki.cancel()')")
+            vim.command("command! -nargs=0 DWflush exec('Py dokuvimki.flush(True)')")
+            vim.command("command! -nargs=0 DWoffline exec('Py dokuvimki.go_offline()')")
+            vim.command("command! -nargs=0 DWonline exec('Py dokuvimki.go_online()')")
+            vim.command("command! -nargs=0 -bang DWstats exec('Py dokuvimki.show_stats(\"<bang>\")')")
+            vim.command("command! -nargs=1 -complete=command DWprofile call DokuVimKiCall('profile', <q-args>)")
+            vim.command("command! -complete=customlist,CmdModeComplete -nargs=? DWfetch call DokuVimKiCall('fetch_namespace', <q-args>)")
+            vim.command("command! -complete=file -bang -nargs=+ DWexport call DokuVimKiCall('export', [<f-args>], '<bang>')")
+            vim.command("command! -complete=file -bang -nargs=+ DWimport call DokuVimKiCall('import_', [<f-args>], '<bang>')")
 
             self.buffers = {}
+            self.link_check = bool(int(vim.eval('g:DokuVimKi_LINK_CHECK')))
             self.buffers['search'] = Buffer('search', 'nofile')
             self.buffers['backlinks'] = Buffer('backlinks', 'nofile')
             self.buffers['revisions'] = Buffer('revisions', 'nofile')
             self.buffers['changes'] = Buffer('changes', 'nofile')
+            self.buffers['compare'] = Buffer('compare', 'nofile')
             self.buffers['index'] = Buffer('index', 'nofile')
             self.buffers['media'] = Buffer('media', 'nofile')
             self.buffers['help'] = Buffer('help', 'nofile')
+            self.buffers['stats'] = Buffer('stats', 'nofile')
+
+            vim_commands(['autocmd! CursorMoved <buffer=%s> Py dokuvimki.prefetch_listed("%s")'
+                          % (self.buffers[name].num, name) for name in ['index', 'search', 'backlinks', 'changes']])
 
-            self.needs_refresh = False
             self.diffmode = False
 
             self.cur_ns = ''
             self.pages = []
+            self.media = []
+
+            self.page_completer = Completer()
+            self.media_completer = Completer()
+            self.media_loading = set()
+            self.media_failed = {}
+            self.media_retry = 60
+            self.complete_max = int(vim.eval('g:DokuVimKi_COMPLETE_MAX'))
+            self.complete_fuzzy = bool(int(vim.eval('g:DokuVimKi_COMPLETE_FUZZY')))
+
+            self.search_cache = collections.OrderedDict()
+            self.search_cache_size = 20
+            self.search_page_size = int(vim.eval('g:DokuVimKi_SEARCH_PAGE_SIZE'))
+            self.search_query = None
+            self.search_results = []
+            self.search_shown = 0
+
+            self.page_index = PageIndex(os.path.join(self.cache_dir, 'index.json'))
+            self.page_index.load()
+            self.index_max_age = 60 * 60 * 24 * int(vim.eval('g:DokuVimKi_INDEX_MAX_AGE'))
+            self.index_changed(save=False)
+
+            self.page_cache = ContentCache(os.path.join(self.cache_dir, 'pages'),
+                                           1024 * 1024 * int(vim.eval('g:DokuVimKi_CACHE_SIZE')),
+                                           60 * 60 * 24 * int(vim.eval('g:DokuVimKi_CACHE_MAX_AGE')))
+            self.page_cache.load()
+            self.search_index = SearchIndex(os.path.join(self.cache_dir, 'search.json'))
+            self.search_local = bool(int(vim.eval('g:DokuVimKi_SEARCH_LOCAL')))
+            self.link_graph = LinkGraph(os.path.join(self.cache_dir, 'links.json'))
+            self.change_feed = ChangeFeed(os.path.join(self.cache_dir, 'changes.json'))
+            self.change_feed.load()
+            self.changes_shown = None
+            self.cache_synced = False
+            self.prefetch_revs = int(vim.eval('g:DokuVimKi_PREFETCH_REVISIONS'))
+            self.prefetching = set()
+            self.prefetch_max = int(vim.eval('g:DokuVimKi_PREFETCH_PAGES'))
+            self.prefetch_rate = 1024 * int(vim.eval('g:DokuVimKi_PREFETCH_RATE'))
+            self.prefetch_log = collections.deque()
+            self.prefetch_busy = False
+            self.prefetch_next = None
+
+            self.journal = Journal(os.path.join(self.cache_dir, 'journal'))
+            self.journal.load()
+            self.uploading = set()
+            self.flush_timer = None
+            self.offline = bool(int(vim.eval('g:DokuVimKi_OFFLINE')))
+
+            self.locks = set()
+            self.lost_locks = set()
+            self.lock_interval = int(vim.eval('g:DokuVimKi_LOCK_INTERVAL'))
+            self.unlocked_ns = [ns.strip(':') for ns in vim.eval('g:DokuVimKi_UNLOCKED_NS').split()]
+            self.lock_failures = 0
+            self.lock_timer = None
+            self.renewing = False
+
+            self.worker = None
+            self.timer = None
+            self.status = ''
+            self.poll_interval = int(vim.eval('g:DokuVimKi_POLL_INTERVAL'))
+            self.quit_timeout = 5
+            self.timers = bool(int(vim.eval("has('timers')")))
+            if int(vim.eval('g:DokuVimKi_ASYNC')) and self.timers:
+                self.worker = Worker(self.client)
+
+            # the page index and the change feed are kept up to date by
+            # polling the recent changes, only in the background since
+            # polling synchronously would block vim every interval
+            self.changes_interval = int(vim.eval('g:DokuVimKi_CHANGES_INTERVAL'))
+            self.changes_timer = None
+            if self.worker and self.changes_interval > 0:
+                self.changes_timer = vim.eval("timer_start(%d, 'DokuVimKiRefresh', {'repeat': -1})"
+                                              % (self.changes_interval * 1000))
+
+            # file transfers get threads of their own once there are any
+            self.pool = None
+            self.transfer_threads = int(vim.eval('g:DokuVimKi_UPLOAD_THREADS'))
+            self.upload_budget = Budget(1024 * 1024 * int(vim.eval('g:DokuVimKi_UPLOAD_MEMORY')))
 
             self.default_sum = vim.eval('g:DokuVimKi_DEFAULT_SUM')
 
             self.img_sub_ns = vim.eval("g:DokuVimKi_IMG_SUB_NS")
 
+            # the login is checked in the background, the index is shown
+            # from the cache right away and synced afterwards
+            if not self.offline:
+                self.request('login', lambda xmlrpc: xmlrpc.dokuwiki_version, self.connected, self.login_failed)
+                self.flush()
+
             self.index_winwith = vim.eval('g:DokuVimKi_INDEX_WINWIDTH')
             self.index(self.cur_ns, True)
 
@@ -110,7 +2166,8 @@ class DokuVimKi:
 
     def xmlrpc_init(self):
         """
-        Establishes the xmlrpc connection to the remote wiki.
+        Sets up the xmlrpc connection to the remote wiki. The remote wiki is
+        only contacted by the first request.
         """
 
         try:
@@ -119,6 +2176,10 @@ class DokuVimKi:
             dw_pass_eval = vim.eval('get(g:, "DokuVimKi_PASS_EVAL", "")')
             dw_url = vim.eval('g:DokuVimKi_URL')
             http_basic_auth = bool(vim.eval('g:DokuVimKi_HTTP_BASIC_AUTH'))
+            timeout = int(vim.eval('g:DokuVimKi_TIMEOUT'))
+            compress = int(vim.eval('g:DokuVimKi_COMPRESS'))
+            trace = vim.eval('g:DokuVimKi_TRACE_FILE')
+            cache_dir = os.path.expanduser(vim.eval('g:DokuVimKi_CACHE_DIR'))
         except vim.error as err:
             print("Error: %s. Please check your configuration settings." % err, file=sys.stderr)
             return False
@@ -127,6 +2188,12 @@ class DokuVimKi:
             print("Error: Please either define the DokuVimKi_PASS or DokuVimKi_PASS_EVAL", file=sys.stderr)
             return False
 
+        self.stats = Stats(trace or None)
+
+        # every wiki (and user, the ACLs may differ) gets its own cache
+        wiki_key = hashlib.md5((dw_url + '\n' + dw_user).encode('utf-8')).hexdigest()
+        self.cache_dir = os.path.join(cache_dir, wiki_key)
+
         try:
             if dw_pass_eval:
                 passw = subprocess.run(dw_pass_eval.split(" "), stdout=subprocess.PIPE).stdout
@@ -134,18 +2201,46 @@ class DokuVimKi:
 
             if http_basic_auth:
                 print('Using HTTP basic authentication')
-            self.xmlrpc = dokuwikixmlrpc.DokuWikiClient(dw_url, dw_user, dw_pass, http_basic_auth=http_basic_auth)
-            dw_version = self.xmlrpc.dokuwiki_version
-            print('Connection to %s established (DokuWiki version: %s)' % (dw_url, dw_version), file=sys.stdout)
+            self.client_args = (dw_url, dw_user, dw_pass)
+            self.client_kwargs = {'http_basic_auth': http_basic_auth, 'timeout': timeout, 'compress': compress,
+                                  'stats': self.stats}
+            self.xmlrpc = self.client()
             return True
         except dokuwikixmlrpc.DokuWikiError as err:
             print(err, file=sys.stderr)
             return False
+        except (IOError, OSError) as err:
+            print('%s (%s)' % (dokuwikixmlrpc.DokuWikiURLError(dw_url), err), file=sys.stderr)
+            return False
+
+    def connected(self, dw_version):
+        """
+        Reports the established connection to the remote wiki.
+        """
+        print('Connection to %s established (DokuWiki version: %s)' % (self.client_args[0], dw_version), file=sys.stdout)
+
+    def login_failed(self, err):
+        """
+        Reports a failed connection to the remote wiki.
+        """
+
+        if isinstance(err, dokuwikixmlrpc.DokuWikiError):
+            print(err, file=sys.stderr)
+        else:
+            print('%s (%s)' % (dokuwikixmlrpc.DokuWikiURLError(self.client_args[0]), err), file=sys.stderr)
+
+    def client(self):
+        """
+        Creates an additional XML-RPC client for a background thread.
+        """
+        return WikiClient(*self.client_args, **self.client_kwargs)
 
-    def edit(self, wp, rev=''):
+    def edit(self, wp, rev='', callback=None):
         """
         Opens a given wiki page, or a given revision of a wiki page for
         editing or switches to the correct buffer if the is open already.
+        The page is loaded in the background, callback is called once the
+        page buffer is ready.
         """
 
         print("editing pagename %s." % wp, file=sys.stdout)
@@ -161,95 +2256,308 @@ class DokuVimKi:
 
         if wp not in self.buffers:
 
-            perm = int(self.xmlrpc.acl_check(wp))
+            if self.offline:
+                self.edit_offline(wp, rev, callback)
+                return
 
-            if perm >= 1:
-                try:
-                    if rev:
-                        text = self.xmlrpc.page(wp, int(rev))
+            # old revisions never change, a cached text of the current page
+            # is only used if the page info shows it is still up to date
+            if rev:
+                version = int(rev)
+                cached = self.page_cache.get(wp, version)
+            else:
+                version = self.page_cache.revision(wp)
+                cached = self.page_cache.get(wp)
+
+            # permissions, page info, text (unless cached) and lock in one
+            # round trip; locking fails harmlessly if we turn out not to have
+            # edit permissions
+            calls = [('wiki.aclCheck', [wp])]
+            if not rev:
+                calls.append(('wiki.getPageInfo', [wp]))
+            if cached is None:
+                if rev:
+                    calls.append(('wiki.getPageVersion', [wp, int(rev)]))
+                else:
+                    calls.append(('wiki.getPage', [wp]))
+            lock = self.needs_lock(wp)
+            if lock:
+                calls.append(('dokuwiki.setLocks', [{'lock': [wp], 'unlock': []}]))
+
+            def fetch(xmlrpc):
+                results = xmlrpc.multicall(calls)
+                perm = results.pop(0)
+                info = results.pop(0) if not rev else None
+                text = results.pop(0) if cached is None else cached
+                locked = results.pop(0) if lock else None
+                current = int(rev) if rev else None
+                error = None
+
+                if isinstance(perm, Exception):
+                    raise perm
+                perm = int(perm)
+
+                if not rev:
+                    if isinstance(info, Exception):
+                        # the page doesn't exist (anymore)
+                        text = ''
                     else:
-                        text = self.xmlrpc.page(wp)
-                except dokuwikixmlrpc.DokuWikiXMLRPCError as err:
-                    print(err, file=sys.stdout)
+                        current = int(info['version'])
+                        if cached is not None and current != version:
+                            text = xmlrpc.page(wp)
+
+                if isinstance(text, Exception):
+                    error = text
+                    text = ''
+                if perm < 1:
+                    text = ''
+
+                if isinstance(locked, Exception):
+                    locked = False
+                if perm < 2:
+                    locked = None
+
+                return perm, text, current, locked, error
+
+            def loaded(result):
+                perm, text, current, locked, error = result
+                if text and current:
+                    if text is not cached:
+                        self.cache_page(wp, current, text, current=not rev)
+                elif not rev and perm >= 1:
+                    self.drop_page(wp)
+                # saving an old revision overwrites whatever is current
+                base = None if rev else (current if text else 0)
+                # a save which hasn't been uploaded yet is newer
+                if not rev and wp in self.journal.entries:
+                    text = self.journal.entries[wp]['text']
+                    base = self.journal.entries[wp].get('base')
+                self.edit_loaded(wp, callback, perm, text, locked, error, base)
+
+            def failed(err):
+                if isinstance(err, dokuwikixmlrpc.DokuWikiXMLRPCError):
+                    self.request_failed(err)
+                else:
+                    # the remote wiki isn't reachable, fall back to the cache
+                    print('DokuVimKi Error: %s' % err, file=sys.stderr)
+                    self.edit_offline(wp, rev, callback)
 
-                if text:
-                    if perm == 1:
-                        print("You don't have permission to edit %s. Opening readonly!" % wp, file=sys.stderr)
-                        self.buffers[wp] = Buffer(wp, 'nowrite', True)
-                        self.buffers[wp].buf[:] = text.split("\n")
-                        vim.command('setlocal nomodifiable')
-                        vim.command('setlocal readonly')
-
-                    if perm >= 2:
-                        if not self.lock(wp):
-                            return
+            self.request('page ' + wp, fetch, loaded, failed)
+
+        else:
+            vim.command('silent! buffer! ' + self.buffers[wp].num)
+            if callback:
+                callback()
 
-                        print("Opening %s for editing ..." % wp, file=sys.stdout)
-                        self.buffers[wp] = Buffer(wp, 'acwrite', True)
-                        self.buffers[wp].page[:] = text.split("\n")
-                        self.buffers[wp].buf[:] = self.buffers[wp].page
+    def edit_offline(self, wp, rev='', callback=None):
+        """
+        Opens the cached text of a page, or its pending save from the
+        journal, without contacting the remote wiki. The page isn't locked.
+        """
 
-                        vim.command('set nomodified')
-                        vim.command('autocmd! BufWriteCmd <buffer> Py dokuvimki.save()')
-                        vim.command('autocmd! FileWriteCmd <buffer> Py dokuvimki.save()')
-                        vim.command('autocmd! FileAppendCmd <buffer> Py dokuvimki.save()')
+        base = None
+        if rev:
+            text = self.page_cache.get(wp, int(rev))
+        elif wp in self.journal.entries:
+            text = self.journal.entries[wp]['text']
+            base = self.journal.entries[wp].get('base')
+        else:
+            text = self.page_cache.get(wp)
+            base = self.page_cache.revision(wp)
 
-                if not text and perm >= 4:
-                    print("Creating new page: %s" % wp, file=sys.stdout)
-                    self.buffers[wp] = Buffer(wp, 'acwrite', True)
-                    self.needs_refresh = True
+        if not text:
+            print("DokuVimKi Error: %s is not available offline." % wp, file=sys.stderr)
+            return
 
-                    vim.command('set nomodified')
-                    vim.command('autocmd! BufWriteCmd <buffer> Py dokuvimki.save()')
-                    vim.command('autocmd! FileWriteCmd <buffer> Py dokuvimki.save()')
-                    vim.command('autocmd! FileAppendCmd <buffer> Py dokuvimki.save()')
+        print("Opening the cached copy of %s, saves are kept until they can be uploaded." % wp, file=sys.stdout)
+        self.edit_loaded(wp, callback, 2, text, None, None, base)
 
-                self.buffer_setup()
+    def edit_loaded(self, wp, callback, perm, text, locked, error, base=None):
+        """
+        Sets up the buffer of a page loaded by edit(). Pages opened without
+        locking them have no locked result. base is the revision saves of
+        the page are based on.
+        """
 
-            else:
-                print("You don't have permissions to read/edit/create %s" % wp, file=sys.stderr)
+        if error:
+            print(error, file=sys.stdout)
+
+        if wp in self.buffers:
+            return
+
+        if perm >= 1:
+            self.focus(2)
+
+            if text:
+                if perm == 1:
+                    print("You don't have permission to edit %s. Opening readonly!" % wp, file=sys.stderr)
+                    self.buffers[wp] = Buffer(wp, 'nowrite', True)
+                    self.buffers[wp].reset(text.split("\n"))
+                    vim.command('setlocal nomodifiable')
+                    vim.command('setlocal readonly')
+
+                if perm >= 2:
+                    if locked is not None:
+                        if not self.locked(wp, locked):
+                            return
+                        self.locks.add(wp)
+
+                    print("Opening %s for editing ..." % wp, file=sys.stdout)
+                    self.buffers[wp] = Buffer(wp, 'acwrite', True)
+                    self.buffers[wp].reset(text.split("\n"))
+
+                    vim_commands(['autocmd! BufWriteCmd <buffer> Py dokuvimki.save()',
+                                  'autocmd! FileWriteCmd <buffer> Py dokuvimki.save()',
+                                  'autocmd! FileAppendCmd <buffer> Py dokuvimki.save()',
+                                  'autocmd! TextChanged,InsertLeave <buffer> Py dokuvimki.check_links()'])
+
+            if not text and perm >= 4:
+                if locked is not None:
+                    if not self.locked(wp, locked):
+                        return
+                    self.locks.add(wp)
+                print("Creating new page: %s" % wp, file=sys.stdout)
+                self.buffers[wp] = Buffer(wp, 'acwrite', True)
+
+                vim_commands(['set nomodified',
+                              'autocmd! BufWriteCmd <buffer> Py dokuvimki.save()',
+                              'autocmd! FileWriteCmd <buffer> Py dokuvimki.save()',
+                              'autocmd! FileAppendCmd <buffer> Py dokuvimki.save()',
+                              'autocmd! TextChanged,InsertLeave <buffer> Py dokuvimki.check_links()'])
+
+            if not text and perm < 4:
+                print("You don't have permission to create %s" % wp, file=sys.stderr)
+
+            if wp not in self.buffers:
+                # the page was locked along with loading it, but isn't opened
+                if locked and wp in locked.get('locked', []):
+                    self.unlock(wp)
                 return
 
+            self.buffers[wp].rev = base
+            self.buffer_setup(self.buffers[wp])
+            self.check_links(wp)
+            self.prefetch_links(wp)
+            if self.lock_timer is None:
+                self.schedule_locks()
+
+            # media of the namespace are likely to be linked
+            self.load_media(PageIndex.media_namespace(wp))
+
+            if callback:
+                callback()
+
         else:
-            self.needs_refresh = False
-            vim.command('silent! buffer! ' + self.buffers[wp].num)
+            print("You don't have permissions to read/edit/create %s" % wp, file=sys.stderr)
 
     def diff(self, revline):
         """
-        Opens a page and a given revision in diff mode.
+        Opens a page and a given revision in diff mode.
+        """
+
+        data = revline.split()
+        wp = data[0]
+        rev = data[2]
+        date = time.strftime('%Y-%m-%d@%Hh%mm%Ss', time.localtime(float(rev)))
+
+        if wp not in self.buffers:
+            self.edit(wp, callback=lambda: self.diff(revline))
+            return
+
+        if rev not in self.buffers[wp].diff:
+
+            def loaded(text):
+                if wp not in self.buffers:
+                    return
+                if text:
+                    self.buffers[wp].diff[rev] = Buffer(wp + '_' + date, 'nofile')
+                    self.buffers[wp].diff[rev].page[:] = text.split("\n")
+                    self.diff(revline)
+                else:
+                    print("Error, couldn't load revision for diffing.", file=sys.stdout)
+
+            self.revision_text(wp, int(rev), loaded)
+            return
+
+        self.focus(2)
+        vim_commands(['silent! buffer! ' + self.buffers[wp].num, 'vertical diffsplit'])
+        self.focus(3)
+        vim.command('silent! buffer! ' + self.buffers[wp].diff[rev].num)
+        self.buffers[wp].diff[rev].set_lines(self.buffers[wp].diff[rev].page)
+        self.buffer_setup(self.buffers[wp].diff[rev], ['abbr <buffer> close DWdiffclose',
+                                                        'abbr <buffer> DWclose DWdiffclose'])
+        vim.command('diffthis')
+        self.focus(2)
+        self.diffmode = True
+
+    def compare(self, wp, old, new=0):
+        """
+        Shows the changes between two revisions of a page as unified diff.
+        The new revision defaults to the current one.
+        """
+
+        if self.diffmode:
+            self.diff_close()
+
+        old = int(old)
+        new = int(new)
+        texts = {}
+
+        self.focus(2)
+        vim.command('silent! buffer! ' + self.buffers['compare'].num)
+        self.buffers['compare'].setup(['setlocal syntax=diff'])
+        self.buffers['compare'].set_lines([])
+
+        def label(rev):
+            if not rev:
+                return wp + ' (current)'
+            return wp + ' ' + time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(rev))
+
+        def loaded(which, text):
+            texts[which] = text
+            if len(texts) < 2:
+                return
+
+            lines = list(difflib.unified_diff(texts['old'].split("\n"), texts['new'].split("\n"),
+                                              label(old), label(new), lineterm=''))
+            self.buffers['compare'].set_lines(lines or ['No differences.'])
+
+        self.revision_text(wp, old, lambda text: loaded('old', text))
+        self.revision_text(wp, new, lambda text: loaded('new', text))
+
+    def revision_text(self, wp, rev, callback):
+        """
+        Calls callback with the text of a revision of a page, or of the
+        current revision if rev is 0. Revisions never change and are taken
+        from the page cache if possible.
         """
 
-        data = revline.split()
-        wp = data[0]
-        rev = data[2]
-        date = time.strftime('%Y-%m-%d@%Hh%mm%Ss', time.localtime(float(rev)))
+        if rev:
+            text = self.page_cache.get(wp, rev)
+            if text is not None:
+                callback(text)
+                return
 
-        if wp not in self.buffers:
-            self.edit(wp)
+            def fetch(xmlrpc):
+                return rev, xmlrpc.page(wp, rev)
 
-        if rev not in self.buffers[wp].diff:
-            text = self.xmlrpc.page(wp, int(rev))
-            if text:
-                self.buffers[wp].diff[rev] = Buffer(wp + '_' + date, 'nofile')
-                self.buffers[wp].diff[rev].page[:] = text.split("\n")
-            else:
-                print("Error, couldn't load revision for diffing.", file=sys.stdout)
-                return
+        else:
 
-        self.focus(2)
-        vim.command('silent! buffer! ' + self.buffers[wp].num)
-        vim.command('vertical diffsplit')
-        self.focus(3)
-        vim.command('silent! buffer! ' + self.buffers[wp].diff[rev].num)
-        vim.command('setlocal modifiable')
-        vim.command('abbr <buffer> close DWdiffclose')
-        vim.command('abbr <buffer> DWclose DWdiffclose')
-        self.buffers[wp].diff[rev].buf[:] = self.buffers[wp].diff[rev].page
-        vim.command('setlocal nomodifiable')
-        self.buffer_setup()
-        vim.command('diffthis')
-        self.focus(2)
-        self.diffmode = True
+            def fetch(xmlrpc):
+                info, text = xmlrpc.multicall([('wiki.getPageInfo', [wp]), ('wiki.getPage', [wp])])
+                if isinstance(text, Exception):
+                    raise text
+                if isinstance(info, Exception):
+                    return None, text
+                return int(info['version']), text
+
+        def loaded(result):
+            version, text = result
+            if text and version:
+                self.cache_page(wp, version, text, current=not rev)
+            callback(text)
+
+        self.request('revision ' + wp, fetch, loaded)
 
     def diff_close(self):
         """
@@ -278,105 +2586,672 @@ class DokuVimKi:
                 print("Error: Current buffer %s is readonly!" % wp, file=sys.stderr)
             else:
                 text = "\n".join(self.buffers[wp].buf)
-                if text and not self.ismodified(wp):
+                if has_conflicts(self.buffers[wp].buf):
+                    print("Error: Resolve the merge conflicts in %s before saving!" % wp, file=sys.stderr)
+                elif text and not self.ismodified(wp):
                     print("No unsaved changes in current buffer.", file=sys.stdout)
-                elif not text and wp not in self.pages:
+                elif not text and wp not in self.page_index.pages:
                     print("Can't save new empty page %s." % wp, file=sys.stdout)
                 else:
                     if not sum and text:
                         sum = self.default_sum
                         minor = 1
 
+                    # the save is safe once it is in the journal, uploading
+                    # it happens in the background
                     try:
-                        self.xmlrpc.put_page(wp, text, sum, minor)
-                        self.buffers[wp].page[:] = self.buffers[wp].buf
-                        self.buffers[wp].need_save = False
-
-                        if text:
-                            vim.command('silent! buffer! ' + self.buffers[wp].num)
-                            vim.command('set nomodified')
-                            print('Page %s written!' % wp, file=sys.stdout)
-
-                            if self.needs_refresh:
-                                self.index(self.cur_ns, True)
-                                self.needs_refresh = False
-                                self.focus(2)
-                        else:
-                            print('Page %s removed!' % wp, file=sys.stdout)
-                            self.close(wp)
-                            self.index(self.cur_ns, True)
-                            self.focus(2)
-
-                    except dokuwikixmlrpc.DokuWikiXMLRPCError as err:
-                        print('DokuVimKi Error: %s' % err, file=sys.stderr)
+                        self.journal.add(wp, text, sum, minor, self.buffers[wp].rev)
+                    except (IOError, OSError) as err:
+                        print("DokuVimKi Error: Failed to write the save journal: %s" % err, file=sys.stderr)
+                        return
+
+                    self.saved(wp, text)
+                    self.flush()
         except KeyError as err:
             print("Error: Current buffer %s is not handled by DWsave!" % wp, file=sys.stderr)
 
-    def upload(self, file, overwrite=False):
+    def cache_page(self, wp, rev, text, current=True):
+        """
+        Adds a revision of a page to the page cache and, if it is the current
+        revision, to the search index.
+        """
+
+        self.page_cache.put(wp, rev, text, current)
+        if current and self.page_cache.revision(wp) == rev:
+            self.search_index.add(wp, rev, text)
+            self.link_graph.add(wp, rev, text)
+
+    def drop_page(self, wp):
+        """
+        Forgets the current text of a page, e.g. because it was deleted.
+        """
+
+        self.page_cache.drop(wp)
+        self.search_index.remove(wp)
+        self.link_graph.remove(wp)
+
+    def fetch_pages(self, pages, label):
+        """
+        Downloads the current texts of pages, given as (page, revision)
+        tuples, into the page cache and the search index. A request is made
+        per batch of pages.
+        """
+
+        batch = 50
+        for i in range(0, len(pages), batch):
+            chunk = pages[i:i + batch]
+
+            def fetch(xmlrpc, chunk=chunk):
+                return xmlrpc.multicall([('wiki.getPage', [wp]) for wp, rev in chunk])
+
+            def loaded(texts, chunk=chunk):
+                for (wp, rev), text in zip(chunk, texts):
+                    if text and not isinstance(text, Exception):
+                        self.cache_page(wp, rev, text)
+
+            self.request('%s %d/%d' % (label, min(i + batch, len(pages)), len(pages)), fetch, loaded)
+
+    def fetch_namespace(self, ns=''):
+        """
+        Downloads all pages of a namespace which aren't cached yet into the
+        page cache and the search index, so they can be searched and opened
+        offline.
+        """
+
+        ns = ns.strip(':')
+
+        def loaded(pages):
+            missing = [(page['id'], int(page['rev'])) for page in pages
+                       if self.page_cache.revision(page['id']) != int(page['rev'])]
+            print('Fetching %d of %d pages of %s.' % (len(missing), len(pages), ns or 'the wiki'), file=sys.stdout)
+            self.fetch_pages(missing, 'fetch')
+
+        self.request('pagelist ' + ns, lambda xmlrpc: xmlrpc.pagelist(ns, {'depth': 0}), loaded)
+
+    def transfer_pool(self):
+        """
+        Returns the worker running file transfers, None if requests are run
+        synchronously.
+        """
+
+        if self.worker and self.pool is None:
+            self.pool = Worker(self.client, self.transfer_threads)
+        return self.pool
+
+    def transfer(self, mirror, what, jobs, start, skipped, conflicts=(), callback=None):
         """
-        Uploads a file to the remote wiki.
+        Runs the jobs of an export or import, given as (label, func, count)
+        tuples, on the transfer pool and reports the throughput once all are
+        done. func returns the (kind, id, rev, md5) tuples of the files it
+        transferred, which are recorded in the manifest of the mirror.
+        callback is called with the number of transferred files at the end.
         """
 
-        path = os.path.realpath(file)
-        fname = os.path.basename(path)
+        progress = {'pending': len(jobs), 'pages': 0, 'media': 0, 'failed': 0}
 
-        if os.path.isfile(path):
+        def finished():
+            progress['pending'] -= 1
+            if progress['pending'] > 0:
+                return
             try:
-                fh = open(path, 'rb')
-                data = fh.read()
-                file_id = self.cur_ns + fname
+                mirror.close()
+            except (IOError, OSError) as err:
+                print('DokuVimKi Error: Could not write the manifest of %s: %s' % (mirror.dirname, err),
+                      file=sys.stderr)
+
+            elapsed = max(time.time() - start, 1e-6)
+            print("%s %d pages and %d media files in %.1fs (%.1f pages/s), %d unchanged, %d failed."
+                  % (what, progress['pages'], progress['media'], elapsed, progress['pages'] / elapsed,
+                     skipped, progress['failed']), file=sys.stdout)
+            if conflicts:
+                print("Skipped %d pages changed on the remote wiki since they were exported: %s"
+                      % (len(conflicts), ', '.join(sorted(conflicts))), file=sys.stderr)
+            if callback:
+                callback(progress['pages'] + progress['media'])
+
+        def done(records):
+            for kind, id, rev, md5 in records:
+                progress[kind] += 1
                 try:
-                    self.xmlrpc.put_file(file_id, data, overwrite)
-                    print("Uploaded %s successfully." % fname, file=sys.stdout)
-                    self.refresh()
-                except dokuwikixmlrpc.DokuWikiXMLRPCError as err:
-                    print(err, file=sys.stderr)
-            except IOError as err:
-                print(err, file=sys.stderr)
+                    mirror.record(kind, id, rev, md5)
+                except (IOError, OSError) as err:
+                    print('DokuVimKi Error: Could not write the manifest of %s: %s' % (mirror.dirname, err),
+                          file=sys.stderr)
+            finished()
+
+        def failed(err, count):
+            progress['failed'] += count
+            print('DokuVimKi Error: %s' % err, file=sys.stderr)
+            finished()
+
+        if not jobs:
+            progress['pending'] = 1
+            finished()
+            return
+
+        pool = self.transfer_pool()
+        for label, func, count in jobs:
+            self.request(label, func, done, lambda err, count=count: failed(err, count), pool)
+
+    def export(self, args, media=False):
+        """
+        Downloads all pages of a namespace, and all its media files if media
+        is set, into a local directory. Files which haven't changed since
+        they were last exported are skipped.
+        """
+
+        if len(args) != 2:
+            print('Usage: DWexport[!] <namespace> <directory>', file=sys.stderr)
+            return
+
+        mirror = Mirror(args[1], args[0])
+        mirror.load()
+        ns = mirror.ns
+        start = time.time()
+        batch = 20
+
+        def fetch_pages(xmlrpc, chunk):
+            texts = xmlrpc.multicall([('wiki.getPage', [wp]) for wp, rev in chunk])
+            records = []
+            for (wp, rev), text in zip(chunk, texts):
+                if isinstance(text, Exception):
+                    continue
+                data = text.encode('utf-8')
+                write_atomic(mirror.path('pages', wp), data)
+                records.append(('pages', wp, rev, hashlib.md5(data).hexdigest()))
+            return records
+
+        def fetch_file(xmlrpc, file_id, rev, size):
+            self.upload_budget.acquire(size)
+            try:
+                data = xmlrpc.get_file(file_id)
+                write_atomic(mirror.path('media', file_id), data)
+                return [('media', file_id, rev, hashlib.md5(data).hexdigest())]
+            finally:
+                self.upload_budget.release(size)
+
+        def unchanged(kind, id, rev):
+            entry = mirror.get(kind, id)
+            return entry and entry['rev'] == rev and os.path.exists(mirror.path(kind, id))
+
+        def listed(result):
+            pages, files = result
+            jobs = []
+
+            missing = [(page['id'], int(page['rev'])) for page in pages
+                       if not unchanged('pages', page['id'], int(page['rev']))]
+            for i in range(0, len(missing), batch):
+                chunk = missing[i:i + batch]
+                jobs.append(('export %d/%d' % (min(i + batch, len(missing)), len(missing)),
+                             lambda xmlrpc, chunk=chunk: fetch_pages(xmlrpc, chunk), len(chunk)))
+
+            skipped = len(pages) - len(missing)
+            for item in files:
+                # lastModified is a date on some wikis
+                rev = str(item['lastModified'])
+                if unchanged('media', item['id'], rev):
+                    skipped += 1
+                    continue
+                jobs.append(('export ' + item['id'],
+                             lambda xmlrpc, item=item, rev=rev: fetch_file(xmlrpc, item['id'], rev, item['size']), 1))
+
+            self.transfer(mirror, 'Exported', jobs, start, skipped)
+
+        def list_remote(xmlrpc):
+            pages = xmlrpc.pagelist(ns, {'depth': 0})
+            files = xmlrpc.list_files(ns or ':', True) if media else []
+            return pages, files
+
+        print('Exporting %s to %s.' % (ns or 'the wiki', mirror.dirname), file=sys.stdout)
+        self.request('export list ' + ns, list_remote, listed)
+
+    def import_(self, args, media=False):
+        """
+        Uploads the pages, and the media files if media is set, of a local
+        directory written by export() to a namespace. Pages and files which
+        haven't changed since they were exported or imported last, or which
+        are the same on the remote wiki, are skipped, as are pages changed
+        on the remote wiki since they were exported.
+        """
+
+        if len(args) != 2:
+            print('Usage: DWimport[!] <directory> <namespace>', file=sys.stderr)
+            return
+
+        mirror = Mirror(args[0], args[1])
+        if not os.path.isdir(mirror.dirname):
+            print('%s is not a directory' % mirror.dirname, file=sys.stderr)
+            return
+        mirror.load()
+        ns = mirror.ns
+        start = time.time()
+        batch = 20
+
+        def put_pages(xmlrpc, chunk):
+            calls = []
+            for wp, text, md5 in chunk:
+                calls.append(('wiki.putPage', [wp, text, {'sum': 'import', 'minor': False}]))
+                calls.append(('wiki.getPageInfo', [wp]))
+            results = xmlrpc.multicall(calls)
+            records = []
+            for (wp, text, md5), result, info in zip(chunk, results[::2], results[1::2]):
+                if isinstance(result, Exception):
+                    print('DokuVimKi Error: Importing %s failed: %s' % (wp, result), file=sys.stderr)
+                    continue
+                rev = None if isinstance(info, Exception) else int(info['version'])
+                records.append(('pages', wp, rev, md5))
+            return records
+
+        def put_file(xmlrpc, file_id, filename, md5):
+            size = os.path.getsize(filename)
+            self.upload_budget.acquire(size)
+            try:
+                xmlrpc.upload_file(file_id, filename, True)
+                # the new modification time isn't returned, the next export
+                # fetches the file once more
+                return [('media', file_id, None, md5)]
+            finally:
+                self.upload_budget.release(size)
+
+        def scan(xmlrpc):
+            # reading and hashing the local pages doesn't block vim here
+            remote = dict((page['id'], page) for page in xmlrpc.pagelist(ns, {'depth': 0, 'hash': True}))
+            files = dict((item['id'], item) for item in xmlrpc.list_files(ns or ':', True)) if media else {}
+
+            pages = []
+            for wp, filename in mirror.files('pages'):
+                with open(filename, 'rb') as fh:
+                    data = fh.read()
+                pages.append((wp, data.decode('utf-8'), hashlib.md5(data).hexdigest()))
+            local = [(file_id, filename, md5_file(filename)) for file_id, filename in mirror.files('media')] if media else []
+            return pages, remote, files, local
+
+        def scanned(result):
+            pages, remote, files, local = result
+            changed = []
+            conflicts = []
+            skipped = 0
+
+            for wp, text, md5 in pages:
+                entry = mirror.get('pages', wp)
+                page = remote.get(wp)
+                if not text.strip() or (page and page.get('hash') == md5) or (entry and entry['md5'] == md5):
+                    skipped += 1
+                elif entry and page and entry['rev'] is not None and int(page['rev']) != entry['rev']:
+                    conflicts.append(wp)
+                else:
+                    changed.append((wp, text, md5))
+
+            jobs = []
+            for i in range(0, len(changed), batch):
+                chunk = changed[i:i + batch]
+                jobs.append(('import %d/%d' % (min(i + batch, len(changed)), len(changed)),
+                             lambda xmlrpc, chunk=chunk: put_pages(xmlrpc, chunk), len(chunk)))
+
+            for file_id, filename, md5 in local:
+                entry = mirror.get('media', file_id)
+                item = files.get(file_id)
+                if entry and entry['md5'] == md5:
+                    skipped += 1
+                elif entry and item and entry['rev'] is not None and str(item['lastModified']) != entry['rev']:
+                    conflicts.append(file_id)
+                else:
+                    jobs.append(('import ' + file_id,
+                                 lambda xmlrpc, file_id=file_id, filename=filename, md5=md5:
+                                 put_file(xmlrpc, file_id, filename, md5), 1))
+
+            # the index learns about the new pages from the recent changes
+            self.transfer(mirror, 'Imported', jobs, start, skipped, conflicts,
+                          lambda count: count and self.refresh())
+
+        print('Importing %s to %s.' % (mirror.dirname, ns or 'the wiki'), file=sys.stdout)
+        self.request('import scan ' + ns, scan, scanned, None, self.transfer_pool())
+
+    def saved(self, wp, text):
+        """
+        Marks the page buffer unmodified once its text is in the journal.
+        """
+
+        buffer = self.buffers[wp]
+        lines = text.split("\n")
+        buffer.saved = buffer.digest(lines)
+        buffer.page[:] = lines
+        buffer.buf.options['modified'] = False
+        buffer.tick = buffer.changedtick()
+        buffer.need_save = False
+
+    def flush(self, force=False):
+        """
+        Uploads the pending saves of the journal in the background. Saves
+        waiting for a retry or refused by the remote wiki are only uploaded
+        if force is set.
+        """
+
+        if self.flush_timer is not None:
+            vim.command('call timer_stop(%s)' % self.flush_timer)
+            self.flush_timer = None
+
+        if not self.offline:
+            for wp in self.journal.ready(force):
+                # uploads finished synchronously may have flushed it already
+                if wp not in self.uploading and wp in self.journal.entries:
+                    self.upload_page(wp, self.journal.entries[wp])
+
+            due = self.journal.next_due()
+            if due is not None and self.timers:
+                delay = max(0, int((due - time.time()) * 1000))
+                self.flush_timer = vim.eval("timer_start(%d, 'DokuVimKiFlush')" % delay)
+
+        self.update_status()
+
+    def upload_page(self, wp, entry):
+        """
+        Uploads a pending save of the journal. If the page has been changed
+        on the remote wiki since the revision the save is based on, the save
+        is merged with the changes instead, see merge_page().
+        """
+
+        base = entry.get('base')
+        base_text = '' if base == 0 else self.page_cache.get(wp, base) if base else None
+
+        def changed(xmlrpc):
+            # returns the current revision and text if it isn't base
+            info, = xmlrpc.multicall([('wiki.getPageInfo', [wp])])
+            if isinstance(info, Exception) or int(info['version']) == base:
+                return None
+            calls = [('wiki.getPage', [wp])]
+            if base_text is None:
+                calls.append(('wiki.getPageVersion', [wp, base]))
+            texts = xmlrpc.multicall(calls)
+            for text in texts:
+                if isinstance(text, Exception):
+                    raise text
+            return int(info['version']), texts[0], texts[1] if base_text is None else base_text
+
+        # the new revision is needed to keep the page cache valid and comes
+        # with the same round trip
+        def put(xmlrpc):
+            if base is not None:
+                current = changed(xmlrpc)
+                if current is not None:
+                    return current
+            result, info = xmlrpc.multicall([
+                ('wiki.putPage', [wp, entry['text'], {'sum': entry['sum'], 'minor': entry['minor']}]),
+                ('wiki.getPageInfo', [wp])])
+            if isinstance(result, Exception):
+                raise result
+            if isinstance(info, Exception):
+                return None
+            return int(info['version'])
+
+        def done(result):
+            if isinstance(result, tuple):
+                self.merge_page(wp, entry, *result)
+            else:
+                self.uploaded(wp, entry, result)
+
+        self.uploading.add(wp)
+        self.journal.due.pop(wp, None)
+        self.request('save ' + wp, put, done, lambda err: self.upload_failed(wp, entry, err))
+
+    def merge_page(self, wp, entry, rev, theirs, base_text):
+        """
+        Merges a pending save with the changes made on the remote wiki since
+        the revision it is based on, revision rev with the text theirs. The
+        merged text is uploaded if there are no conflicts, otherwise it is
+        shown in the buffer of the page for resolving them.
+        """
+
+        self.uploading.discard(wp)
+        if theirs:
+            self.cache_page(wp, rev, theirs)
+
+        # saved again meanwhile, that save gets merged once it's uploaded
+        if self.journal.entries.get(wp) is not entry:
+            self.flush()
+            return
+
+        merged, conflicts = merge3(base_text.split("\n"), entry['text'].split("\n"), theirs.split("\n"),
+                                   'revision %d' % rev)
+        text = "\n".join(merged)
+
+        buffer = self.buffers.get(wp)
+        # the buffer shows the text of the save, not newer changes
+        current = buffer is not None and Buffer.digest(buffer.buf[:]) == Buffer.digest(entry['text'].split("\n"))
+
+        if not conflicts:
+            print("Merged %s with the changes of revision %d." % (wp, rev), file=sys.stdout)
+            try:
+                self.journal.add(wp, text, entry['sum'], entry['minor'], rev)
+            except (IOError, OSError) as err:
+                print("DokuVimKi Error: Failed to write the save journal: %s" % err, file=sys.stderr)
+                return
+            if current:
+                buffer.reset(merged)
+                buffer.rev = rev
+            self.flush()
+            return
+
+        self.journal.fail(wp, 'merge conflicts with revision %d' % rev)
+        print("DokuVimKi Error: %s has been changed on the remote wiki, resolve %d merge conflict(s) and save again."
+              % (wp, conflicts), file=sys.stderr)
+
+        # the merged text still needs saving, so the buffer stays modified
+        def show():
+            buffer = self.buffers.get(wp)
+            if buffer is not None:
+                buffer.update(merged)
+                buffer.rev = rev
+
+        if buffer is None:
+            self.edit(wp, callback=show)
+        elif current:
+            show()
+        self.update_status()
+
+    def uploaded(self, wp, entry, rev):
+        """
+        Updates the page cache and the index after a page has been uploaded
+        as revision rev.
+        """
+
+        self.uploading.discard(wp)
+        if not self.journal.remove(wp, entry) and rev:
+            # a newer save of the page was made on top of this one
+            self.journal.rebase(wp, entry.get('base'), rev)
+        if rev and wp in self.buffers and self.buffers[wp].rev == entry.get('base'):
+            self.buffers[wp].rev = rev
+        text = entry['text']
+
+        if text and rev:
+            self.cache_page(wp, rev, text)
+        else:
+            self.drop_page(wp)
+
+        if text:
+            print('Page %s written!' % wp, file=sys.stdout)
+
+            if wp not in self.page_index.pages:
+                self.page_index.add_page(wp)
+                self.index_changed()
+                self.redraw_index()
+        else:
+            print('Page %s removed!' % wp, file=sys.stdout)
+            if wp in self.buffers:
+                # whichever window is current is left alone, only the buffer
+                # of the page is deleted
+                buffer = self.forget(wp)
+                vim.command('silent! bdel! ' + buffer.num)
+                if buffer.type == 'acwrite':
+                    self.unlock(wp)
+                self.update_status()
+            self.page_index.remove_page(wp)
+            self.index_changed()
+            self.redraw_index()
+
+        # saving a page removes its lock on the remote wiki
+        if wp in self.locks and wp in self.buffers:
+            self.renew_locks()
+
+        # the page may have been saved again in the meantime
+        self.flush()
+
+    def upload_failed(self, wp, entry, err):
+        """
+        Keeps a save whose upload failed in the journal. Network errors are
+        retried later, saves refused by the remote wiki only by DWflush.
+        """
+
+        self.uploading.discard(wp)
+
+        if isinstance(err, dokuwikixmlrpc.DokuWikiXMLRPCError):
+            self.journal.fail(wp, err)
+            print('DokuVimKi Error: Saving %s failed: %s. Use DWflush to retry.' % (wp, err), file=sys.stderr)
         else:
-            print('%s is not a file' % path, file=sys.stderr)
+            delay = self.journal.retry(wp)
+            print('DokuVimKi Error: Saving %s failed: %s. Retrying in %d seconds.' % (wp, err, delay), file=sys.stderr)
+
+        self.flush()
+
+    def go_offline(self):
+        """
+        Stops contacting the remote wiki. Cached pages can still be opened
+        and saves are kept in the journal.
+        """
+
+        self.offline = True
+        print('DokuVimKi is offline, saves are kept until DWonline.', file=sys.stdout)
+        self.flush()
+
+    def go_online(self):
+        """
+        Reconnects to the remote wiki, uploads the pending saves and syncs
+        the page index.
+        """
+
+        self.offline = False
+        self.request('login', lambda xmlrpc: xmlrpc.dokuwiki_version, self.connected, self.login_failed)
+        self.flush(True)
+        self.refresh()
+        self.renew_locks()
+
+    def upload(self, files, overwrite=False, callback=None):
+        """
+        Uploads files to the current namespace of the remote wiki. Files may
+        be given as a single name or a list of names, glob patterns and
+        directories (their files are uploaded). Files are uploaded in
+        parallel, only as many of them at once as fit into the upload memory
+        budget. Calls callback once all uploads are done.
+        """
+
+        if not isinstance(files, list):
+            files = [files]
+        overwrite = bool(overwrite)
+
+        filenames = []
+        for pattern in files:
+            for match in sorted(glob.glob(os.path.expanduser(pattern))) or [pattern]:
+                if os.path.isdir(match):
+                    filenames += sorted(os.path.join(match, name) for name in os.listdir(match)
+                                        if os.path.isfile(os.path.join(match, name)))
+                elif os.path.isfile(match):
+                    filenames.append(os.path.realpath(match))
+                else:
+                    print('%s is not a file' % match, file=sys.stderr)
+
+        if not filenames:
+            return
+
+        pool = self.transfer_pool()
+        progress = {'done': 0, 'failed': 0}
+        ns = self.cur_ns
+
+        def finished():
+            if progress['done'] + progress['failed'] < len(filenames):
+                return
+            if len(filenames) > 1:
+                print("Uploaded %d of %d files." % (progress['done'], len(filenames)), file=sys.stdout)
+            # only the uploaded media are added to the index
+            self.page_index.save()
+            self.media_changed()
+            if callback:
+                callback()
+
+        for i, filename in enumerate(filenames):
+            fname = os.path.basename(filename)
+            size = os.path.getsize(filename)
+
+            def put(xmlrpc, filename=filename, file_id=ns + fname, size=size):
+                self.upload_budget.acquire(size)
+                try:
+                    return xmlrpc.upload_file(file_id, filename, overwrite)
+                finally:
+                    self.upload_budget.release(size)
+
+            def uploaded(result, fname=fname, file_id=ns + fname):
+                progress['done'] += 1
+                # the remote wiki returns the cleaned up id
+                self.page_index.add_media(result if isinstance(result, str) else file_id)
+                print("Uploaded %s successfully (%d/%d)." % (fname, progress['done'] + progress['failed'], len(filenames)),
+                      file=sys.stdout)
+                finished()
+
+            def failed(err, fname=fname):
+                progress['failed'] += 1
+                print("DokuVimKi Error: Uploading %s failed: %s" % (fname, err), file=sys.stderr)
+                finished()
+
+            self.request('upload %s (%d/%d)' % (fname, i + 1, len(filenames)), put, uploaded, failed, pool)
 
     def paste_image(self, after):
         """
         Uploads an image from the clipboard to the remote wiki
         and paste the media link into the buffer.
         """
-        if not has_pil:
+        # only needed here and slow to import
+        try:
+            from PIL import ImageGrab
+        except ImportError:
             print('DokuVimKi Error: The PIL python module is missing!', file=sys.stderr)
             return
+        import shutil
+        from tempfile import mkdtemp
 
         img = ImageGrab.grabclipboard()
         if img is None:
             return
 
-        with TemporaryDirectory() as tmpdir:
-            img_name = vim.exec_lua("return vim.fn.input('File Name? ', '')")
-            img_name = path.basename(img_name)
-            if img_name == "":
-                timestamp = int(time.time())
-                img_name = f"image_{timestamp}"
+        img_name = vim.exec_lua("return vim.fn.input('File Name? ', '')")
+        img_name = path.basename(img_name)
+        if img_name == "":
+            timestamp = int(time.time())
+            img_name = f"image_{timestamp}"
 
-            img_path = path.abspath(path.join(tmpdir, f"{img_name}.png"))
-            img.save(img_path, "PNG")
+        # the upload reads the file in the background, it is removed after
+        tmpdir = mkdtemp()
+        img_path = path.abspath(path.join(tmpdir, f"{img_name}.png"))
+        img.save(img_path, "PNG")
 
-            img_ns = self.cur_ns
-            if self.img_sub_ns:
-                img_ns = f"{img_ns}{self.img_sub_ns}:"
+        img_ns = self.cur_ns
+        if self.img_sub_ns:
+            img_ns = f"{img_ns}{self.img_sub_ns}:"
 
-            old_ns = self.cur_ns
-            self.cur_ns = img_ns
-            self.upload(img_path, True)
+        old_ns = self.cur_ns
+        self.cur_ns = img_ns
+        try:
+            self.upload(img_path, True, lambda: shutil.rmtree(tmpdir, True))
+        finally:
             self.cur_ns = old_ns
 
-            img_url = f"{img_ns}{img_name}.png"
-            pattern = "{{" + img_url + "}}"
-            if vim.eval("mode()") in ["v", "V"]:
-                vim.command(f"normal! c{pattern}")
+        img_url = f"{img_ns}{img_name}.png"
+        pattern = "{{" + img_url + "}}"
+        if vim.eval("mode()") in ["v", "V"]:
+            vim.command(f"normal! c{pattern}")
+        else:
+            if after:
+                vim.command(f"normal! a{pattern}")
             else:
-                if after:
-                    vim.command(f"normal! a{pattern}")
-                else:
-                    vim.command(f"normal! i{pattern}")
+                vim.command(f"normal! i{pattern}")
 
     def cd(self, query=''):
         """
@@ -393,22 +3268,24 @@ class DokuVimKi:
         Build the index used to navigate the remote wiki.
         """
 
-        index = []
-        pages = []
-        dirs = []
-
         self.focus(1)
-        vim.command('set winwidth=' + self.index_winwith)
-        vim.command('set winminwidth=' + self.index_winwith)
-
-        vim.command('silent! buffer! ' + self.buffers['index'].num)
-        vim.command('setlocal modifiable')
-        vim.command('setlocal nonumber')
-        vim.command('syn match DokuVimKi_NS /^.*\//')
-        vim.command('syn match DokuVimKi_CURNS /^ns:/')
-
-        vim.command('hi DokuVimKi_NS term=bold cterm=bold ctermfg=LightBlue gui=bold guifg=LightBlue')
-        vim.command('hi DokuVimKi_CURNS term=bold cterm=bold ctermfg=Yellow gui=bold guifg=Yellow')
+        vim_commands([
+            'set winwidth=' + self.index_winwith,
+            'set winminwidth=' + self.index_winwith,
+            'silent! buffer! ' + self.buffers['index'].num,
+        ])
+
+        self.buffers['index'].setup([
+            'setlocal nonumber',
+            'syn match DokuVimKi_NS /^.*\//',
+            'syn match DokuVimKi_CURNS /^ns:/',
+            'hi DokuVimKi_NS term=bold cterm=bold ctermfg=LightBlue gui=bold guifg=LightBlue',
+            'hi DokuVimKi_CURNS term=bold cterm=bold ctermfg=Yellow gui=bold guifg=Yellow',
+            'map <silent> <buffer> <enter> :Py dokuvimki.cmd("index")<CR>',
+            'map <silent> <buffer> r :Py dokuvimki.cmd("revisions")<CR>',
+            'map <silent> <buffer> b :Py dokuvimki.cmd("backlinks")<CR>',
+            'map <silent> <buffer> R :Py dokuvimki.reload()<CR>',
+        ])
 
         if refresh:
             self.refresh()
@@ -419,46 +3296,32 @@ class DokuVimKi:
         else:
             self.cur_ns = query
 
-        if self.pages:
-            for page in self.pages:
-                if not query:
-                    if ':' not in page:
-                        pages.append(page)
-                    else:
-                        ns = page.split(':', 1)[0] + '/'
-                        if ns not in dirs:
-                            dirs.append(ns)
-                else:
-                    if re.search('^' + query, page):
-                        page = page.replace(query, '')
-                        if page.find(':') == -1:
-                            if page not in index:
-                                pages.append(page)
-                        else:
-                            ns = page.split(':', 1)[0] + '/'
-                            if ns not in dirs:
-                                dirs.append(ns)
+        self.redraw_index()
+        vim.command('2')
+
+    def redraw_index(self):
+        """
+        Renders the current namespace into the index buffer without changing
+        the window focus.
+        """
+
+        if not self.pages:
+            return
+
+        with self.stats.measure('index render'):
+            index = []
+            dirs, pages = self.page_index.listing(self.cur_ns)
 
             index.append('ns: ' + self.cur_ns)
 
-            if query:
+            if self.cur_ns:
                 index.append('.. (up a namespace)')
 
             index.append('')
 
-            pages.sort()
-            dirs.sort()
-            index = index + dirs + pages
-
-            self.buffers['index'].buf[:] = index
+            index = index + [ns + '/' for ns in dirs] + pages
 
-            vim.command('map <silent> <buffer> <enter> :Py dokuvimki.cmd("index")<CR>')
-            vim.command('map <silent> <buffer> r :Py dokuvimki.cmd("revisions")<CR>')
-            vim.command('map <silent> <buffer> b :Py dokuvimki.cmd("backlinks")<CR>')
-            vim.command('map <silent> <buffer> R :Py dokuvimki.index("", True)<CR>')
-
-            vim.command('setlocal nomodifiable')
-            vim.command('2')
+            self.buffers['index'].set_lines(index)
 
     def changes(self, timeframe=False):
         """
@@ -468,11 +3331,6 @@ class DokuVimKi:
         if self.diffmode:
             self.diff_close()
 
-        self.focus(2)
-
-        vim.command('silent! buffer! ' + self.buffers['changes'].num)
-        vim.command('setlocal modifiable')
-
         if not timeframe:
             timestamp = int(time.time()) - (60 * 60 * 24 * 7)
         else:
@@ -491,26 +3349,54 @@ class DokuVimKi:
                 print("Wrong timeframe format %s." % timeframe, file=sys.stderr)
                 return
 
-        try:
-            changes = self.xmlrpc.recent_changes(timestamp)
-            if len(changes) > 0:
-                maxlen = max(len(change['name']) for change in changes)
-                fmt = '{name:' + str(maxlen) + '}\t{lastModified}\t{version}\t{author}'
-                self.buffers['changes'].buf[:] = list(reversed([fmt.format(**change) for change in changes]))
-                vim.command('syn match DokuVimKi_REV_PAGE /^\(\w\|:\)*/')
-                vim.command('syn match DokuVimKi_REV_TS /\s\d*\s/')
+        self.focus(2)
 
-                vim.command('hi DokuVimKi_REV_PAGE cterm=bold ctermfg=Yellow gui=bold guifg=Yellow')
-                vim.command('hi DokuVimKi_REV_TS cterm=bold ctermfg=Yellow gui=bold guifg=Yellow')
+        vim.command('silent! buffer! ' + self.buffers['changes'].num)
+        self.changes_shown = timestamp
+        self.buffers['changes'].setup([
+            'syn match DokuVimKi_REV_PAGE /^\(\w\|:\)*/',
+            'syn match DokuVimKi_REV_TS /\s\d*\s/',
+            'hi DokuVimKi_REV_PAGE cterm=bold ctermfg=Yellow gui=bold guifg=Yellow',
+            'hi DokuVimKi_REV_TS cterm=bold ctermfg=Yellow gui=bold guifg=Yellow',
+            'map <silent> <buffer> <enter> :Py dokuvimki.rev_edit()<CR>',
+        ])
+
+        # the change feed is kept up to date by polling, only changes older
+        # than it has been asked for have to be fetched
+        if self.change_feed.covers(timestamp) or self.offline:
+            self.changes_show(True)
+            if self.changes_timer is None:
+                self.refresh(quiet=True)
+            return
 
-                vim.command('setlocal nomodifiable')
-                vim.command('map <silent> <buffer> <enter> :Py dokuvimki.rev_edit()<CR>')
+        def fetch(xmlrpc):
+            return xmlrpc.time(), xmlrpc.recent_changes(timestamp)
 
-            else:
-                print('DokuVimKi Error: No changes', file=sys.stderr)
+        def loaded(result):
+            now, changes = result
+            self.change_feed.merge(changes, timestamp, now)
+            self.change_feed.save()
+            self.changes_show(True)
 
-        except dokuwikixmlrpc.DokuWikiXMLRPCError as err:
-            print(err, file=sys.stderr)
+        self.request('changes', fetch, loaded, lambda err: print(err, file=sys.stderr))
+
+    def changes_show(self, report=False):
+        """
+        Renders the changes shown by DWchanges from the change feed. With
+        report set it is reported if there are none.
+        """
+
+        if self.changes_shown is None:
+            return
+
+        changes = self.change_feed.since(self.changes_shown)
+        if len(changes) > 0:
+            maxlen = max(len(change['name']) for change in changes)
+            fmt = '{name:' + str(maxlen) + '}\t{lastModified}\t{version}\t{author}'
+            self.buffers['changes'].set_lines([fmt.format(**change) for change in reversed(changes)])
+        elif report:
+            self.buffers['changes'].set_lines([])
+            print('DokuVimKi Error: No changes', file=sys.stderr)
 
     def revisions(self, wp='', first=0):
         """
@@ -523,75 +3409,185 @@ class DokuVimKi:
         if not wp or wp[-1] == ':':
             return
 
-        try:
-            self.focus(2)
-
-            vim.command('silent! buffer! ' + self.buffers['revisions'].num)
-            vim.command('setlocal modifiable')
+        self.focus(2)
 
-            revs = self.xmlrpc.page_versions(wp, int(first))
+        vim.command('silent! buffer! ' + self.buffers['revisions'].num)
+        self.buffers['revisions'].setup([
+            'map <silent> <buffer> <enter> :Py dokuvimki.rev_edit()<CR>',
+            'syn match DokuVimKi_REV_PAGE /^\(\w\|:\)*/',
+            'syn match DokuVimKi_REV_TS /\s\d*\s/',
+            'syn match DokuVimKi_REV_CHANGE /\s\w\{1}\s/',
+            'hi DokuVimKi_REV_PAGE term=bold cterm=bold ctermfg=Yellow gui=bold guifg=Yellow',
+            'hi DokuVimKi_REV_TS term=bold cterm=bold ctermfg=Yellow gui=bold guifg=Yellow',
+            'hi DokuVimKi_REV_CHANGE term=bold cterm=bold ctermfg=Yellow gui=bold guifg=Yellow',
+            'map <silent> <buffer> d :Py dokuvimki.cmd("diff")<CR>',
+            'map <silent> <buffer> c :Py dokuvimki.rev_compare()<CR>',
+            'map <silent> <buffer> C :Py dokuvimki.rev_compare(True)<CR>',
+            'autocmd! CursorMoved <buffer> Py dokuvimki.prefetch_revisions()',
+        ])
+
+        def loaded(revs):
             if revs:
-                self.buffers['revisions'].buf[:] = [wp + "\t" + "\t".join(str(rev[x]) for x in ['modified', 'version', 'ip', 'type', 'user', 'sum'])
-                                                    for rev in revs]
+                self.buffers['revisions'].set_lines([wp + "\t" + "\t".join(str(rev[x]) for x in ['modified', 'version', 'ip', 'type', 'user', 'sum'])
+                                                     for rev in revs])
                 print("loaded revisions for :%s" % wp, file=sys.stdout)
-                vim.command('map <silent> <buffer> <enter> :Py dokuvimki.rev_edit()<CR>')
+                self.prefetch_revisions(1)
+            else:
+                print('DokuVimKi Error: No revisions found for page: %s' % wp, file=sys.stderr)
 
-                vim.command('syn match DokuVimKi_REV_PAGE /^\(\w\|:\)*/')
-                vim.command('syn match DokuVimKi_REV_TS /\s\d*\s/')
-                vim.command('syn match DokuVimKi_REV_CHANGE /\s\w\{1}\s/')
+        self.request('revisions ' + wp, lambda xmlrpc: xmlrpc.page_versions(wp, int(first)), loaded,
+                     lambda err: print('DokuVimKi XML-RPC Error: %s' % err, file=sys.stderr))
 
-                vim.command('hi DokuVimKi_REV_PAGE term=bold cterm=bold ctermfg=Yellow gui=bold guifg=Yellow')
-                vim.command('hi DokuVimKi_REV_TS term=bold cterm=bold ctermfg=Yellow gui=bold guifg=Yellow')
-                vim.command('hi DokuVimKi_REV_CHANGE term=bold cterm=bold ctermfg=Yellow gui=bold guifg=Yellow')
+    def backlinks(self, wp=''):
+        """
+        Display backlinks for a certain page if any. They are looked up in
+        the link graph of the cached pages, if not all pages are cached the
+        remote wiki is asked as well.
+        """
 
-                vim.command('setlocal nomodifiable')
-                vim.command('map <silent> <buffer> d :Py dokuvimki.cmd("diff")<CR>')
+        if not wp:
+            wp = vim.current.buffer.name.rsplit(os.sep, 1)[-1]
+            if wp not in self.buffers or not self.buffers[wp].iswp:
+                return
 
-            else:
-                print('DokuVimKi Error: No revisions found for page: %s' % wp, file=sys.stderr)
+        if wp[-1] == ':':
+            return
 
-        except dokuwikixmlrpc.DokuWikiXMLRPCError as err:
-            print('DokuVimKi XML-RPC Error: %s' % err, file=sys.stderr)
+        local, pages = self.link_graph_pages()
+        blinks = self.link_graph.incoming(wp)
+        complete = len(local) == len(pages) or self.offline
+        if blinks or complete:
+            self.show_links(blinks, 'No backlinks found for page: %s' % wp)
 
-    def backlinks(self, wp=''):
+        if not complete:
+
+            def loaded(remote):
+                merged = sorted(set(blinks) | set(str(link) for link in remote))
+                if merged != blinks or not blinks:
+                    self.show_links(merged, 'No backlinks found for page: %s' % wp)
+
+            self.request('backlinks ' + wp, lambda xmlrpc: xmlrpc.backlinks(wp), loaded,
+                         lambda err: print('DokuVimKi XML-RPC Error: %s' % err, file=sys.stderr))
+
+    def links(self, wp=''):
+        """
+        Shows the pages a page, by default the current one, links to. Links
+        to pages which don't exist are marked.
+        """
+
+        if not wp:
+            wp = vim.current.buffer.name.rsplit(os.sep, 1)[-1]
+
+        self.link_graph_pages()
+        if wp in self.buffers and self.buffers[wp].iswp:
+            # the buffer may have been changed since
+            links = LinkGraph.links(wp, "\n".join(self.buffers[wp].buf))
+        else:
+            links = self.link_graph.outgoing(wp)
+            if links is None:
+                print('DokuVimKi Error: %s is not cached, open it or use DWfetch.' % wp, file=sys.stderr)
+                return
+
+        self.show_links([link if link in self.page_index.pages else link + '  (missing)' for link in links],
+                        'No links found on page: %s' % wp)
+
+    def orphans(self, ns=''):
+        """
+        Shows the pages of a namespace no other page links to.
+        """
+
+        ns = ns.strip(':')
+        prefix = ns + ':' if ns else ''
+        # any page may link to the pages of the namespace
+        local, pages = self.link_graph_pages()
+        if len(local) < len(pages):
+            print('DokuVimKi Error: Orphans are only found with the links of all pages, %d of %d are cached. '
+                  'Use DWfetch to cache the others.' % (len(local), len(pages)), file=sys.stderr)
+            return
+        self.show_links(self.link_graph.orphans([page for page in pages if page.startswith(prefix)]),
+                        'No orphans found in %s' % (ns or 'the wiki'))
+
+    def wanted(self, ns=''):
+        """
+        Shows the pages of a namespace which are linked to but don't exist,
+        and the pages linking to them.
+        """
+
+        ns = ns.strip(':')
+        prefix = ns + ':' if ns else ''
+        self.link_graph_pages(True)
+        wanted = self.link_graph.wanted(self.page_index.pages)
+        self.show_links(['%s  <- %s' % (target, ', '.join(sources)) for target, sources in sorted(wanted.items())
+                         if target.startswith(prefix)],
+                        'No wanted pages found in %s' % (ns or 'the wiki'))
+
+    def link_graph_pages(self, notice=False):
+        """
+        Brings the link graph up to date and returns the pages it knows the
+        links of and all pages. With notice set, tells if an answer is based
+        on part of the pages only.
+        """
+
+        self.sync_cache()
+        pages = self.page_index.pages
+        local = [page for page in pages if page in self.link_graph.docs]
+        if notice and len(local) < len(pages):
+            print('Based on the links of the %d of %d pages in the cache, DWfetch caches the others.'
+                  % (len(local), len(pages)), file=sys.stdout)
+        return local, pages
+
+    def show_links(self, lines, empty):
         """
-        Display backlinks for a certain page if any.
+        Shows a list of pages in the backlinks buffer, enter opens the page
+        under the cursor.
         """
 
         if self.diffmode:
             self.diff_close()
 
-        if not wp or wp[-1] == ':':
+        if not lines:
+            print('DokuVimKi Error: %s' % empty, file=sys.stderr)
             return
 
-        try:
-            self.focus(2)
-
-            vim.command('silent! buffer! ' + self.buffers['backlinks'].num)
-            vim.command('setlocal modifiable')
+        self.focus(2)
+        vim.command('silent! buffer! ' + self.buffers['backlinks'].num)
+        self.buffers['backlinks'].setup(['map <buffer> <enter> :Py dokuvimki.links_open()<CR>'])
+        self.buffers['backlinks'].set_lines(lines)
 
-            blinks = self.xmlrpc.backlinks(wp)
+    def links_open(self):
+        """
+        Opens the page listed in the current line of the backlinks buffer.
+        """
 
-            if len(blinks) > 0:
-                for link in blinks:
-                    self.buffers['backlinks'].buf[:] = map(str, blinks)
-                vim.command('map <buffer> <enter> :Py dokuvimki.cmd("edit")<CR>')
-            else:
-                print('DokuVimKi Error: No backlinks found for page: %s' % wp, file=sys.stderr)
+        line = vim.current.line
+        if line:
+            self.edit(line.split()[0])
 
-            vim.command('setlocal nomodifiable')
+    def sync_cache(self):
+        """
+        Brings the search index and the link graph in line with the page
+        cache, once per session; afterwards they are kept up to date.
+        """
 
-        except dokuwikixmlrpc.DokuWikiXMLRPCError as err:
-            print('DokuVimKi XML-RPC Error: %s' % err, file=sys.stderr)
+        if not self.cache_synced:
+            self.search_index.sync(self.page_cache)
+            self.link_graph.sync(self.page_cache)
+            self.cache_synced = True
 
-    def search(self, type='', pattern=''):
+    def search(self, type='', pattern='', fulltext=False):
         """
         Search the page list for matching pages and display them for editing.
+        With fulltext set the contents of the pages are searched by the
+        remote wiki instead.
         """
 
         if self.diffmode:
             self.diff_close()
 
+        if fulltext and type == 'page':
+            self.search_fulltext(pattern)
+            return
+
         self.focus(2)
 
         try:
@@ -601,7 +3597,7 @@ class DokuVimKi:
 
                 if pattern:
                     p = re.compile(pattern)
-                    result = filter(p.search, self.pages)
+                    result = list(filter(p.search, self.pages))
                 else:
                     result = self.pages
 
@@ -611,27 +3607,151 @@ class DokuVimKi:
                 else:
                     print('DokuVimKi Error: No matching pages found!', file=sys.stderr)
 
-            elif type == 'media':
-                vim.command('silent! buffer! ' + self.buffers['media'].num)
-                vim.command('setlocal modifiable')
+            elif type == 'media':
+                vim.command('silent! buffer! ' + self.buffers['media'].num)
+                vim.command('setlocal modifiable')
+
+                # the media below the current namespace are listed once
+                ns = self.cur_ns
+                p = re.compile(pattern) if pattern else None
+
+                def loaded():
+                    result = sorted(self.page_index.media_ids(ns))
+                    if p:
+                        result = list(filter(p.search, result))
+
+                    if len(result) > 0:
+                        self.buffers['media'].set_lines(result)
+                    else:
+                        print('DokuVimKi Error: No matching media files found!', file=sys.stderr)
+
+                self.load_media(ns, True, loaded)
+
+            vim.command('setlocal nomodifiable')
+
+        except:
+            pass
+
+    def search_fulltext(self, query):
+        """
+        Runs a full-text search on the remote wiki in the background and shows
+        the results in the search buffer, a page at a time. Results are cached
+        per query until the wiki changes.
+        """
+
+        if not query:
+            print('DokuVimKi Error: Full-text search needs a query.', file=sys.stderr)
+            return
+
+        self.focus(2)
+        vim.command('silent! buffer! ' + self.buffers['search'].num)
+        vim_commands([
+            'map <silent> <buffer> <enter> :Py dokuvimki.search_open()<CR>',
+            'syn match DokuVimKi_SEARCH_ID /^\S\+/',
+            'hi DokuVimKi_SEARCH_ID term=bold cterm=bold ctermfg=Yellow gui=bold guifg=Yellow',
+        ])
+
+        self.search_query = query
+
+        if self.offline or self.search_local:
+            # pages cached while the index wasn't saved are picked up once
+            self.sync_cache()
+            with self.stats.measure('local search'):
+                results = [(wp, '%.1f' % score, None) for wp, score in self.search_index.search(query, self.page_cache.get)]
+            self.search_show(query, results)
+            return
+
+        if query in self.search_cache:
+            self.search_cache.move_to_end(query)
+            self.search_show(query, self.search_cache[query])
+            return
+
+        self.buffers['search'].set_lines(['Searching for "%s" ...' % query])
+        self.search_shown = 0
+
+        def loaded(results):
+            results = [(r['id'], r.get('score', 0), self.search_snippet(r.get('snippet', ''))) for r in results]
+            self.search_cache[query] = results
+            if len(self.search_cache) > self.search_cache_size:
+                self.search_cache.popitem(last=False)
+            # a newer search may have been started in the meantime
+            if self.search_query == query:
+                self.search_show(query, results)
+
+        self.request('search ' + query, lambda xmlrpc: xmlrpc.search(query), loaded)
+
+    @staticmethod
+    def search_snippet(snippet):
+        """
+        Turns the HTML snippet of a search result into a single line of text.
+        """
+
+        import html
+        return ' '.join(html.unescape(re.sub(r'<[^>]*>', '', snippet)).split())
+
+    def local_snippet(self, wp, query):
+        """
+        Returns the text around the first term of a query in the cached text
+        of a page.
+        """
+
+        text = self.page_cache.get(wp)
+        terms = SearchIndex.terms(query)
+        if not text or not terms:
+            return ''
 
-                if pattern:
-                    p = re.compile(pattern)
-                    result = filter(p.search, self.media)
-                else:
-                    result = self.media
+        m = re.search(r'\b' + re.escape(terms[0]), text, re.I | re.U)
+        start = max(0, m.start() - 40) if m else 0
+        words = text[start:start + 120].split()
+        # drop the words cut in half
+        return ' '.join(words[1 if start else 0:-1] if len(words) > 2 else words)
 
-                if len(result) > 0:
-                    self.buffers['media'].buf[:] = result
-                else:
-                    print('DokuVimKi Error: No matching media files found!', file=sys.stderr)
+    def search_show(self, query, results, more=False):
+        """
+        Shows the first page of search results, or the next one if more is
+        set, in the search buffer. The last line tells how many are left.
+        """
 
-            vim.command('setlocal nomodifiable')
+        if not results:
+            self.buffers['search'].set_lines(['No pages found for "%s".' % query])
+            self.search_results = []
+            self.search_shown = 0
+            return
 
-        except:
-            pass
+        self.search_results = results
+        start = self.search_shown if more else 0
+        end = start + self.search_page_size if self.search_page_size else len(results)
+        width = max(len(wp) for wp, score, snippet in results[:end])
+
+        # snippets of local results are only made for the shown ones
+        lines = ['%-*s %4s  %s' % (width, wp, score, snippet if snippet is not None else self.local_snippet(wp, query))
+                 for wp, score, snippet in results[start:end]]
+        left = len(results) - end
+        if left > 0:
+            lines.append('-- %d more results, <enter> shows the next %d --' % (left, min(left, self.search_page_size)))
+
+        if more:
+            # replaces the "more results" line
+            self.buffers['search'].set_lines(lines, start)
+        else:
+            self.buffers['search'].set_lines(lines)
+        self.search_shown = min(end, len(results))
+
+    def search_open(self):
+        """
+        Opens the page of the search result under the cursor, or shows more
+        results if the cursor is on the last line. The shown results are the
+        first search_shown lines.
+        """
+
+        row, col = vim.current.window.cursor
+        line = vim.current.line
+        if row <= self.search_shown:
+            self.edit(line.split()[0])
+        elif row == self.search_shown + 1 and self.search_shown and line.startswith('-- '):
+            self.search_show(self.search_query, self.search_results, True)
 
-    def close(self, buffer, bang=False):
+    def close(self, buffer, bang=False, unlock=True):
         """
         Closes the given buffer. Works only if the given buffer is a wiki
         page.  The buffer is also removed from the buffer stack.
@@ -648,36 +3768,81 @@ class DokuVimKi:
                     return
 
                 vim.command('bp!')
+                # forgotten first, so the BufDelete autocmd leaves it alone
+                page = self.forget(buffer)
                 # Ignore any failure deleting this buffer e.g. if it has been manually deleted before
-                vim.command('silent! bdel! ' + self.buffers[buffer].num)
-                if self.buffers[buffer].type == 'acwrite':
+                vim.command('silent! bdel! ' + page.num)
+                if page.type == 'acwrite' and unlock:
                     self.unlock(buffer)
-                del self.buffers[buffer]
+                self.update_status()
             else:
                 print('You cannot close special buffer "%s"!' % buffer, file=sys.stderr)
 
         except KeyError:
             print('You cannot use DWclose on non wiki page "%s"!' % buffer, file=sys.stderr)
 
+    def forget(self, wp):
+        """
+        Forgets an open page and its lock, returns its buffer.
+        """
+
+        self.locks.discard(wp)
+        self.lost_locks.discard(wp)
+        return self.buffers.pop(wp)
+
+    def buffer_deleted(self, wp):
+        """
+        Called when the buffer of a page is deleted. Only pages not closed by
+        DokuVimKi itself, e.g. with :bdelete, need to be forgotten and
+        unlocked.
+        """
+
+        if wp not in self.buffers:
+            return
+        if self.forget(wp).type == 'acwrite':
+            self.unlock(wp)
+        self.update_status()
+
     def quit(self, bang):
         """
         Quits the current session.
         """
 
         unsaved = []
+        locked = []
 
         for buffer in list(self.buffers):
             if self.buffers[buffer].iswp:
+                if self.buffers[buffer].type == 'acwrite':
+                    locked.append(buffer)
                 if not self.ismodified(buffer):
                     vim.command('silent! buffer! ' + self.buffers[buffer].num)
-                    self.close(buffer)
+                    self.close(buffer, unlock=False)
                 elif self.ismodified(buffer) and bang:
                     vim.command('silent! buffer! ' + self.buffers[buffer].num)
-                    self.close(buffer, bang=True)
+                    self.close(buffer, bang=True, unlock=False)
                 else:
                     unsaved.append(buffer)
 
+        # the locks of all closed pages are removed with a single request
+        locked = [wp for wp in locked if wp not in self.buffers]
+        if locked:
+            self.unlock(*locked)
+
         if len(unsaved) == 0:
+            # give pending requests (e.g. removing the locks) a chance to finish
+            for worker in self.workers():
+                worker.wait(self.quit_timeout)
+            self.page_cache.save()
+            self.search_index.save()
+            self.link_graph.save()
+            self.change_feed.save()
+
+            if self.journal.entries and not bang:
+                print("%d page(s) haven't been uploaded yet. They are kept and uploaded by the next session, use DWquit! to quit anyway."
+                      % len(self.journal.entries), file=sys.stderr)
+                return
+
             vim.command('silent! quitall')
         else:
             print("Some buffers contain unsaved changes. Use DWquit! if you really want to quit.", file=sys.stderr)
@@ -697,17 +3862,57 @@ class DokuVimKi:
         vim.command('help dokuvimki')
         vim.command("setlocal statusline=%{'[help]'}")
 
+    def show_stats(self, reset=False):
+        """
+        Shows the statistics of the XML-RPC requests and UI operations in the
+        stats buffer. DWstats! starts over.
+        """
+
+        if reset:
+            self.stats.reset()
+            print('DokuVimKi statistics reset.', file=sys.stdout)
+            return
+
+        self.focus(2)
+        vim.command('silent! buffer! ' + self.buffers['stats'].num)
+        self.buffers['stats'].setup(['setlocal nowrap'])
+        self.buffers['stats'].set_lines(self.stats.report())
+
+    def profile(self, command):
+        """
+        Runs an ex command under cProfile and shows the functions it spent the
+        most time in in the stats buffer. Only the UI thread is profiled, so
+        the results of background requests aren't covered.
+        """
+
+        import io
+        import pstats
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            vim.command(command)
+        except vim.error as err:
+            print('DokuVimKi Error: %s' % err, file=sys.stderr)
+        finally:
+            profiler.disable()
+
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(40)
+
+        self.focus(2)
+        vim.command('silent! buffer! ' + self.buffers['stats'].num)
+        self.buffers['stats'].setup(['setlocal nowrap'])
+        self.buffers['stats'].set_lines(['Profile of :' + command] + out.getvalue().splitlines())
+
     def ismodified(self, buffer):
         """
         Checks whether the current buffer or a given buffer is modified or not.
         """
 
-        if self.buffers[buffer].need_save:
-            return True
-        elif u("\n".join(self.buffers[buffer].page).strip()) != u("\n".join(self.buffers[buffer].buf).strip()):
-            return True
-        else:
-            return False
+        self.buffers[buffer].sync()
+        return self.buffers[buffer].need_save
 
     def rev_edit(self):
         """
@@ -719,6 +3924,151 @@ class DokuVimKi:
         rev = vim.current.buffer[row - 1].split("\t")[2].strip()
         self.edit(wp, rev)
 
+    def rev_compare(self, current=False):
+        """
+        Special mapping for comparing the revision under the cursor with the
+        previous one, or with the current revision, in the revisions listing.
+        """
+
+        row, col = vim.current.window.cursor
+        fields = vim.current.buffer[row - 1].split("\t")
+        wp = fields[0].strip()
+        rev = fields[2].strip()
+
+        if current:
+            self.compare(wp, rev)
+        elif row < len(vim.current.buffer):
+            self.compare(wp, vim.current.buffer[row].split("\t")[2].strip(), rev)
+        else:
+            print("DokuVimKi Error: No previous revision of %s listed." % wp, file=sys.stderr)
+
+    def prefetch_revisions(self, row=None):
+        """
+        Fetches the revisions around the cursor in the revisions listing into
+        the page cache in the background, so stepping through the history of
+        a page doesn't wait for the network.
+        """
+
+        if not self.worker or not self.prefetch_revs or self.offline:
+            return
+
+        if row is None:
+            row, col = vim.current.window.cursor
+
+        wanted = []
+        start = max(0, row - 1 - self.prefetch_revs)
+        for line in self.buffers['revisions'].buf[start:row + self.prefetch_revs]:
+            fields = line.split("\t")
+            if len(fields) < 3 or not fields[2].isdigit():
+                continue
+            item = (fields[0], int(fields[2]))
+            if item not in self.prefetching and item not in self.page_cache:
+                wanted.append(item)
+
+        if not wanted:
+            return
+
+        self.prefetching.update(wanted)
+
+        def loaded(texts):
+            for (wp, rev), text in zip(wanted, texts):
+                if text and not isinstance(text, Exception):
+                    self.page_cache.put(wp, rev, text, current=False)
+
+        self.request('prefetch', lambda xmlrpc: xmlrpc.multicall([('wiki.getPageVersion', list(item)) for item in wanted]),
+                     loaded, lambda err: None, cleanup=lambda: self.prefetching.difference_update(wanted))
+
+    def prefetch_listed(self, name):
+        """
+        Fetches the pages listed under and right below the cursor in the
+        index, search results, backlinks or changes into the page cache in
+        the background, so opening them doesn't wait for the network.
+        """
+
+        if not self.worker or not self.prefetch_max or self.offline:
+            return
+
+        row, col = vim.current.window.cursor
+        pages = []
+        for line in self.buffers[name].buf[row - 1:row + 2]:
+            if name == 'index':
+                # namespaces end with a slash
+                if line and not line.endswith('/') and not line.startswith(('ns: ', '.. ')):
+                    pages.append(self.cur_ns + line)
+            elif line and not line.startswith('-- '):
+                pages.append(line.split()[0])
+        self.prefetch_pages(pages)
+
+    def prefetch_links(self, wp):
+        """
+        Fetches the pages an open page links to into the page cache in the
+        background, the first links first.
+        """
+
+        if not self.worker or not self.prefetch_max or self.offline:
+            return
+        self.prefetch_pages(LinkGraph.links(wp, "\n".join(self.buffers[wp].buf)))
+
+    def prefetch_pages(self, pages):
+        """
+        Fetches the current texts of those of the given pages which aren't
+        cached into the page cache in the background. One request is made at
+        a time, pages wanted meanwhile are fetched next; no more than
+        g:DokuVimKi_PREFETCH_PAGES pages per request and no more than
+        g:DokuVimKi_PREFETCH_RATE kilobytes a minute are fetched.
+        """
+
+        wanted = []
+        for wp in pages:
+            if (wp in self.page_index.pages and wp not in self.buffers and wp not in self.prefetching
+                    and wp not in wanted and self.page_cache.revision(wp) is None):
+                wanted.append(wp)
+                if len(wanted) == self.prefetch_max:
+                    break
+
+        if not wanted:
+            return
+
+        if self.prefetch_busy:
+            # the latest wish wins
+            self.prefetch_next = wanted
+            return
+
+        now = time.time()
+        while self.prefetch_log and self.prefetch_log[0][0] < now - 60:
+            self.prefetch_log.popleft()
+        if sum(size for when, size in self.prefetch_log) >= self.prefetch_rate:
+            return
+
+        self.prefetch_busy = True
+        self.prefetching.update(wanted)
+
+        # the revision is needed to keep the cached text
+        def fetch(xmlrpc):
+            calls = []
+            for wp in wanted:
+                calls += [('wiki.getPageInfo', [wp]), ('wiki.getPage', [wp])]
+            results = xmlrpc.multicall(calls)
+            return list(zip(wanted, results[::2], results[1::2]))
+
+        def done():
+            self.prefetch_busy = False
+            self.prefetching.difference_update(wanted)
+            pending, self.prefetch_next = self.prefetch_next, None
+            if pending:
+                self.prefetch_pages(pending)
+
+        def loaded(results):
+            size = 0
+            for wp, info, text in results:
+                if text and not isinstance(text, Exception) and not isinstance(info, Exception):
+                    self.cache_page(wp, int(info['version']), text)
+                    size += len(text)
+            self.prefetch_log.append((time.time(), size))
+
+        # prefetching never holds up the requests of the user
+        self.request('prefetch %d page(s)' % len(wanted), fetch, loaded, lambda err: None, self.transfer_pool(), done)
+
     def focus(self, winnr):
         """
         Convenience function to switch the current window focus.
@@ -727,90 +4077,365 @@ class DokuVimKi:
         if int(vim.eval('winnr()')) != winnr:
             vim.command(str(winnr) + 'wincmd w')
 
-    def refresh(self):
+    def refresh(self, full=False, quiet=False):
         """
-        Refreshes the page index by retrieving a fresh list of all pages on the
-        remote server and updating the completion dictionary.
+        Brings the page index and the change feed up to date in the
+        background. Only the changes since the last sync are retrieved from
+        the remote wiki unless a full rebuild is requested or the last sync
+        is too old for the recent changes of the remote wiki. With quiet set
+        nothing is reported unless the index has changed.
         """
 
-        self.pages = []
-        self.media = []
+        if self.offline:
+            return
 
-        try:
+        cursor = self.page_index.cursor
+        rebuild = full or not cursor or time.time() - cursor > self.index_max_age
+
+        # the change feed continues where it left off, e.g. before a rebuild
+        since = cursor
+        feed = self.change_feed.cursor
+        if not rebuild and feed and feed < cursor and time.time() - feed < self.index_max_age:
+            since = feed
+
+        if quiet:
+            pass
+        elif rebuild:
             print("Refreshing page index!", file=sys.stdout)
-            data = self.xmlrpc.all_pages()
+        else:
+            print("Syncing page index!", file=sys.stdout)
+
+        def fetch(xmlrpc):
+            now = xmlrpc.time()
+            if rebuild:
+                return now, xmlrpc.all_pages(), None
+            return now, xmlrpc.recent_changes(since), xmlrpc.recent_media_changes(cursor)
+
+        def loaded(result):
+            now, pages, media = result
+            if rebuild:
+                self.page_index.rebuild(pages or [])
+            else:
+                changes = pages
+                pages = [change for change in changes if int(change['version']) >= cursor]
+                if quiet and not pages and not media:
+                    self.page_index.cursor = now
+                    self.changes_merged(changes, since, now)
+                    return
+                self.page_index.update(pages, media)
+                self.refetch_pages(pages)
+                self.changes_merged(changes, since, now)
+            self.page_index.cursor = now
+            self.index_changed()
+            self.redraw_index()
+
+        def failed(err):
+            if not quiet:
+                print("Failed to fetch page list. Please check your configuration\n%s" % err, file=sys.stderr)
+
+        self.request('index', fetch, loaded, failed)
+
+    def poll_changes(self):
+        """
+        Syncs the page index and the change feed with the recent changes,
+        called by a timer every g:DokuVimKi_CHANGES_INTERVAL seconds.
+        """
+
+        # the previous sync may still be running on a slow connection
+        if any(job.label == 'index' for job in self.jobs()):
+            return
+        self.refresh(quiet=True)
+
+    def changes_merged(self, changes, since, now):
+        """
+        Merges recent changes into the change feed and shows the new ones
+        in the changes buffer.
+        """
+
+        if self.change_feed.merge(changes, since, now):
+            self.change_feed.save()
+            self.changes_show()
+
+    def refetch_pages(self, changes):
+        """
+        Brings the texts of the indexed pages in a list of recent changes up
+        to date, deleted pages are removed from the search index.
+        """
+
+        latest = {}
+        for change in changes:
+            latest[change['name']] = change
+
+        stale = []
+        for wp, change in latest.items():
+            rev = self.search_index.revision(wp)
+            if rev is None:
+                continue
+            if not change.get('size', 1):
+                self.drop_page(wp)
+            elif int(change['version']) != rev:
+                stale.append((wp, int(change['version'])))
+
+        if stale:
+            self.fetch_pages(stale, 'reindex')
+
+    def index_changed(self, save=True):
+        """
+        Stores the page index and updates the page lists and the completers
+        from it.
+        """
+
+        # search results may be out of date
+        self.search_cache.clear()
+
+        with self.stats.measure('index update'):
+            if save:
+                self.page_index.save()
 
-            if data:
-                for page in data:
-                    page = page['id']
-                    self.pages.append(page)
-                    # Add the page's namespace if not the root namespace
-                    if ':' not in page:
-                        continue
-                    ns = page.rsplit(':', 1)[0] + ':'
-                    if ns not in self.pages:
-                        self.pages.append(ns)
-                        self.media.append(ns)
+            namespaces = self.page_index.namespaces()
 
-            self.pages.sort()
-            vim.command('let g:pages = "' + " ".join(self.pages) + '"')
+            self.pages = sorted(self.page_index.pages.union(namespaces))
+            self.page_completer = Completer(self.pages)
 
-            print("Refreshing media index!", file=sys.stdout)
-            data = self.xmlrpc.list_files(':', True)
+            self.media_changed(namespaces)
 
-            if data:
-                for media in data:
-                    self.media.append(media['id'])
+        # links may lead to pages which have been created or removed, other
+        # buffers are checked when they are entered
+        self.check_links()
 
-            self.media.sort()
-            vim.command('let g:media = "' + " ".join(self.media) + '"')
+    def media_changed(self, namespaces=None):
+        """
+        Updates the media list and its completer from the page index.
+        """
+
+        if namespaces is None:
+            namespaces = self.page_index.namespaces()
+
+        self.media = sorted(self.page_index.media_ids().union(namespaces))
+        self.media_completer = Completer(self.media)
+
+    def load_media(self, ns, recursive=False, callback=None, wait=False):
+        """
+        Lists the media of a namespace, and of its sub namespaces if recursive
+        is set, unless they are known already. Calls callback once they are,
+        right away if they are known or the remote wiki can't be asked. With
+        wait set they are listed without a background request.
+        """
+
+        if self.page_index.has_media(ns, recursive) or self.offline:
+            if callback:
+                callback()
+            return
+
+        def fetch(xmlrpc):
+            return xmlrpc.list_files(ns.rstrip(':') or ':', recursive)
+
+        def loaded(media):
+            self.page_index.set_media(ns, media, recursive)
+            self.page_index.save()
+            self.media_changed()
+            if callback:
+                callback()
+
+        def failed(err):
+            self.media_failed[ns] = time.time()
+            print('DokuVimKi Error: Failed to list the media of %s: %s' % (ns or 'the wiki', err), file=sys.stderr)
+
+        if wait:
+            # don't block every keystroke while the remote wiki is unreachable
+            if time.time() - self.media_failed.get(ns, 0) < self.media_retry:
+                return
+            try:
+                loaded(fetch(self.xmlrpc))
+            except Exception as err:
+                failed(err)
+        elif (ns, recursive) not in self.media_loading or callback:
+            self.media_loading.add((ns, recursive))
+            self.request('media ' + (ns or ':'), fetch, loaded, failed,
+                         cleanup=lambda: self.media_loading.discard((ns, recursive)))
+
+    def complete(self, type, base):
+        """
+        Returns the completion candidates for InsertModeComplete() and
+        CmdModeComplete().
+        """
+
+        base = base.lower()
+
+        if type == 'media':
+            # completion can't wait for a background request
+            self.load_media(PageIndex.media_namespace(base), wait=True)
+            completer = self.media_completer
+        else:
+            completer = self.page_completer
 
-        except dokuwikixmlrpc.DokuWikiXMLRPCError as err:
-            print("Failed to fetch page list. Please check your configuration\n%s" % err, file=sys.stderr)
+        with self.stats.measure('completion'):
+            return completer.complete(base, self.complete_max, self.complete_fuzzy)
 
-    def lock(self, wp):
+    def reload(self, full=False):
         """
-        Tries to obtain a lock given wiki page.
+        Syncs the page index with the remote wiki and redraws the index.
         """
 
-        locks = {}
-        locks['lock'] = [wp]
-        locks['unlock'] = []
+        self.refresh(bool(full))
+        self.index(self.cur_ns)
 
-        result = self.set_locks(locks)
+    def locked(self, wp, result):
+        """
+        Checks the result of a set_locks() call locking a given wiki page.
+        """
 
-        if locks['lock'] == result['locked']:
+        if result and result['locked'] == [wp]:
             print("Locked page %s for editing." % wp, file=sys.stdout)
             return True
         else:
             print('The page "%s" appears to be locked for editing. You have to wait until the lock expires.' % wp, file=sys.stderr)
             return False
 
-    def unlock(self, wp):
+    def needs_lock(self, wp):
         """
-        Tries to unlock a given wiki page.
+        Checks whether a page is locked while it's open, pages of the
+        namespaces in g:DokuVimKi_UNLOCKED_NS aren't.
         """
 
-        locks = {}
-        locks['lock'] = []
-        locks['unlock'] = [wp]
+        for ns in self.unlocked_ns:
+            if not ns or wp.startswith(ns + ':'):
+                return False
+        return True
 
-        result = self.set_locks(locks)
+    def unlock(self, *wps):
+        """
+        Tries to unlock the given wiki pages.
+        """
 
-        if locks['unlock'] == result['unlocked']:
-            return True
-        else:
-            return False
+        locks = {'lock': [], 'unlock': list(wps)}
+        self.request('unlock ' + ' '.join(wps), lambda xmlrpc: xmlrpc.set_locks(locks))
 
-    def set_locks(self, locks):
+    def schedule_locks(self, delay=None):
         """
-        Locks unlocks a given set of pages.
+        Schedules the next renewal of the locks of the open pages, after
+        delay seconds or the lock interval. Locks are only renewed by
+        background requests, renewing them synchronously would block vim.
         """
 
-        try:
-            return self.xmlrpc.set_locks(locks)
-        except dokuwikixmlrpc.DokuWikiXMLRPCError as err:
-            print(err, file=sys.stderr)
+        if self.lock_timer is not None:
+            vim.command('call timer_stop(%s)' % self.lock_timer)
+            self.lock_timer = None
+
+        if not self.locks or not self.worker or not self.lock_interval:
+            return
+
+        if delay is None:
+            delay = self.lock_interval
+        self.lock_timer = vim.eval("timer_start(%d, 'DokuVimKiRenewLocks')" % (delay * 1000))
+
+    def renew_locks(self):
+        """
+        Renews the locks of all open pages with a single request before they
+        expire on the remote wiki. Lost locks are taken again as soon as the
+        remote wiki allows it.
+        """
+
+        if self.offline or self.renewing:
+            self.schedule_locks()
+            return
+
+        wps = sorted(wp for wp in self.locks if wp in self.buffers)
+        self.locks = set(wps)
+        if not wps:
+            self.schedule_locks()
+            return
+
+        locks = {'lock': wps, 'unlock': []}
+        self.renewing = True
+
+        # the callbacks are skipped if the request is cancelled, renew the
+        # locks with the next interval then
+        def cleanup():
+            if self.renewing:
+                self.renewing = False
+                self.schedule_locks()
+
+        self.request('lock ' + ' '.join(wps), lambda xmlrpc: xmlrpc.set_locks(locks),
+                     lambda result: self.locks_renewed(wps, result), self.renew_locks_failed, cleanup=cleanup)
+
+    def locks_renewed(self, wps, result):
+        """
+        Checks the result of renewing the locks of the given pages.
+        """
+
+        self.renewing = False
+        self.lock_failures = 0
+
+        renewed = set(result.get('locked', []))
+        for wp in wps:
+            if wp in renewed:
+                if wp in self.lost_locks:
+                    self.lost_locks.discard(wp)
+                    print("Locked page %s for editing again." % wp, file=sys.stdout)
+            elif wp not in self.lost_locks:
+                self.lost_locks.add(wp)
+                print('Lost the lock of %s, somebody else may be editing it.' % wp, file=sys.stderr)
+
+        self.schedule_locks()
+        self.update_status()
+
+    def renew_locks_failed(self, err):
+        """
+        Retries renewing the locks with a growing delay, but never later than
+        the lock interval.
+        """
+
+        self.renewing = False
+        delay = min(self.lock_interval, Journal.retry_min * 2 ** self.lock_failures)
+        self.lock_failures += 1
+        print('DokuVimKi Error: Renewing the page locks failed: %s. Retrying in %d seconds.' % (err, delay), file=sys.stderr)
+        self.schedule_locks(delay)
+
+    def check_links(self, wp=None):
+        """
+        Highlights the links to pages which don't exist in the buffer of a
+        page, by default the current one. Only lines which have changed since
+        the last check are parsed again.
+        """
+
+        if not self.link_check:
+            return
+
+        name = vim.current.buffer.name.rsplit(os.sep, 1)[-1]
+        buffer = self.buffers.get(wp or name)
+        # syntax commands apply to the current buffer
+        if buffer is None or not buffer.iswp or (wp or name) != name:
+            return
+
+        with self.stats.measure('link check'):
+            tick = buffer.changedtick()
+            if tick != buffer.link_tick:
+                ns = name.rsplit(':', 1)[0] if ':' in name else ''
+                known = buffer.links
+                links = {}
+                for line in buffer.buf:
+                    if '[[' in line and line not in links:
+                        found = known.get(line)
+                        links[line] = found if found is not None else LinkGraph.line_links(line, ns)
+                buffer.links = links
+                buffer.link_tick = tick
+
+            pages = self.page_index.pages
+            dangling = frozenset(link for found in buffer.links.values() for link, id in found
+                                 if id and id not in pages)
+            previous = buffer.dangling
+            buffer.dangling = dangling
+            # None means nothing is highlighted
+            if dangling == previous or not (dangling or previous):
+                return
+
+            commands = ['silent! syntax clear DokuVimKiDanglingLink',
+                        'highlight default link DokuVimKiDanglingLink Error']
+            if dangling:
+                pattern = '\\|'.join(link.replace('\\', '\\\\').replace('/', '\\/') for link in sorted(dangling))
+                commands.append('syntax match DokuVimKiDanglingLink /\\V[[\\%%(%s\\)]]/ containedin=ALL' % pattern)
+            vim_commands(commands)
 
     def id_lookup(self):
         """
@@ -827,50 +4452,16 @@ class DokuVimKi:
             ns = ''
 
         # look for link syntax on the left and right from the current curser position
-        reL = re.compile('\[{2}[^]]*$')  # opening link syntax
-        reR = re.compile('^[^\[]*]{2}')  # closing link syntax
-
-        L = reL.search(line[:col])
-        R = reR.search(line[col:])
+        L = link_open_re.search(line[:col])
+        R = link_close_re.search(line[col:])
 
         # if both matched we probably have a link
         if L and R:
 
-            # sanitize match remove anchors and everything after '|'
-            id = (L.group() + R.group()).strip('[]').split('|')[0].split('#')[0]
-
-            # check if it's not and external/interwiki/share link
-            if id.find('>') == -1 and id.find('://') == -1 and id.find('\\') == -1:
-
-                # check if useshlash is used
-                if id.find('/'):
-                    id = id.replace('/', ':')
-
-                # this is _almost_ a rip off of DokuWikis resolve_id() function
-                if id[0] == '.':
-                    re_sanitize = re.compile('(\.(?=[^:\.]))')
-                    id = re_sanitize.sub('.:', id)
-                    id = ns + ':' + id
-                    path = id.split(':')
-
-                    result = []
-                    for dir in path:
-                        if dir == '..':
-                            try:
-                                if result[-1] == '..':
-                                    result.append('..')
-                                elif not result.pop():
-                                    result.append('..')
-                            except IndexError:
-                                pass
-                        elif dir and dir != '.' and not len(dir.split('.')) > 2:
-                            result.append(dir)
-
-                    id = ':'.join(result)
-
-                elif ns and id[0] != ':' and id.find(':', 0) == -1:
-                    id = ns + ':' + id
+            id = resolve_link((L.group() + R.group()).strip('[]'), ns)
 
+            # not an external/interwiki/share link
+            if id:
                 # we're done, open the page for editing
                 print(id, file=sys.stdout)
                 self.edit(id)
@@ -906,45 +4497,165 @@ class DokuVimKi:
 
     def buffer_enter(self, wp):
         """
-        Loads the buffer on enter.
+        Loads the buffer on enter. The text only needs to be restored if vim
+        has unloaded the buffer in the meantime.
         """
 
-        self.buffers[wp].buf[:] = self.buffers[wp].page
-        vim.command('setlocal nomodified')
-        self.buffer_setup()
+        buffer = self.buffers[wp]
+        if buffer.changedtick() != buffer.tick:
+            buffer.buf[:] = buffer.page
+            vim.command('setlocal nomodified')
+            buffer.tick = buffer.changedtick()
+            buffer.ready = False
+            # setting up the syntax again clears the highlighting
+            buffer.dangling = None
+        self.buffer_setup(buffer)
+        self.check_links(wp)
 
     def buffer_leave(self, wp):
-        if "\n".join(self.buffers[wp].buf).strip() != "\n".join(self.buffers[wp].page).strip():
-            self.buffers[wp].page[:] = self.buffers[wp].buf
-            self.buffers[wp].need_save = True
-
-    def buffer_setup(self):
-        """
-        Setup edit environment.
-        """
-
-        vim.command('setlocal textwidth=0')
-        vim.command('setlocal wrap')
-        vim.command('setlocal linebreak')
-        vim.command('setlocal syntax=dokuwiki')
-        vim.command('setlocal filetype=dokuwiki')
-        vim.command('setlocal tabstop=2')
-        vim.command('setlocal expandtab')
-        vim.command('setlocal shiftwidth=2')
-        vim.command('setlocal encoding=utf-8')
-        vim.command('setlocal completefunc=InsertModeComplete')
-        vim.command('setlocal omnifunc=InsertModeComplete')
-        vim.command('map <buffer> <silent> <C-]> :Py dokuvimki.id_lookup()<CR>')
-        vim.command('imap <buffer> <silent> <C-D><C-B> ****<ESC>1hi')
-        vim.command('imap <buffer> <silent> <C-D><C-I> ////<ESC>1hi')
-        vim.command('imap <buffer> <silent> <C-D><C-U> ____<ESC>1hi')
-        vim.command('imap <buffer> <silent> <C-D><C-L> [[]]<ESC>1hi')
-        vim.command('imap <buffer> <silent> <C-D><C-M> {{}}<ESC>1hi')
-        vim.command('imap <buffer> <silent> <C-D><C-K> <code><CR><CR></code><ESC>ki')
-        vim.command('imap <buffer> <silent> <C-D><C-F> <file><CR><CR></file><ESC>ki')
-        vim.command('imap <buffer> <silent> <expr> <C-D><C-H> Headline()')
-        vim.command('imap <buffer> <silent> <expr> <C-D><C-P> SetLvl(+1)')
-        vim.command('imap <buffer> <silent> <expr> <C-D><C-D> SetLvl(-1)')
+        self.buffers[wp].sync()
+
+    def buffer_setup(self, buffer, extra=()):
+        """
+        Setup edit environment of the current buffer. Options, syntax and
+        mappings of the buffer are only set up once, the window options for
+        every window showing it.
+        """
+
+        with self.stats.measure('buffer setup'):
+            vim.command('setlocal wrap linebreak')
+            buffer.setup([
+                'setlocal textwidth=0 tabstop=2 expandtab shiftwidth=2',
+                'setlocal syntax=dokuwiki',
+                'setlocal filetype=dokuwiki',
+                'setlocal encoding=utf-8',
+                'setlocal completefunc=InsertModeComplete omnifunc=InsertModeComplete',
+                'map <buffer> <silent> <C-]> :Py dokuvimki.id_lookup()<CR>',
+                'imap <buffer> <silent> <C-D><C-B> ****<ESC>1hi',
+                'imap <buffer> <silent> <C-D><C-I> ////<ESC>1hi',
+                'imap <buffer> <silent> <C-D><C-U> ____<ESC>1hi',
+                'imap <buffer> <silent> <C-D><C-L> [[]]<ESC>1hi',
+                'imap <buffer> <silent> <C-D><C-M> {{}}<ESC>1hi',
+                'imap <buffer> <silent> <C-D><C-K> <code><CR><CR></code><ESC>ki',
+                'imap <buffer> <silent> <C-D><C-F> <file><CR><CR></file><ESC>ki',
+                'imap <buffer> <silent> <expr> <C-D><C-H> Headline()',
+                'imap <buffer> <silent> <expr> <C-D><C-P> SetLvl(+1)',
+                'imap <buffer> <silent> <expr> <C-D><C-D> SetLvl(-1)',
+            ] + list(extra))
+
+    def request(self, label, func, callback=None, errback=None, worker=None, cleanup=None):
+        """
+        Calls func with an XML-RPC client in the background and hands its
+        result to callback, or the raised exception to errback, once it is
+        done. Without timer support in vim func is called right away. The
+        request is run by the default worker unless another one is given.
+        cleanup is called once the request is over, even if it has been
+        cancelled.
+        """
+
+        if errback is None:
+            errback = self.request_failed
+
+        job = Job(label, func, callback, errback, cleanup)
+
+        if self.worker is None:
+            try:
+                try:
+                    result = func(self.xmlrpc)
+                except Exception as err:
+                    errback(err)
+                    return job
+                if callback:
+                    callback(result)
+                return job
+            finally:
+                if cleanup:
+                    cleanup()
+
+        (worker or self.worker).submit(job)
+        if self.timer is None:
+            self.timer = vim.eval("timer_start(%d, 'DokuVimKiPoll', {'repeat': -1})" % self.poll_interval)
+        self.update_status()
+        return job
+
+    def workers(self):
+        """
+        Returns the workers running background requests.
+        """
+        return [worker for worker in (self.worker, self.pool) if worker]
+
+    def jobs(self):
+        """
+        Returns the pending background requests.
+        """
+        return [job for worker in self.workers() for job in worker.jobs]
+
+    def request_failed(self, err):
+        """
+        Default error handler of background requests.
+        """
+        print('DokuVimKi Error: %s' % err, file=sys.stderr)
+
+    def poll(self):
+        """
+        Timer callback delivering the results of background requests.
+        """
+
+        for worker in self.workers():
+            worker.deliver()
+
+        if not self.jobs() and self.timer is not None:
+            vim.command('call timer_stop(%s)' % self.timer)
+            self.timer = None
+            # write what the finished requests added to the page cache
+            self.page_cache.save()
+
+        self.update_status()
+
+    def cancel(self):
+        """
+        Cancels all pending background requests.
+        """
+
+        if self.worker:
+            # pages wanted while prefetching are forgotten with it
+            self.prefetch_next = None
+            jobs = [job for worker in self.workers() for job in worker.cancel()]
+            print("Cancelled %d request(s)." % len(jobs), file=sys.stdout)
+
+            # cancelled saves stay in the journal
+            for wp in self.uploading:
+                self.journal.retry(wp)
+            self.uploading.clear()
+            self.flush()
+
+    def update_status(self):
+        """
+        Shows the pending background requests and saves and the lost locks
+        in the statusline.
+        """
+
+        jobs = self.jobs()
+
+        status = ''
+        if jobs:
+            status = '[' + jobs[0].label
+            if len(jobs) > 1:
+                status += ' +%d' % (len(jobs) - 1)
+            status += ']'
+
+        queued = len(self.journal.entries) - len(self.uploading)
+        if queued:
+            status += '[%d queued]' % queued
+        if self.lost_locks:
+            status += '[%d lock(s) lost]' % len(self.lost_locks)
+        if self.offline:
+            status += '[offline]'
+
+        if status != self.status:
+            self.status = status
+            vim.command('let g:DokuVimKi_STATUS = "%s"' % status.replace('\\', '\\\\').replace('"', '\\"'))
+            vim.command('redrawstatus!')
 
 
 class Buffer:
@@ -957,6 +4668,15 @@ class Buffer:
         self.buf    = vim buffer object
         self.name   = buffer name
         self.iswp   = True if buffer represents a wiki page
+        self.page   = text of the page as of the last sync with the buffer
+        self.saved  = digest of the text as last saved
+        self.tick   = b:changedtick of the last sync with the buffer
+        self.ready  = True once syntax and mappings have been set up
+        self.rev    = revision of the page the text is based on, 0 for a new
+                      page, None if unknown
+        self.links  = links of every line containing any, by line text
+        self.dangling = links to missing pages currently highlighted, None
+                      if the syntax has been set up afresh
     """
 
     id = None
@@ -982,31 +4702,116 @@ class Buffer:
         self.iswp = iswp
         self.type = type
         self.page = []
-        vim.command('silent! buffer! ' + self.num)
-        vim.command('setlocal buftype=' + type)
-        vim.command('abbr <silent> close DWclose')
-        vim.command('abbr <silent> close! DWclose!')
-        vim.command('abbr <silent> quit DWquit')
-        vim.command('abbr <silent> quit! DWquit!')
-        vim.command('abbr <silent> q DWquit')
-        vim.command('abbr <silent> q! DWquit!')
-        vim.command('abbr <silent> qa DWquit')
-        vim.command('abbr <silent> qa! DWquit!')
+        self.saved = self.digest(self.page)
+        self.tick = None
+        self.need_save = False
+        self.ready = False
+        self.rev = None
+        self.links = {}
+        self.link_tick = None
+        self.dangling = None
+
+        # keep the buffer loaded while it is hidden, vim has no file to
+        # reload the text, syntax and mappings from
+        commands = [
+            'silent! buffer! ' + self.num,
+            'setlocal buftype=' + type + ' bufhidden=hide',
+            'abbr <silent> close DWclose',
+            'abbr <silent> close! DWclose!',
+            'abbr <silent> quit DWquit',
+            'abbr <silent> quit! DWquit!',
+            'abbr <silent> q DWquit',
+            'abbr <silent> q! DWquit!',
+            'abbr <silent> qa DWquit',
+            'abbr <silent> qa! DWquit!',
+        ]
 
         if type == 'nofile':
-            vim.command('setlocal nobuflisted')
-            vim.command('setlocal nomodifiable')
-            vim.command('setlocal noswapfile')
-            vim.command("setlocal statusline=%{'[" + self.name + "]'}")
+            commands.append('setlocal nobuflisted nomodifiable noswapfile')
+            commands.append("setlocal statusline=%{'[" + self.name + "]'}%=%{get(g:,'DokuVimKi_STATUS','')}")
 
         if type == 'acwrite':
             self.diff = {}
-            self.need_save = False
-            vim.command('autocmd! BufEnter <buffer> Py dokuvimki.buffer_enter("' + self.name + '")')
-            vim.command('autocmd! BufLeave <buffer> Py dokuvimki.buffer_leave("' + self.name + '")')
-            vim.command('autocmd! BufDelete <buffer> Py dokuvimki.close("%s")' % name)
-            vim.command("setlocal statusline=%{'[wp]\ " + self.name + "'}\ %r\ [%c,%l][%p]")
+            commands.append('autocmd! BufEnter <buffer> Py dokuvimki.buffer_enter("' + self.name + '")')
+            commands.append('autocmd! BufLeave <buffer> Py dokuvimki.buffer_leave("' + self.name + '")')
+            commands.append('autocmd! BufDelete <buffer> Py dokuvimki.buffer_deleted("%s")' % name)
+            commands.append("setlocal statusline=%{'[wp]\ " + self.name + "'}\ %r\ [%c,%l][%p]%=%{get(g:,'DokuVimKi_STATUS','')}")
 
         if type == 'nowrite':
             self.diff = {}
-            vim.command("setlocal statusline=%{'[wp]\ " + self.name + "'}\ %r\ [%c,%l][%p%%]")
+            commands.append("setlocal statusline=%{'[wp]\ " + self.name + "'}\ %r\ [%c,%l][%p%%]%=%{get(g:,'DokuVimKi_STATUS','')}")
+
+        vim_commands(commands)
+
+    def setup(self, commands):
+        """
+        Runs the commands setting up the buffer, e.g. its syntax and
+        mappings, unless they have been run for this buffer already. The
+        buffer has to be the current one.
+        """
+
+        if not self.ready:
+            vim_commands(commands)
+            self.ready = True
+
+    @staticmethod
+    def digest(lines):
+        """
+        Returns a digest of a text given as lines, ignoring leading and
+        trailing whitespace.
+        """
+        return hashlib.md5(u("\n".join(lines).strip()).encode('utf-8')).hexdigest()
+
+    def changedtick(self):
+        """
+        Returns b:changedtick of the buffer, which vim increments on every
+        change of the buffer.
+        """
+        return int(vim.eval('getbufvar(%s, "changedtick")' % self.num))
+
+    def reset(self, lines):
+        """
+        Shows the text of the page as stored on the remote wiki in the buffer.
+        """
+
+        self.page[:] = lines
+        self.saved = self.digest(lines)
+        self.need_save = False
+        self.buf[:] = lines
+        self.buf.options['modified'] = False
+        self.tick = self.changedtick()
+
+    def update(self, lines):
+        """
+        Shows a text which hasn't been saved yet, like the result of a merge,
+        in the buffer.
+        """
+
+        self.page[:] = lines
+        self.need_save = self.digest(lines) != self.saved
+        self.buf[:] = lines
+        self.buf.options['modified'] = True
+        self.tick = self.changedtick()
+
+    def sync(self):
+        """
+        Takes over the text of the buffer and checks whether it differs from
+        the remote wiki, but only if it has changed since the last sync.
+        """
+
+        tick = self.changedtick()
+        if tick != self.tick:
+            self.page[:] = self.buf[:]
+            self.need_save = self.digest(self.page) != self.saved
+            self.tick = tick
+
+    def set_lines(self, lines, start=0):
+        """
+        Replaces the contents of the buffer from line start (counted from 0)
+        on, even if it isn't modifiable or not shown in the current window.
+        """
+
+        modifiable = self.buf.options['modifiable']
+        self.buf.options['modifiable'] = True
+        self.buf[start:] = lines
+        self.buf.options['modifiable'] = modifiable
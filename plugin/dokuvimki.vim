@@ -34,7 +34,7 @@ elseif has('python')
 endif
 
 if (has('python3') || has('python')) && version > 700
-  command! -nargs=0 DokuVimKi exec('Py dokuvimki = DokuVimKi()')
+  command! -nargs=0 DokuVimKi call s:DokuVimKi()
 
   if !exists('g:DokuVimKi_INDEX_WINWIDTH')
     let g:DokuVimKi_INDEX_WINWIDTH=30
@@ -48,9 +48,127 @@ if (has('python3') || has('python')) && version > 700
     let g:DokuVimKi_HTTP_BASIC_AUTH=''
   endif
 
+  if !exists('g:DokuVimKi_CACHE_DIR')
+    let g:DokuVimKi_CACHE_DIR = (empty($XDG_CACHE_HOME) ? '~/.cache' : $XDG_CACHE_HOME) . '/dokuvimki'
+  endif
+
+  if !exists('g:DokuVimKi_INDEX_MAX_AGE')
+    let g:DokuVimKi_INDEX_MAX_AGE=6
+  endif
+
+  if !exists('g:DokuVimKi_CACHE_SIZE')
+    let g:DokuVimKi_CACHE_SIZE=50
+  endif
+
+  if !exists('g:DokuVimKi_CACHE_MAX_AGE')
+    let g:DokuVimKi_CACHE_MAX_AGE=30
+  endif
+
+  if !exists('g:DokuVimKi_PREFETCH_REVISIONS')
+    let g:DokuVimKi_PREFETCH_REVISIONS=5
+  endif
+
+  if !exists('g:DokuVimKi_PREFETCH_PAGES')
+    let g:DokuVimKi_PREFETCH_PAGES=10
+  endif
+
+  if !exists('g:DokuVimKi_PREFETCH_RATE')
+    let g:DokuVimKi_PREFETCH_RATE=512
+  endif
+
+  if !exists('g:DokuVimKi_COMPLETE_MAX')
+    let g:DokuVimKi_COMPLETE_MAX=100
+  endif
+
+  if !exists('g:DokuVimKi_COMPLETE_FUZZY')
+    let g:DokuVimKi_COMPLETE_FUZZY=0
+  endif
+
+  if !exists('g:DokuVimKi_ASYNC')
+    let g:DokuVimKi_ASYNC=1
+  endif
+
+  if !exists('g:DokuVimKi_POLL_INTERVAL')
+    let g:DokuVimKi_POLL_INTERVAL=50
+  endif
+
+  if !exists('g:DokuVimKi_TIMEOUT')
+    let g:DokuVimKi_TIMEOUT=30
+  endif
+
+  if !exists('g:DokuVimKi_COMPRESS')
+    let g:DokuVimKi_COMPRESS=0
+  endif
+
+  if !exists('g:DokuVimKi_OFFLINE')
+    let g:DokuVimKi_OFFLINE=0
+  endif
+
+  if !exists('g:DokuVimKi_LOCK_INTERVAL')
+    let g:DokuVimKi_LOCK_INTERVAL=600
+  endif
+
+  if !exists('g:DokuVimKi_UNLOCKED_NS')
+    let g:DokuVimKi_UNLOCKED_NS=''
+  endif
+
+  if !exists('g:DokuVimKi_LINK_CHECK')
+    let g:DokuVimKi_LINK_CHECK=1
+  endif
+
+  if !exists('g:DokuVimKi_CHANGES_INTERVAL')
+    let g:DokuVimKi_CHANGES_INTERVAL=300
+  endif
+
+  if !exists('g:DokuVimKi_TRACE_FILE')
+    let g:DokuVimKi_TRACE_FILE=''
+  endif
+
+  if !exists('g:DokuVimKi_SEARCH_PAGE_SIZE')
+    let g:DokuVimKi_SEARCH_PAGE_SIZE=50
+  endif
+
+  if !exists('g:DokuVimKi_SEARCH_LOCAL')
+    let g:DokuVimKi_SEARCH_LOCAL=0
+  endif
+
+  if !exists('g:DokuVimKi_UPLOAD_THREADS')
+    let g:DokuVimKi_UPLOAD_THREADS=4
+  endif
+
+  if !exists('g:DokuVimKi_UPLOAD_MEMORY')
+    let g:DokuVimKi_UPLOAD_MEMORY=64
+  endif
+
+  " Calls a method of the running DokuVimKi instance and returns the result
+  fun! DokuVimKiCall(method, ...)
+    let expr = 'dokuvimki.' . a:method . '(*vim.eval("a:000"))'
+    return has('python3') ? py3eval(expr) : pyeval(expr)
+  endfun
+
+  " Timer callback delivering the results of background requests
+  fun! DokuVimKiPoll(timer)
+    Py dokuvimki.poll()
+  endfun
+
+  " Timer callback retrying the uploads of pending saves
+  fun! DokuVimKiFlush(timer)
+    Py dokuvimki.flush()
+  endfun
+
+  " Timer callback syncing with the recent changes of the remote wiki
+  fun! DokuVimKiRefresh(timer)
+    Py dokuvimki.poll_changes()
+  endfun
+
+  " Timer callback renewing the locks of the open pages
+  fun! DokuVimKiRenewLocks(timer)
+    Py dokuvimki.renew_locks()
+  endfun
+
   " Custom autocompletion function for wiki pages and media files
-  " the global g:pages g:media variables are set/refreshed
-  " when the index is loaded
+  " the candidates are looked up in the page index of the running
+  " DokuVimKi instance
   fun! InsertModeComplete(findstart, base)
     if a:findstart
       " locate the start of the page/media link
@@ -67,34 +185,14 @@ if (has('python3') || has('python')) && version > 700
       return start
     else
       " find matching pages/media
-      let res = []
-      if g:comp =~ "pages"
-        for m in split(g:pages)
-          if m =~ '^' . a:base
-            call add(res, m)
-          endif
-        endfor
-      elseif g:comp =~ "media"
-        for m in split(g:media)
-          if m =~ '^' . a:base
-            call add(res, m)
-          endif
-        endfor
-      endif
-      return res
+      return DokuVimKiCall('complete', g:comp, a:base)
     endif
   endfun
 
   " Custom autocompletion function for namespaces and pages in
   " normal mode. Used with DWedit
   fun! CmdModeComplete(ArgLead, CmdLine, CursorPos)
-    let res = []
-    for m in split(g:pages)
-      if m =~ '^' . a:ArgLead
-        call add(res, m)
-      endif
-    endfor
-    return res
+    return DokuVimKiCall('complete', 'pages', a:ArgLead)
   endfun
 
   " Inserts a headline
@@ -113,7 +211,15 @@ if (has('python3') || has('python')) && version > 700
     return ''
   endfun
 
-  exe "Pyfile " . escape(s:plugin_path, ' ') . "/dokuvimki.py"
+  " The python part is only loaded when DokuVimKi is started, so the plugin
+  " doesn't slow down starting vim
+  fun! s:DokuVimKi()
+    if !exists('s:loaded')
+      exe "Pyfile " . escape(s:plugin_path, ' ') . "/dokuvimki.py"
+      let s:loaded = 1
+    endif
+    Py dokuvimki = DokuVimKi()
+  endfun
 else
   command! -nargs=0 DokuVimKi echoerr "DokuVimKi disabled! Python support missing or vim version not supported."
 endif